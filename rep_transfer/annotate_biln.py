@@ -0,0 +1,72 @@
+"""Adds the BILN of every molecule to the datasets that have SMILES but no
+BILN, so that monomer-level representations, e.g., pepfunn, can be computed
+for them.
+
+    python rep_transfer/annotate_biln.py nc-antiviral nc-antibacterial
+
+Only the rows without a BILN are converted, and the results are cached in
+the download cache, so the annotation can be interrupted and run again.
+"""
+import os
+import os.path as osp
+
+from multiprocessing import cpu_count
+from typing import List
+
+import pandas as pd
+import typer
+
+from utils.downloads import CACHE_DIR
+from utils.smiles_biln import annotate_biln, cache_path
+
+
+DATA_DIR = osp.join(osp.dirname(__file__), '..', 'downstream_data')
+
+
+def annotate_csv(path: str, cache_dir: str = CACHE_DIR,
+                 n_jobs: int = cpu_count(), timeout: float = 120.,
+                 retry_failed: bool = False) -> int:
+    """Fills in the `BILN` column of the CSV at `path`. Returns the number
+    of rows that are still without one."""
+    df = pd.read_csv(path)
+    df['BILN'] = df['BILN'].astype(object) if 'BILN' in df.columns \
+        else None
+    missing = df['BILN'].isna() & df['SMILES'].notna()
+    if not missing.any():
+        return int(df['BILN'].isna().sum())
+
+    converted = annotate_biln(df.loc[missing, 'SMILES'].tolist(),
+                              cache_path(cache_dir), n_jobs, timeout,
+                              retry_failed)
+    df.loc[missing, 'BILN'] = [biln for biln, _ in converted]
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return int(df['BILN'].isna().sum())
+
+
+def main(
+    datasets: List[str] = typer.Argument(None),
+    data_dir: str = DATA_DIR,
+    cache_dir: str = CACHE_DIR,
+    n_jobs: int = cpu_count(),
+    timeout: float = typer.Option(
+        120., help='Seconds after which a molecule is abandoned.'),
+    retry_failed: bool = typer.Option(
+        False, help='Convert again the molecules that failed or timed out '
+                    'in a previous run.')
+):
+    if not datasets:
+        datasets = sorted(f[:-4] for f in os.listdir(data_dir)
+                          if f.endswith('.csv') and
+                          'SMILES' in pd.read_csv(osp.join(data_dir, f),
+                                                  nrows=0).columns)
+    for dataset in datasets:
+        path = osp.join(data_dir, f'{dataset}.csv')
+        n_missing = annotate_csv(path, cache_dir, n_jobs, timeout,
+                                 retry_failed)
+        print(f'{dataset}: {n_missing} molecules without BILN.')
+
+
+if __name__ == '__main__':
+    typer.run(main)
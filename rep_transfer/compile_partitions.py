@@ -0,0 +1,23 @@
+import os
+import os.path as osp
+
+from typing import List
+
+import typer
+
+from utils.partition_index import PARTITION_DIR, compile_partitions
+
+
+def main(datasets: List[str] = typer.Argument(None)):
+    if not datasets:
+        datasets = sorted(f[:-3] for f in os.listdir(PARTITION_DIR)
+                          if f.endswith('.gz'))
+    for dataset in datasets:
+        entry = compile_partitions(dataset)
+        size = osp.getsize(osp.join(PARTITION_DIR, f'{dataset}.npz'))
+        print(f"{dataset}: {len(entry['thresholds'])} thresholds, "
+              f"{size / 1e6:.2f} MB")
+
+
+if __name__ == '__main__':
+    typer.run(main)
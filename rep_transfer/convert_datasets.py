@@ -0,0 +1,28 @@
+import os
+import os.path as osp
+
+from typing import List
+
+import typer
+
+from utils.peptide_dataset import DATA_DIR, convert_csv, load_dataset
+
+
+def main(datasets: List[str] = typer.Argument(None),
+         data_dir: str = DATA_DIR):
+    """Converts the CSV files in `downstream_data/` into the canonical
+    Parquet format of `utils/peptide_dataset.py`."""
+    if not datasets:
+        datasets = sorted(f[:-4] for f in os.listdir(data_dir)
+                          if f.endswith('.csv') and
+                          not f.endswith('_errors.csv'))
+    for dataset in datasets:
+        path = convert_csv(dataset, data_dir)
+        df = load_dataset(dataset, ['biln', 'n_heavy_atoms'], data_dir)
+        print(f"{dataset}: {len(df)} peptides, {df['biln'].notna().sum()} "
+              f"with BILN, {df['n_heavy_atoms'].isna().sum()} not parsed, "
+              f"{osp.getsize(path) / 1e6:.2f} MB")
+
+
+if __name__ == '__main__':
+    typer.run(main)
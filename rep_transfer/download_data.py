@@ -2,26 +2,46 @@ import os
 import os.path as osp
 import urllib.error
 import pkg_resources
-import shutil
 import time
 import urllib
-import urllib.request as request
-import zipfile
+
+from functools import lru_cache
 
 import pandas as pd
 import typer
 
-import datamol as dm
 import rdkit.Chem as Chem
-from rdkit.Chem import rdmolfiles
 from pyPept.converter import Converter
-from pepfunn.sequence import peptideFromSMILES
-from pqdm.processes import pqdm
+
+from utils.biln import BILNConverter
+from utils.downloads import CACHE_DIR, ChecksumError, fetch, fetch_all, unpack
+from utils.pdb_smiles import cache_path as pdb_cache_path
+from utils.peptide_dataset import convert_csv
+from utils.pdb_smiles import convert_pdb_files
+from utils.smiles_biln import annotate_biln
+from utils.smiles_biln import cache_path as biln_cache_path
 
 
 SPECIAL_1 = ['ac-', 'deca-', 'glyco-', 'medl-', 'Mono21-', 'Mono22-']
 SPECIAL_2 = ['-pip']
 MONOMERS = SPECIAL_1 + SPECIAL_2
+PEPLAND_URL = 'https://raw.githubusercontent.com/zhangruochi/pepland/master/data/eval'
+ANTIMPMOD_URL = 'https://webs.iiitd.edu.in/raghava/antimpmod'
+ANTIMPMOD_FILES = ['pos_train', 'neg_train', 'pos_test', 'neg_test']
+SOURCES = {
+    'nc-antiviral': 'https://prod-dcd-datasets-cache-zipfiles.s3.eu-west-1.amazonaws.com/2zhgy9ggdv-2.zip',
+    # Shared by c-antiviral and c-antibacterial.
+    'peptidebenchmarks': 'https://drive.google.com/u/0/uc?id=1UmDu773CdkBFqkitK550uO6zoxhU1bUB&export=download',
+    'c-cpp': f'{PEPLAND_URL}/c-CPP.txt',
+    'nc-cpp': f'{PEPLAND_URL}/nc-CPP.csv',
+    'c-binding': f'{PEPLAND_URL}/c-binding.csv',
+    'nc-binding': f'{PEPLAND_URL}/nc-binding.csv',
+    **{f'nc-antibacterial-{file}': f'{ANTIMPMOD_URL}/{file}.zip'
+       for file in ANTIMPMOD_FILES}
+}
+# `fetch` raises `ConnectionError` and `TimeoutError` as they are, not as
+# `URLError`s.
+DOWNLOAD_ERRORS = (urllib.error.URLError, ChecksumError, OSError)
 CANONICAL = {
     "ALA": "A", "ASP": "D", "GLU": "E", "PHE": "F", "HIS": "H",
     "ILE": "I", "LYS": "K", "LEU": "L", "MET": "M", "GLY": "G",
@@ -39,21 +59,19 @@ def is_canonical(sequence: str):
     return True
 
 
+def biln_converter() -> BILNConverter:
+    """Converter for the current `MONOMERS`, which `prepare_resources`
+    extends."""
+    return _biln_converter(tuple(MONOMERS))
+
+
+@lru_cache(maxsize=None)
+def _biln_converter(monomers: tuple) -> BILNConverter:
+    return BILNConverter(list(monomers), SPECIAL_1, SPECIAL_2, CANONICAL)
+
+
 def pepseqres2biln(biln: str) -> str:
-    new_biln = biln
-    for monomer in MONOMERS:
-        monomer = monomer
-        if (f'-{monomer}-' in biln or f'({monomer}-' in biln or
-           f'-{monomer}(' in biln):
-            new_biln = new_biln.replace(monomer, f'[{monomer}]')
-        elif monomer in SPECIAL_1 and f'{monomer}-' in biln:
-            new_biln = new_biln.replace(monomer, f'[{monomer}]')
-        elif monomer in SPECIAL_2 and f'-{monomer}' in biln:
-            new_biln = new_biln.replace(monomer, f'[{monomer}]')
-
-    for monomer in CANONICAL:
-        new_biln = new_biln.replace(monomer, CANONICAL[monomer])
-    return new_biln
+    return biln_converter().pepseqres2biln(biln)
 
 
 def prepare_resources():
@@ -82,32 +100,29 @@ def fasta2smiles(seq: str) -> str:
 
 
 def fasta2biln(seq: str) -> str:
-    biln = '-'.join(seq)
-    new_biln = biln
-    for monomer in MONOMERS:
-        monomer = monomer
-
-        if (f'-{monomer}-' in biln or f'({monomer}-' in biln or
-           f'-{monomer}(' in biln):
-            new_biln = new_biln.replace(monomer, f'[{monomer}]')
-        elif monomer in SPECIAL_1 and f'{monomer}-' in biln:
-            new_biln = new_biln.replace(monomer, f'[{monomer}]')
-        elif monomer in SPECIAL_2 and f'-{monomer}' in biln:
-            new_biln = new_biln.replace(monomer, f'[{monomer}]')
-        elif monomer in CANONICAL:
-            new_biln = new_biln.replace(monomer, CANONICAL[monomer])
-    for monomer in CANONICAL:
-        new_biln = new_biln.replace(monomer, CANONICAL[monomer])
-
-    return new_biln
-
-
-def download_downstream_data(data_path: str) -> None:
+    return biln_converter().fasta2biln(seq)
+
+
+def smiles2biln(smiles: pd.Series, cache_dir: str = CACHE_DIR) -> pd.Series:
+    """BILN of every SMILES, or `None` for the molecules that pepfunn
+    cannot convert in time."""
+    converted = annotate_biln(smiles.tolist(), biln_cache_path(cache_dir))
+    return pd.Series([biln for biln, _ in converted], index=smiles.index,
+                     dtype=object)
+
+
+def download_downstream_data(data_path: str, cache_dir: str = CACHE_DIR,
+                             n_jobs: int = 8) -> None:
     """
     Download the downstream data for the project.
 
+    All source files are first fetched concurrently into the download
+    cache, so that building the datasets does not wait for the network.
+
     Args:
         data_path (str): The path where the data will be downloaded.
+        cache_dir (str): The directory of the download cache.
+        n_jobs (int): The number of concurrent downloads.
 
     Returns:
         None
@@ -118,75 +133,80 @@ def download_downstream_data(data_path: str) -> None:
     else:
         os.makedirs(data_path)
 
+    print('Fetching source files...')
+    for name, path in fetch_all(SOURCES, cache_dir, n_jobs).items():
+        if isinstance(path, Exception):
+            print(f'Warning: could not download {name}: {path}')
+
     print('Downloading Canonical Cell Penetration dataset...')
-    status = download_c_cpp(data_path)
+    status = download_c_cpp(data_path, cache_dir)
     if status:
         print('Canonical Cell Penetration dataset downloaded succesfully!')
     else:
         print('There has been a problem with the download, omitting.')
 
     print('Downloading Non-canonical Cell Penetration dataset...')
-    status = download_nc_cpp(data_path)
+    status = download_nc_cpp(data_path, cache_dir)
     if status:
         print('Non-canonical Cell Penetration dataset downloaded succesfully!')
     else:
         print('There has been a problem with the download, omitting.')
 
     print('Downloading Canonical binding dataset...')
-    status = download_c_binding(data_path)
+    status = download_c_binding(data_path, cache_dir)
     if status:
         print('Canonical binding dataset downloaded succesfully!')
     else:
         print('There has been a problem with the download, omitting.')
 
     print('Downloading Non-canonical binding dataset...')
-    status = download_nc_binding(data_path)
+    status = download_nc_binding(data_path, cache_dir)
     if status:
         print('Non-canonical binding dataset downloaded succesfully!')
     else:
         print('There has been a problem with the download, omitting.')
 
     print('Downloading Non-canonical Antiviral dataset...')
-    status = download_nc_antiviral(data_path)
+    status = download_nc_antiviral(data_path, cache_dir)
     if status:
         print('Non-canonical antiviral dataset downloaded succesfully!')
     else:
         print('There has been a problem with the download, omitting.')
 
     print("Downloading Canonical Antiviral...")
-    status = download_c_antiviral(data_path)
+    status = download_c_antiviral(data_path, cache_dir)
     if status:
         print("Canonical Antiviral dataset downloaded succesfully!")
     else:
         print("There has been a problem with the download, omitting.")
 
     print('Downloading Non-canonical Antibacterial dataset...')
-    status = download_nc_antibacterial(data_path)
+    status = download_nc_antibacterial(data_path, cache_dir)
     if status:
         print('Non-canonical antimicrobial dataset downloaded succesfully!')
     else:
         print('There has been a problem with the download, omitting.')
 
     print("Downloading Canonical Antibacterial...")
-    status = download_c_antibacterial(data_path)
+    status = download_c_antibacterial(data_path, cache_dir)
     if status:
         print("Canonical Antimicrobial dataset downloaded succesfully!")
     else:
         print("There has been a problem with the download, omitting.")
 
+    print('Converting the datasets into the canonical Parquet format...')
+    for file in sorted(os.listdir(data_path)):
+        if file.endswith('.csv') and not file.endswith('_errors.csv'):
+            convert_csv(file[:-len('.csv')], data_path)
+
 
-def download_nc_antiviral(data_path: str) -> bool:
-    url = 'https://prod-dcd-datasets-cache-zipfiles.s3.eu-west-1.amazonaws.com/2zhgy9ggdv-2.zip'
-    tmp_path = osp.join(data_path, 'PharmaPeptides.zip')
-    extracted_path = osp.join(data_path, "Database of Peptides with Potential for Pharmacological Intervention in Human Pathogen Molecular Targets")
+def download_nc_antiviral(data_path: str, cache_dir: str = CACHE_DIR) -> bool:
     out_path = osp.join(data_path, 'nc-antiviral.csv')
     try:
-        request.urlretrieve(url, tmp_path)
-    except urllib.error.URLError:
+        archive = fetch(SOURCES['nc-antiviral'], cache_dir=cache_dir)
+    except DOWNLOAD_ERRORS:
         return False
-    with zipfile.ZipFile(tmp_path, 'r') as zip_ref:
-        zip_ref.extractall(data_path)
-    os.remove(tmp_path)
+    extracted_path = osp.join(unpack(archive, cache_dir, 'zip'), "Database of Peptides with Potential for Pharmacological Intervention in Human Pathogen Molecular Targets")
     positive = []
     negative = []
     subdirs = ['Antiparasitic peptides', 'Antifungal peptides', 'Antibacterial peptides', 'Antiviral peptides']
@@ -203,37 +223,30 @@ def download_nc_antiviral(data_path: str) -> bool:
                 positive.append({
                     'SMILES': txt,
                     'labels': 1})
-    shutil.rmtree(extracted_path)
     df_pos = pd.DataFrame(positive)
     df_neg = pd.DataFrame(negative).sample(len(df_pos), replace=False,
                                            random_state=1)
     df = pd.concat([df_pos, df_neg])
-    smiles = df['SMILES']
-    # df['BILN'] = pqdm(smiles, peptideFromSMILES, n_jobs=10,
-    #                   exception_behaviour='immediate')
+    df['BILN'] = smiles2biln(df['SMILES'], cache_dir)
     df.to_csv(out_path, index=False)
     return True
 
 
-def download_c_antiviral(data_path: str) -> bool:
-    tmp_path = osp.join(data_path, 'peptidebenchmarks.tar.gz')
-    tmp_dir = osp.join(data_path, 'PeptideBenchmarks')
-    url = "https://drive.google.com/u/0/uc?id=1UmDu773CdkBFqkitK550uO6zoxhU1bUB&export=download"
+def download_c_antiviral(data_path: str, cache_dir: str = CACHE_DIR) -> bool:
     try:
-        request.urlretrieve(url, tmp_path)
-    except urllib.error.URLError:
+        archive = fetch(SOURCES['peptidebenchmarks'], cache_dir=cache_dir)
+    except DOWNLOAD_ERRORS:
         return False
-    shutil.unpack_archive(tmp_path, data_path)
-    os.remove(tmp_path)
+    tmp_dir = osp.join(unpack(archive, cache_dir, 'gztar'),
+                       'PeptideBenchmarks')
     df1 = pd.read_csv(osp.join(tmp_dir, 'AV', 'splits', 'train.csv'))
     df1 = df1.drop_duplicates('sequence')
     df2 = pd.read_csv(osp.join(tmp_dir, 'AV', 'splits', 'test.csv'))
     df2 = df2.drop_duplicates('sequence')
     df = pd.concat([df1, df2])
     df['SMILES'] = df.sequence.map(fasta2smiles)
-    df['BILN'] = df.sequence.map(fasta2biln)
+    df['BILN'] = biln_converter().fasta2biln_series(df.sequence)
     df['labels'] = df.Y
-    shutil.rmtree(tmp_dir)
     print(len(df))
     df = df[df.sequence.map(len) <= 50]
     print(len(df))
@@ -241,25 +254,21 @@ def download_c_antiviral(data_path: str) -> bool:
     return True
 
 
-def download_c_antibacterial(data_path: str) -> bool:
-    tmp_path = osp.join(data_path, 'peptidebenchmarks.tar.gz')
-    tmp_dir = osp.join(data_path, 'PeptideBenchmarks')
-    url = "https://drive.google.com/u/0/uc?id=1UmDu773CdkBFqkitK550uO6zoxhU1bUB&export=download"
+def download_c_antibacterial(data_path: str, cache_dir: str = CACHE_DIR) -> bool:
     try:
-        request.urlretrieve(url, tmp_path)
-    except urllib.error.URLError:
+        archive = fetch(SOURCES['peptidebenchmarks'], cache_dir=cache_dir)
+    except DOWNLOAD_ERRORS:
         return False
-    shutil.unpack_archive(tmp_path, data_path)
-    os.remove(tmp_path)
+    tmp_dir = osp.join(unpack(archive, cache_dir, 'gztar'),
+                       'PeptideBenchmarks')
     df1 = pd.read_csv(osp.join(tmp_dir, 'AB', 'splits', 'train.csv'))
     df1 = df1.drop_duplicates('sequence')
     df2 = pd.read_csv(osp.join(tmp_dir, 'AB', 'splits', 'test.csv'))
     df2 = df2.drop_duplicates('sequence')
     df = pd.concat([df1, df2])
     df['SMILES'] = df.sequence.map(fasta2smiles)
-    df['BILN'] = df.sequence.map(fasta2biln)
+    df['BILN'] = biln_converter().fasta2biln_series(df.sequence)
     df['labels'] = df.Y
-    shutil.rmtree(tmp_dir)
     print(len(df))
     df = df[df.sequence.map(len) <= 50]
     print(len(df))
@@ -267,57 +276,53 @@ def download_c_antibacterial(data_path: str) -> bool:
     return True
 
 
-def download_nc_antibacterial(data_path: str) -> bool:
+def download_nc_antibacterial(data_path: str, cache_dir: str = CACHE_DIR) -> bool:
     out_path = osp.join(data_path, 'nc-antibacterial.csv')
     proto_df = []
-    url = 'https://webs.iiitd.edu.in/raghava/antimpmod'
-    for file in ['pos_train', 'neg_train', 'pos_test', 'neg_test']:
-        d_url = f'{url}/{file}.zip'
-        filepath = osp.join(data_path, f'{file}.zip')
-
+    pdb_paths = []
+    for file in ANTIMPMOD_FILES:
         try:
-            request.urlretrieve(d_url, filepath)
-        except urllib.error.URLError:
+            archive = fetch(SOURCES[f'nc-antibacterial-{file}'],
+                            cache_dir=cache_dir)
+        except DOWNLOAD_ERRORS:
             return False
-        with zipfile.ZipFile(filepath, 'r') as zip_ref:
-            zip_ref.extractall(data_path)
-        os.remove(filepath)
-        extracted = osp.join(data_path, file)
-        dm.disable_rdkit_log()
+        extracted = osp.join(unpack(archive, cache_dir, 'zip'), file)
 
         for pdb_file in os.listdir(extracted):
-            mol = rdmolfiles.MolFromPDBFile(
-                osp.join(extracted, pdb_file), sanitize=False, removeHs=False
-            )
-            mol = dm.fix_mol(mol)
-            mol = dm.fix_valence(mol)
-            mol = dm.remove_hs(mol)
-            if mol is None:
-                raise ValueError(f"File: {file} has not generated a valid molecule.")
-
+            pdb_paths.append(osp.join(extracted, pdb_file))
             proto_df.append({
-                'SMILES': dm.to_smiles(mol),
                 'labels': 1 if 'pos' in file else 0,
                 'original_split': 1 if 'test' in file else 0,
             })
-        shutil.rmtree(extracted)
-    df = pd.DataFrame(proto_df)
-    # smiles = df['SMILES']
-    # df['BILN'] = pqdm(smiles, peptideFromSMILES, n_jobs=10,
-    #                   exception_behaviour='immediate')
+
+    converted = convert_pdb_files(pdb_paths, pdb_cache_path(cache_dir))
+    errors = []
+    for path, row, (smiles, error) in zip(pdb_paths, proto_df, converted):
+        row['SMILES'] = smiles
+        if error is not None:
+            errors.append({'file': osp.relpath(path, cache_dir),
+                           'error': error})
+    if errors:
+        print(f'Warning: {len(errors)} PDB files have not generated a valid '
+              f'molecule and are omitted, see {out_path[:-4]}_errors.csv.')
+        pd.DataFrame(errors).to_csv(f'{out_path[:-4]}_errors.csv',
+                                    index=False)
+    proto_df = [row for row, (smiles, _) in zip(proto_df, converted)
+                if smiles is not None]
+    df = pd.DataFrame(proto_df)[['SMILES', 'labels', 'original_split']]
+    df['BILN'] = smiles2biln(df['SMILES'], cache_dir)
     df.to_csv(out_path)
     return True
 
 
-def download_c_cpp(data_path: str) -> bool:
+def download_c_cpp(data_path: str, cache_dir: str = CACHE_DIR) -> bool:
     out_path = osp.join(data_path, 'c-cpp.csv')
-    url = 'https://raw.githubusercontent.com/zhangruochi/pepland/master/data/eval/c-CPP.txt'
     try:
-        request.urlretrieve(url, out_path)
-    except urllib.error.URLError:
+        source = fetch(SOURCES['c-cpp'], cache_dir=cache_dir)
+    except DOWNLOAD_ERRORS:
         return False
-    df = pd.read_csv(out_path, header=None, names=['sequence', 'labels'])
-    df['BILN'] = df['sequence'].apply(fasta2biln)
+    df = pd.read_csv(source, header=None, names=['sequence', 'labels'])
+    df['BILN'] = biln_converter().fasta2biln_series(df['sequence'])
     df['SMILES'] = df['sequence'].apply(fasta2smiles)
     df = df[df.sequence.map(is_canonical)]
     df = df.dropna().reset_index(drop=True)
@@ -325,14 +330,13 @@ def download_c_cpp(data_path: str) -> bool:
     return True
 
 
-def download_nc_cpp(data_path: str) -> bool:
+def download_nc_cpp(data_path: str, cache_dir: str = CACHE_DIR) -> bool:
     out_path = osp.join(data_path, 'nc-cpp.csv')
-    url = 'https://raw.githubusercontent.com/zhangruochi/pepland/master/data/eval/nc-CPP.csv'
     try:
-        request.urlretrieve(url, out_path)
-    except urllib.error.URLError:
+        source = fetch(SOURCES['nc-cpp'], cache_dir=cache_dir)
+    except DOWNLOAD_ERRORS:
         return False
-    df = pd.read_csv(out_path)
+    df = pd.read_csv(source)
     df['labels'] = df['PAMPA']
     neg_df = df[df.labels < -9.5].copy()
     neg_df['labels'] = 0
@@ -340,22 +344,24 @@ def download_nc_cpp(data_path: str) -> bool:
     pos_df['labels'] = 1
     df = pd.concat([neg_df, pos_df])
     df = df[['SMILES', 'HELM', 'labels']]
-    df['BILN'] = df['SMILES'].map(peptideFromSMILES)
-    df.dropna(inplace=True)
+    df = df.dropna()
+    # Molecules that pepfunn cannot convert keep an empty BILN, as dropping
+    # them would shift the rows that the partitions refer to.
+    df['BILN'] = smiles2biln(df['SMILES'], cache_dir)
     df.to_csv(out_path, index=False)
     return True
 
 
-def download_nc_binding(data_path: str) -> bool:
+def download_nc_binding(data_path: str, cache_dir: str = CACHE_DIR) -> bool:
     out_path = osp.join(data_path, 'nc-binding.csv')
-    url = "https://raw.githubusercontent.com/zhangruochi/pepland/master/data/eval/nc-binding.csv"
     try:
-        request.urlretrieve(url, out_path)
-    except urllib.error.URLError:
+        source = fetch(SOURCES['nc-binding'], cache_dir=cache_dir)
+    except DOWNLOAD_ERRORS:
         return False
-    df = pd.read_csv(out_path)
+    df = pd.read_csv(source)
     df['SMILES'] = df['Merge_SMILES']
-    df['BILN'] = df['pep_SEQRES'].apply(pepseqres2biln)
+    df['BILN'] = biln_converter().pepseqres2biln_series(
+        df['pep_SEQRES'])
     df['labels'] = df['affinity']
     df = df[['seq1', 'SMILES', 'BILN', 'labels']]
     df.dropna(inplace=True)
@@ -363,16 +369,16 @@ def download_nc_binding(data_path: str) -> bool:
     return True
 
 
-def download_c_binding(data_path: str) -> bool:
+def download_c_binding(data_path: str, cache_dir: str = CACHE_DIR) -> bool:
     out_path = osp.join(data_path, 'c-binding.csv')
-    url = "https://raw.githubusercontent.com/zhangruochi/pepland/master/data/eval/c-binding.csv"
     try:
-        request.urlretrieve(url, out_path)
-    except urllib.error.URLError:
+        source = fetch(SOURCES['c-binding'], cache_dir=cache_dir)
+    except DOWNLOAD_ERRORS:
         return False
-    df = pd.read_csv(out_path)
+    df = pd.read_csv(source)
     df['SMILES'] = df['Merge_SMILES']
-    df['BILN'] = df['pep_SEQRES'].apply(pepseqres2biln)
+    df['BILN'] = biln_converter().pepseqres2biln_series(
+        df['pep_SEQRES'])
     df['labels'] = df['affinity']
     df = df[df['BILN'].map(lambda x:  max([len(a) for a in x.split('-')]) == 1)]
     df['sequence'] = df['BILN'].map(lambda x: ''.join(x.split('-')))
@@ -3,7 +3,7 @@ import yaml
 import os
 import os.path as osp
 
-from typing import Tuple
+from typing import TYPE_CHECKING, Iterable, Iterator, Tuple, Union
 
 import numpy as np
 import optuna
@@ -11,9 +11,15 @@ import pandas as pd
 import typer
 
 
-from autopeptideml.train import (OptunaTrainer, evaluate)
-from autopeptideml.utils import format_numbers
-from hestia import HestiaGenerator
+from metrics import evaluate
+from utils.artifacts import save_artifact
+from utils.journal import (append_unit, compact, completed_units,
+                           journal_path, unit_key)
+from utils.results_db import write_results
+from utils.partition_index import PartitionIndex
+
+if TYPE_CHECKING:
+    from autopeptideml.train.architectures import VotingEnsemble
 
 
 REGRESSION_TASKS = ['binding']
@@ -21,7 +27,10 @@ CLASSIFICATION_TASKS = ['cpp', 'antibacterial', 'antiviral']
 TASKS = REGRESSION_TASKS + CLASSIFICATION_TASKS
 
 
-def define_hpspace(model: str, pred_task: str) -> Tuple[dict, dict]:
+def define_hpspace(model: str, pred_task: str,
+                   n_jobs: int = 10) -> Tuple[dict, dict]:
+    from autopeptideml.utils import format_numbers
+
     cwd = os.path.abspath(os.path.dirname(__file__))
     path = os.path.join(cwd, 'h_param_search',
                         f'{model}_{pred_task}.yml')
@@ -39,13 +48,18 @@ def define_hpspace(model: str, pred_task: str) -> Tuple[dict, dict]:
     }
     optim_strategy = {'task': pred_task, 'direction': 'maximize',
                       'metric': 'mcc' if pred_task == 'class' else 'spcc',
-                      'patience': 20, 'n_steps': 100, 'n_jobs': 10}
+                      'patience': 20, 'n_steps': 100, 'n_jobs': n_jobs}
     return hpspace, optim_strategy
 
 
 def hpo(pred_task: str, model_name: str, train_x: np.ndarray,
-        train_y: np.ndarray, seed: int) -> dict:
-    hpspace, optim_strategy = define_hpspace(model_name, pred_task)
+        train_y: np.ndarray, seed: int,
+        n_jobs: int = 10) -> Tuple['VotingEnsemble', list]:
+    # autopeptideml imports hestia, which only the fallback of
+    # `load_thresholds` needs otherwise.
+    from autopeptideml.train import OptunaTrainer
+
+    hpspace, optim_strategy = define_hpspace(model_name, pred_task, n_jobs)
     trainer = OptunaTrainer(task=pred_task)
     trainer.hpo(
         x={'default': train_x},
@@ -53,98 +67,150 @@ def hpo(pred_task: str, model_name: str, train_x: np.ndarray,
         models=[model_name],
         n_folds=5,
         n_trials=100,
-        n_jobs=10,
+        n_jobs=n_jobs,
         random_state=seed,
         verbose=3,
         custom_hpspace=hpspace
     )
-    return trainer.best_model
+    return trainer.best_model, trainer.best_config
 
 
-def experiment(dataset: str, model: str, representation: str,
-               df: pd.DataFrame, hdg: HestiaGenerator, seed: int = 1):
-    np.random.seed(seed)
-
+def get_pred_task(dataset: str) -> str:
     if dataset.split('-')[1] in REGRESSION_TASKS:
-        pred_task = 'reg'
+        return 'reg'
     elif dataset.split('-')[1] in CLASSIFICATION_TASKS:
-        pred_task = 'class'
+        return 'class'
+    raise ValueError(
+        f"Dataset: {dataset} not in tasks: {', '.join(TASKS)}")
+
 
+def load_representation(dataset: str, representation: str) -> np.ndarray:
     x = np.array(pickle.load(
-        open(osp.join('reps', f'{representation}_{dataset}.pickle'), 'rb')))
-    y = df.labels.to_numpy()
-    results = []
+        open(osp.join(osp.dirname(__file__), '..', 'reps',
+                      f'{representation}_{dataset}.pickle'), 'rb')))
 
     if dataset.split('-')[1] == 'binding':
         x = np.concatenate([x, np.stack(pickle.load(
             open(osp.join(osp.dirname(__file__), '..', 'reps',
             f"binding-{dataset.split('-')[0]}-targets.pickle"), 'rb')
         ))], axis=1)
+    return x
+
+
+def _keep_threshold(th: Union[float, str]) -> bool:
+    if not isinstance(th, str):
+        if not ((th * 100) % 10 == 0):
+            return False
+    return True
+
+
+def load_thresholds(dataset: str, df: pd.DataFrame
+                    ) -> Iterator[Tuple[Union[float, str], dict]]:
+    """Yields the partitions of each threshold as it is reached, so that
+    only the arrays of the threshold being run are mapped."""
+    if PartitionIndex.exists(dataset):
+        index = PartitionIndex(dataset)
+        if not index.check_data():
+            print(f'Warning: downstream_data/{dataset}.csv differs from the '
+                  'data the partition index was compiled for.')
+        for th in index.thresholds(filter=0.185):
+            if _keep_threshold(th):
+                yield th, index.get(th)
+        return
+
+    from hestia import HestiaGenerator
 
+    part_path = os.path.join(
+        os.path.dirname(__file__), '..', 'partitions', f"{dataset}.gz"
+    )
+    if not os.path.exists(part_path):
+        raise NotImplementedError("Please make sure you have downloaded the official partitions.")
+    hdg = HestiaGenerator(df)
+    hdg.from_precalculated(part_path)
     for th, partitions in hdg.get_partitions(filter=0.185):
-        if not isinstance(th, str):
-            if not ((th * 100) % 10 == 0):
-                continue
-        print("THRESHOLD:", th)
+        if _keep_threshold(th):
+            yield th, partitions
 
-        train_idx = partitions['train']
-        train_idx = train_idx + partitions['valid']
-        test_idx = partitions['test']
 
-        train_x, train_y = x[train_idx], y[train_idx]
-        test_x, test_y = x[test_idx], y[test_idx]
+def run_threshold(pred_task: str, model: str, x: np.ndarray, y: np.ndarray,
+                  partitions: dict, seed: int, n_jobs: int = 10,
+                  results_path: str = None, unit: dict = None,
+                  save_model: bool = False) -> dict:
+    train_idx = np.concatenate([partitions['train'], partitions['valid']])
+    test_idx = np.asarray(partitions['test'])
+
+    train_x, train_y = x[train_idx], y[train_idx]
+    test_x, test_y = x[test_idx], y[test_idx]
+
+    best_model, best_config = hpo(pred_task, model, train_x, train_y, seed,
+                                  n_jobs)
+    if pred_task == 'class':
+        preds = best_model.predict_proba({'default': test_x})[0]
+        preds = preds[:, 1]
+    else:
+        preds = best_model.predict({'default': test_x})[0]
 
-        best_model = hpo(pred_task, model, train_x, train_y, seed)
-        if pred_task == 'class':
-            preds = best_model.predict_proba({'default': test_x})[0]
-            preds = preds[:, 1]
-        else:
-            preds = best_model.predict({'default': test_x})[0]
+    if results_path is not None:
+        save_artifact(results_path, unit, pred_task, preds, test_y,
+                      test_idx=test_idx, params=best_config,
+                      model=best_model if save_model else None)
+    return evaluate(preds, test_y, pred_task=pred_task)
+
+
+def experiment(dataset: str, model: str, representation: str,
+               df: pd.DataFrame, thresholds: Iterable, seed: int = 1,
+               n_jobs: int = 10, journal: str = None,
+               results_path: str = None, save_model: bool = False):
+    np.random.seed(seed)
+    pred_task = get_pred_task(dataset)
+    x = load_representation(dataset, representation)
+    y = df.labels.to_numpy()
+    results = []
+    done = completed_units(journal) if journal is not None else set()
 
-        result = evaluate(preds, test_y, pred_task=pred_task)
+    for th_idx, (th, partitions) in enumerate(thresholds):
+        unit = {'seed': seed, 'threshold': th}
+        if unit_key(unit) in done:
+            continue
+        print("THRESHOLD:", th)
+        result = run_threshold(pred_task, model, x, y, partitions, seed,
+                               n_jobs, results_path, unit, save_model)
         result['seed'] = seed
         result['threshold'] = th
         results.append(result)
+        if journal is not None:
+            append_unit(journal, unit, [result], order=[seed, th_idx])
 
     result_df = pd.DataFrame(results)
     return result_df
 
 
+def get_results_path(dataset: str, model: str, representation: str) -> str:
+    results_dir = os.path.join(
+        os.path.dirname(__file__), '..',
+        'Results', 'no-generalisation',
+    )
+    os.makedirs(results_dir, exist_ok=True)
+    return os.path.join(
+        results_dir,
+        f"{dataset}_{model}_pre_0.0_post_0.0_{representation}.csv"
+    )
+
+
 def main(dataset: str, model: str, representation: str,
-         n_trials: int = 200, n_seeds: int = 5):
+         n_trials: int = 200, n_seeds: int = 5, n_jobs: int = 10,
+         save_model: bool = False):
 
-    part_dir = os.path.join(
-        os.path.dirname(__file__), '..', 'partitions'
-    )
     data_path = os.path.join(
         os.path.dirname(__file__), '..', 'downstream_data'
     )
-    part_path = os.path.join(
-        part_dir, f"{dataset}.gz"
-    )
-    os.makedirs(part_dir, exist_ok=True)
-
     df = pd.read_csv(os.path.join(data_path, f'{dataset}.csv'))
     df['name'] = dataset
 
-    if os.path.exists(part_path):
-        hdg = HestiaGenerator(df)
-        hdg.from_precalculated(part_path)
-    else:
-        raise NotImplementedError("Please make sure you have downloaded the official partitions.")
-
     optuna.logging.set_verbosity(optuna.logging.CRITICAL)
-    results_dir = os.path.join(
-        os.path.dirname(__file__), '..',
-        'Results', 'no-generalisation',
-    )
-    results_path = os.path.join(
-        results_dir,
-        f"{dataset}_{model}_pre_0.0_post_0.0_{representation}.csv"
-    )
-    os.makedirs(results_dir, exist_ok=True)
+    results_path = get_results_path(dataset, model, representation)
+    journal = journal_path(results_path)
 
-    results_df = pd.DataFrame()
     for i in range(n_seeds):
         print("SEED:", i)
         result_df = experiment(
@@ -152,12 +218,16 @@ def main(dataset: str, model: str, representation: str,
             model=model,
             representation=representation,
             df=df,
-            hdg=hdg,
-            seed=i
+            thresholds=load_thresholds(dataset, df),
+            seed=i,
+            n_jobs=n_jobs,
+            journal=journal,
+            results_path=results_path,
+            save_model=save_model
         )
-        results_df = pd.concat([results_df, result_df])
-        print(results_df.head(10))
-    results_df.to_csv(results_path, index=False)
+        print(result_df.head(10))
+    results_df = compact(journal, results_path)
+    write_results(results_df, results_path)
 
 
 if __name__ == '__main__':
@@ -3,22 +3,30 @@ import yaml
 import os
 import os.path as osp
 
-from typing import Tuple
+from typing import Dict, Tuple
 
 import numpy as np
 import optuna
 import pandas as pd
 import typer
 
-from autopeptideml.train import (OptunaTrainer, evaluate)
+from autopeptideml.train import OptunaTrainer
+from autopeptideml.train.architectures import VotingEnsemble
 from autopeptideml.utils import format_numbers
+from metrics import evaluate
+
+from utils.artifacts import save_artifact
+from utils.journal import (append_unit, compact, completed_units,
+                           journal_path, unit_key)
+from utils.results_db import write_results
 
 REGRESSION_TASKS = ['binding']
 CLASSIFICATION_TASKS = ['cpp', 'antibacterial', 'antiviral']
 TASKS = REGRESSION_TASKS + CLASSIFICATION_TASKS
 
 
-def define_hpspace(model: str, pred_task: str) -> Tuple[dict, dict]:
+def define_hpspace(model: str, pred_task: str,
+                   n_jobs: int = 10) -> Tuple[dict, dict]:
     cwd = os.path.abspath(os.path.dirname(__file__))
     path = os.path.join(cwd, 'h_param_search',
                         f'{model}_{pred_task}.yml')
@@ -36,13 +44,14 @@ def define_hpspace(model: str, pred_task: str) -> Tuple[dict, dict]:
     }
     optim_strategy = {'task': pred_task, 'direction': 'maximize',
                       'metric': 'mcc' if pred_task == 'class' else 'spcc',
-                      'patience': 20, 'n_steps': 100, 'n_jobs': 10}
+                      'patience': 20, 'n_steps': 100, 'n_jobs': n_jobs}
     return hpspace, optim_strategy
 
 
 def hpo(pred_task: str, model_name: str, train_x: np.ndarray,
-        train_y: np.ndarray, seed: int) -> dict:
-    hpspace, optim_strategy = define_hpspace(model_name, pred_task)
+        train_y: np.ndarray, seed: int,
+        n_jobs: int = 10) -> Tuple[VotingEnsemble, list]:
+    hpspace, optim_strategy = define_hpspace(model_name, pred_task, n_jobs)
     trainer = OptunaTrainer(task=pred_task)
     trainer.hpo(
         x={'default': train_x},
@@ -50,27 +59,25 @@ def hpo(pred_task: str, model_name: str, train_x: np.ndarray,
         models=[model_name],
         n_folds=5,
         n_trials=100,
-        n_jobs=10,
+        n_jobs=n_jobs,
         random_state=seed,
         verbose=3,
         custom_hpspace=hpspace
     )
-    return trainer.best_model
-
+    return trainer.best_model, trainer.best_config
 
-def experiment(dataset: str, model: str, representation: str,
-               train_set: str, df_c: pd.DataFrame, df_nc: pd.DataFrame,
-               seed: int = 1):
-    np.random.seed(seed)
 
+def get_pred_task(dataset: str) -> str:
     if dataset in REGRESSION_TASKS:
-        pred_task = 'reg'
+        return 'reg'
     elif dataset in CLASSIFICATION_TASKS:
-        pred_task = 'class'
-    else:
-        raise ValueError(
-            f"Dataset: {dataset} not in tasks: {', '.join(TASKS)}")
+        return 'class'
+    raise ValueError(
+        f"Dataset: {dataset} not in tasks: {', '.join(TASKS)}")
 
+
+def load_representations(dataset: str,
+                         representation: str) -> Dict[str, np.ndarray]:
     x_type = {}
     for s in ['c', 'nc']:
         x_type[s] = []
@@ -94,6 +101,19 @@ def experiment(dataset: str, model: str, representation: str,
         x_type['nc'] = np.concatenate([x_type['nc'], np.stack(pickle.load(
             open(osp.join(osp.dirname(__file__), '..', 'reps', 'binding-nc-targets.pickle'), 'rb')
         ))], axis=1)
+    return x_type
+
+
+def experiment(dataset: str, model: str, representation: str,
+               train_set: str, df_c: pd.DataFrame, df_nc: pd.DataFrame,
+               seed: int = 1, n_jobs: int = 10,
+               x_type: Dict[str, np.ndarray] = None,
+               results_path: str = None, save_model: bool = False):
+    np.random.seed(seed)
+    pred_task = get_pred_task(dataset)
+
+    if x_type is None:
+        x_type = load_representations(dataset, representation)
 
     y_c = df_c.labels.to_numpy()
     y_nc = df_nc.labels.to_numpy()
@@ -109,9 +129,10 @@ def experiment(dataset: str, model: str, representation: str,
     else:
         print(f"Type does not exist: {train_set}")
 
-    best_model = hpo(pred_task, model, train_x, train_y, seed)
+    best_model, best_config = hpo(pred_task, model, train_x, train_y, seed,
+                                  n_jobs)
 
-    results = []
+    results, all_preds = [], []
     for idx, model in enumerate(best_model.models):
         if pred_task == 'class':
             preds = model.predict_proba(test_x)
@@ -121,13 +142,34 @@ def experiment(dataset: str, model: str, representation: str,
         result = evaluate(preds, test_y, pred_task=pred_task)
         result['seed'] = seed + idx
         results.append(result)
+        all_preds.append(preds)
+
+    if results_path is not None:
+        save_artifact(results_path, {'seed': seed}, pred_task,
+                      np.stack(all_preds), test_y,
+                      seeds=[r['seed'] for r in results], params=best_config,
+                      model=best_model if save_model else None)
 
     result_df = pd.DataFrame(results)
     return result_df
 
 
+def get_results_path(dataset: str, model: str, representation: str,
+                     train_set: str) -> str:
+    results_dir = os.path.join(
+        os.path.dirname(__file__), '..',
+        'Results', train_set
+    )
+    os.makedirs(results_dir, exist_ok=True)
+    return os.path.join(
+        results_dir,
+        f'{dataset}_{model}_{representation}.csv'
+    )
+
+
 def main(dataset: str, model: str, representation: str,
-         train_set: str = 'standard', n_seeds: int = 25):
+         train_set: str = 'standard', n_seeds: int = 25, n_jobs: int = 10,
+         save_model: bool = False):
 
     data_path = os.path.join(
         os.path.dirname(__file__), '..', 'downstream_data'
@@ -138,25 +180,25 @@ def main(dataset: str, model: str, representation: str,
     df_nc['name'] = dataset
 
     optuna.logging.set_verbosity(optuna.logging.CRITICAL)
-    results_dir = os.path.join(
-        os.path.dirname(__file__), '..',
-        'Results', train_set
-    )
-    results_path = os.path.join(
-        results_dir,
-        f'{dataset}_{model}_{representation}.csv'
-    )
-    os.makedirs(results_dir, exist_ok=True)
+    results_path = get_results_path(dataset, model, representation,
+                                    train_set)
+    journal = journal_path(results_path)
+    done = completed_units(journal)
+    x_type = load_representations(dataset, representation)
 
-    results_df = pd.DataFrame()
     for i in range(n_seeds):
+        if unit_key({'seed': i}) in done:
+            continue
         print("SEED:", i)
         result_df = experiment(
             dataset, model, representation,
-            train_set, df_c, df_nc, i
+            train_set, df_c, df_nc, i, n_jobs, x_type,
+            results_path, save_model
         )
-        results_df = pd.concat([results_df, result_df])
-    results_df.to_csv(results_path, index=False)
+        append_unit(journal, {'seed': i}, result_df.to_dict('records'),
+                    order=[i])
+    results_df = compact(journal, results_path)
+    write_results(results_df, results_path)
     print(results_df.head())
 
 
@@ -0,0 +1,211 @@
+"""Runs the benchmark grid of `scheduler.py` on several nodes that share a
+filesystem, through the work queue in `utils/work_queue.py`.
+
+    python rep_transfer/grid_queue.py submit --rep ecfp --model lightgbm
+    python rep_transfer/grid_queue.py work --workers 4     # on every node
+    python rep_transfer/grid_queue.py status
+    python rep_transfer/grid_queue.py collect              # on one node
+
+Every worker appends the results of its jobs to its own shard of the
+journal of their results file, as `flock` is not reliable over NFS, and
+rebuilds the CSV from all the shards once every job of that file is done.
+`collect` writes the finished CSVs into `Results/results.db`, which, as any
+SQLite database, should not be written from several nodes over NFS.
+"""
+import json
+import os
+import os.path as osp
+import socket
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import cpu_count
+from typing import List
+
+import typer
+
+from scheduler import (DATASETS, EXPERIMENTS, _init_worker, _results_path,
+                       _unit, expand_grid, run_job)
+from utils.artifacts import artifact_name
+from utils.journal import (append_unit, compact, completed_units,
+                           journal_path, shard_path, unit_key)
+from utils.results_db import write_results
+from utils.work_queue import WorkQueue, format_exception
+
+
+ROOT = osp.join(osp.dirname(__file__), '..')
+QUEUE_DIR = osp.join(ROOT, 'Results', '.queue')
+
+app = typer.Typer()
+
+
+def job_name(job: dict) -> str:
+    return '_'.join([job['experiment'], job['dataset'], job['model'],
+                     job['rep'], artifact_name(_unit(job))])
+
+
+def _manifest_path(queue_dir: str, results_path: str) -> str:
+    return osp.join(queue_dir, 'files',
+                    f'{osp.basename(osp.dirname(results_path))}_'
+                    f'{osp.splitext(osp.basename(results_path))[0]}.json')
+
+
+def _write_manifests(queue_dir: str, jobs: List[dict]):
+    """Records the units that make up every results file, so that workers
+    know when a file is complete."""
+    os.makedirs(osp.join(queue_dir, 'files'), exist_ok=True)
+    units = {}
+    for job in jobs:
+        units.setdefault(_results_path(job), []).append(_unit(job))
+    for results_path, file_units in units.items():
+        path = _manifest_path(queue_dir, results_path)
+        manifest = {'results_path': osp.relpath(results_path, ROOT),
+                    'units': []}
+        if osp.exists(path):
+            manifest = json.load(open(path))
+        known = set(unit_key(unit) for unit in manifest['units'])
+        manifest['units'] += [unit for unit in file_units
+                              if unit_key(unit) not in known]
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        json.dump(manifest, open(tmp_path, 'w'))
+        os.replace(tmp_path, path)
+
+
+def _read_manifests(queue_dir: str) -> List[dict]:
+    files_dir = osp.join(queue_dir, 'files')
+    if not osp.isdir(files_dir):
+        return []
+    return [json.load(open(osp.join(files_dir, f)))
+            for f in sorted(os.listdir(files_dir)) if f.endswith('.json')]
+
+
+def _is_complete(manifest: dict) -> bool:
+    journal = journal_path(osp.join(ROOT, manifest['results_path']))
+    done = completed_units(journal)
+    return all(unit_key(unit) in done for unit in manifest['units'])
+
+
+@app.command()
+def submit(
+    rep: List[str] = typer.Option(..., help='Representation(s) to evaluate.'),
+    model: List[str] = typer.Option(..., help='Model(s) to evaluate.'),
+    dataset: List[str] = typer.Option(DATASETS, help='Datasets to use.'),
+    experiment: List[str] = typer.Option(EXPERIMENTS),
+    train_set: List[str] = typer.Option(['standard']),
+    n_seeds: int = 5,
+    n_seeds_ood: int = 25,
+    queue_dir: str = QUEUE_DIR,
+    retry_failed: bool = False
+):
+    """Adds the jobs of the grid that are neither queued nor already in
+    the journals, longest first."""
+    queue = WorkQueue(queue_dir)
+    if retry_failed:
+        print(f'{queue.retry_failed()} failed jobs queued again.')
+    jobs = expand_grid(rep, model, dataset, experiment, train_set,
+                       n_seeds, n_seeds_ood)
+    _write_manifests(queue_dir, jobs)
+    done = {}
+    pending = []
+    for job in jobs:
+        path = _results_path(job)
+        if path not in done:
+            done[path] = completed_units(journal_path(path))
+        if unit_key(_unit(job)) not in done[path]:
+            pending.append(job)
+    added = queue.submit(pending, [job_name(job) for job in pending])
+    print(f'{len(jobs) - len(pending)} jobs already completed, {added} '
+          f'added to the queue, {len(pending) - added} already queued.')
+
+
+def _work(queue_dir: str, worker: str, cores: int, save_model: bool,
+          heartbeat: float, lease: float, wait: bool) -> int:
+    queue = WorkQueue(queue_dir, lease=lease)
+    n_done = 0
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            if wait and queue.counts()['leased'] > 0:
+                time.sleep(heartbeat)
+                continue
+            return n_done
+        job = claimed.job
+        claimed.start_heartbeat(heartbeat)
+        print(f"{worker}: {claimed.filename}")
+        try:
+            rows = run_job(job, cores, save_model)
+        except Exception as e:
+            claimed.fail(format_exception(e))
+            print(f'{worker}: {claimed.filename} failed: {e}')
+            continue
+
+        results_path = _results_path(job)
+        journal = journal_path(results_path)
+        append_unit(shard_path(journal, worker), _unit(job), rows,
+                    order=list(job['order']))
+        if not claimed.complete():
+            print(f'Warning: lease of {claimed.filename} expired before it '
+                  'was completed.')
+        n_done += 1
+        manifest = json.load(open(_manifest_path(queue_dir, results_path)))
+        if _is_complete(manifest):
+            compact(journal, results_path)
+
+
+@app.command()
+def work(
+    workers: int = typer.Option(1, help='Jobs run at the same time.'),
+    cores: int = cpu_count(),
+    queue_dir: str = QUEUE_DIR,
+    save_model: bool = False,
+    heartbeat: float = 60.,
+    lease: float = 900.,
+    wait: bool = typer.Option(
+        False, help='Wait for the jobs leased by other workers, which are '
+                    'queued again if their lease expires.')
+):
+    """Runs queued jobs until the queue is empty."""
+    host = f'{socket.gethostname()}-{os.getpid()}'
+    names = [f'{host}-{idx}' for idx in range(workers)]
+    work_fn = partial(_work, queue_dir, cores=max(cores // workers, 1),
+                      save_model=save_model, heartbeat=heartbeat,
+                      lease=lease, wait=wait)
+    if workers == 1:
+        n_done = work_fn(names[0])
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker) as pool:
+            n_done = sum(pool.map(work_fn, names))
+    print(f'{n_done} jobs done.')
+
+
+@app.command()
+def status(queue_dir: str = QUEUE_DIR):
+    queue = WorkQueue(queue_dir)
+    print(', '.join(f'{state}: {count}'
+                    for state, count in queue.counts().items()))
+    for job in queue.failed():
+        error = job.get('error', '').strip().splitlines()
+        print(f"Failed: {job['name']} ({job['attempts']} attempts): "
+              f"{error[-1] if error else ''}")
+
+
+@app.command()
+def collect(queue_dir: str = QUEUE_DIR):
+    """Rebuilds the CSV of every complete results file from the journal
+    shards of the workers and writes it into the results database."""
+    n_complete = 0
+    for manifest in _read_manifests(queue_dir):
+        results_path = osp.join(ROOT, manifest['results_path'])
+        if not _is_complete(manifest):
+            continue
+        write_results(compact(journal_path(results_path), results_path),
+                      results_path)
+        n_complete += 1
+    print(f'{n_complete} of {len(_read_manifests(queue_dir))} results files '
+          'complete.')
+
+
+if __name__ == '__main__':
+    app()
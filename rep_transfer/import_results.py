@@ -0,0 +1,13 @@
+import typer
+
+from utils.results_db import DB_PATH, RESULTS_DIR, import_results
+
+
+def main(results_dir: str = RESULTS_DIR, db_path: str = DB_PATH,
+         force: bool = False):
+    imported = import_results(results_dir, db_path, force)
+    print(f'Imported {len(imported)} results files into {db_path}.')
+
+
+if __name__ == '__main__':
+    typer.run(main)
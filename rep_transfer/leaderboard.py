@@ -0,0 +1,312 @@
+"""Builds the leaderboards in the README from `Results/results.db`.
+
+The statistics of every group of results (one representation, model and
+dataset) and every pairwise significance test are cached in the results
+database, keyed by a hash of the scores they were computed from, and of the
+splits they were obtained on for the paired tests. Adding a representation,
+or rerunning one, only computes the statistics that involve the groups
+whose scores changed.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import typer
+
+from scipy.stats import f as f_dist
+from scipy.stats import kruskal, studentized_range
+
+from utils.results_db import DB_PATH, connect, import_results, load_results
+from utils.significance import (cached_pairwise_wilcoxon, fingerprint,
+                                significance_clusters)
+
+
+DATASET_NAMES = {
+    'antibacterial': 'Antibacterial',
+    'antiviral': 'Antiviral',
+    'cpp': 'Cell penetration',
+    'binding': 'Protein-peptide binding affinity',
+}
+REP_NAMES = {
+    'esm2-8m': 'ESM2 8M',
+    'esm2-150m': 'ESM2 150M',
+    'esm2-650m': 'ESM2 650M',
+    'prot-t5-xl': 'Prot-T5-XL',
+    'protbert': 'ProtBERT',
+    'molformer': 'Molformer-XL',
+    'chemberta': 'ChemBERTa-2',
+    'chemberta-3': 'ChemBERTa-3',
+    'pepfunn': 'PepFuNN',
+    'ecfp': 'ECFP-16',
+    'ecfp-count': 'ECFP-16 counts',
+    'pepclm': 'PeptideCLM',
+    'pepland': 'Pepland',
+    'avalonfp': 'Avalon FP',
+}
+REGRESSION_DATASETS = ['binding']
+# Columns that identify the split a score was obtained on. Rows that share
+# them, e.g., the fold models of a seed in `evaluation_ood.py`, are told
+# apart by their position within the results file.
+SCORE_KEYS = ['dataset', 'seed', 'threshold']
+# name: (title, experiment, dataset prefix, test)
+TABLES = {
+    'interpolation-standard': (
+        'Interpolation standard to standard peptides',
+        'no-generalisation', 'c-', 'wilcoxon'),
+    'interpolation-modified': (
+        'Interpolation modified to modified peptides',
+        'no-generalisation', 'nc-', 'wilcoxon'),
+    'extrapolation': (
+        'Standard to modified extrapolation',
+        'standard', '', 'tukey'),
+}
+COLUMNS = list(DATASET_NAMES.values()) + ['Average', 'Significant rank']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS group_stats (
+    fingerprint TEXT PRIMARY KEY,
+    n INTEGER,
+    mean REAL,
+    m2 REAL
+);
+CREATE TABLE IF NOT EXISTS pairwise_tests (
+    fingerprint1 TEXT,
+    fingerprint2 TEXT,
+    test TEXT,
+    pvalue REAL,
+    PRIMARY KEY (fingerprint1, fingerprint2, test)
+);
+"""
+
+
+class StatsCache:
+    """Group statistics and pairwise p-values keyed by the fingerprints of
+    the scores they were computed from."""
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self.group_stats, self.pvalues = {}, {}
+        self.new_stats, self.new_pvalues = [], []
+        with connect(db_path) as conn:
+            conn.executescript(_SCHEMA)
+            for fp, n, mean, m2 in conn.execute(
+                'SELECT fingerprint, n, mean, m2 FROM group_stats'
+            ):
+                self.group_stats[fp] = (n, mean, m2)
+            for fp1, fp2, test, pvalue in conn.execute(
+                'SELECT fingerprint1, fingerprint2, test, pvalue '
+                'FROM pairwise_tests'
+            ):
+                self.pvalues[(fp1, fp2, test)] = pvalue
+
+    def stats(self, fp: str, values: np.ndarray) -> Tuple[int, float, float]:
+        if fp not in self.group_stats:
+            mean = float(np.mean(values))
+            stats = (len(values), mean, float(((values - mean) ** 2).sum()))
+            self.group_stats[fp] = stats
+            self.new_stats.append((fp, *stats))
+        return self.group_stats[fp]
+
+    def get_pvalue(self, key: Tuple[str, str, str]) -> Optional[float]:
+        return self.pvalues.get(key)
+
+    def set_pvalue(self, key: Tuple[str, str, str], pvalue: float):
+        self.pvalues[key] = pvalue
+        self.new_pvalues.append((*key, pvalue))
+
+    def save(self):
+        with connect(self.db_path) as conn:
+            conn.executemany('INSERT OR REPLACE INTO group_stats '
+                             'VALUES (?, ?, ?, ?)', self.new_stats)
+            conn.executemany('INSERT OR REPLACE INTO pairwise_tests '
+                             'VALUES (?, ?, ?, ?)', self.new_pvalues)
+        print(f'Computed {len(self.new_stats)} group statistics and '
+              f'{len(self.new_pvalues)} pairwise tests.')
+        self.new_stats, self.new_pvalues = [], []
+
+
+def _groups(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Every score of each representation, in the order of the results."""
+    return {rep: r_df['GOOD'].dropna().to_numpy()
+            for rep, r_df in df.groupby('rep', sort=True)}
+
+
+def wilcoxon_rank(df: pd.DataFrame, cache: StatsCache,
+                  alpha: float = 0.05) -> pd.DataFrame:
+    """Ranks groups by mean with Kruskal-Wallis and one-sided post-hoc
+    Wilcoxon tests with Bonferroni correction, which pair the scores
+    obtained on the same split, see `group_scores`. Groups that are not
+    significantly worse than the best group of their cluster share its
+    rank."""
+    groups = _groups(df)
+    names = sorted(groups)
+    fps = {name: fingerprint(groups[name]) for name in names}
+    stats = {name: cache.stats(fps[name], groups[name]) for name in names}
+    means = np.array([stats[name][1] for name in names])
+    sems = np.array([np.sqrt(stats[name][2] / stats[name][0]) /
+                     np.sqrt(stats[name][0]) for name in names])
+    order = np.argsort(means)[::-1]
+    names = [names[i] for i in order]
+
+    if kruskal(*[groups[name] for name in names])[1] > alpha:
+        rank = [1] * len(names)
+    else:
+        scores = group_scores(df)
+        n_partial = int(scores.isna().any(axis=1).sum())
+        if n_partial:
+            print(f'Warning: {n_partial} of {len(scores)} splits lack the '
+                  'scores of some groups, pairs are only compared on the '
+                  'splits they share.')
+        pvalues = cached_pairwise_wilcoxon(scores, cache, 'greater')
+        rank = significance_clusters(names, pvalues, alpha)
+
+    out_df = pd.DataFrame({
+        'Category': names,
+        'Mean': means[order],
+        'Error': sems[order],
+        'Significant rank': rank
+    })
+    return out_df.sort_values(by=['Significant rank', 'Mean'],
+                              ascending=[True, False])
+
+
+def tukey_rank(df: pd.DataFrame, cache: StatsCache,
+               alpha: float = 0.05) -> pd.DataFrame:
+    """Ranks groups by mean with ANOVA and the simultaneous confidence
+    intervals of Tukey's HSD test, computed from the cached statistics of
+    every score of each group."""
+    groups = _groups(df)
+    names = sorted(groups)
+    stats = np.array([cache.stats(fingerprint(groups[name]), groups[name])
+                      for name in names])
+    n, means, m2 = stats[:, 0], stats[:, 1], stats[:, 2]
+    k, n_total = len(names), n.sum()
+    df_within = n_total - k
+    var = m2.sum() / df_within
+
+    grand_mean = (n * means).sum() / n_total
+    ss_between = (n * (means - grand_mean) ** 2).sum()
+    f_value = (ss_between / (k - 1)) / var
+    significant = f_dist.sf(f_value, k - 1, df_within) <= alpha
+
+    # Simultaneous intervals for unequal group sizes, Hochberg & Tamhane
+    # (1987), eq. 3.32, as in `statsmodels`' `pairwise_tukeyhsd`.
+    q_crit = studentized_range.ppf(1 - alpha, k, df_within)
+    d = np.sqrt(var / n[:, None] + var / n[None, :])
+    np.fill_diagonal(d, 0)
+    if k > 2:
+        w = ((k - 1) * d.sum(axis=0) - d.sum() / 2) / ((k - 1) * (k - 2))
+    else:
+        w = np.full(k, d.sum() / 4)
+    ci = q_crit / np.sqrt(2) * w
+
+    order = np.argsort(means)[::-1]
+    means, ci = means[order], ci[order]
+    rank, rank_cluster = [1], [1]
+    for idx in range(1, k):
+        if (not significant or
+           means[idx] + ci[idx] >= means[rank_cluster[-1]] - ci[idx - 1]):
+            rank.append(rank[-1])
+            rank_cluster.append(rank_cluster[-1])
+        else:
+            rank.append(rank[-1] + 1)
+            rank_cluster.append(idx)
+
+    out_df = pd.DataFrame({
+        'Category': [names[i] for i in order],
+        'Mean': means,
+        'Error': ci,
+        'Significant rank': rank
+    })
+    return out_df.sort_values(by=['Significant rank', 'Mean'],
+                              ascending=[True, False])
+
+
+RANKING_TESTS = {'wilcoxon': wilcoxon_rank, 'tukey': tukey_rank}
+
+
+def get_scores(experiment: str, prefix: str, model: str,
+               reps: List[str], db_path: str = DB_PATH) -> pd.DataFrame:
+    df = load_results(experiment=experiment, model=model, db_path=db_path)
+    df = df[df['dataset'].str.startswith(prefix) & df['rep'].isin(reps)]
+    df = df[df['threshold'] != 'random'].copy()
+    df['task'] = df['dataset'].str[len(prefix):]
+    df['GOOD'] = np.where(df['task'].isin(REGRESSION_DATASETS),
+                          df.get('spcc', np.nan), df['mcc'])
+    return df
+
+
+def group_scores(df: pd.DataFrame) -> pd.DataFrame:
+    """Scores of each representation, one column each, on rows keyed by
+    `SCORE_KEYS` and the position among the rows of the representation
+    that share them, so that paired tests compare the scores obtained on
+    the same split whatever the order of the results files. Splits that a
+    representation was not evaluated on are NaN."""
+    keys = df[SCORE_KEYS].astype(str)
+    df = df.assign(**keys)
+    df['repeat'] = df.groupby(SCORE_KEYS + ['rep']).cumcount()
+    return df.pivot(index=SCORE_KEYS + ['repeat'], columns='rep',
+                    values='GOOD')
+
+
+def define_table(df: pd.DataFrame, test: str,
+                 cache: StatsCache) -> pd.DataFrame:
+    rank_fn = RANKING_TESTS[test]
+    results = {rep: {} for rep in df['rep'].unique()}
+
+    for task, t_df in df.groupby('task'):
+        for _, row in rank_fn(t_df, cache).iterrows():
+            results[row['Category']][DATASET_NAMES[task]] = \
+                f"{row['Mean']:.2f}±{row['Error']:.2f}"
+
+    global_df = rank_fn(df, cache)
+    for _, row in global_df.iterrows():
+        results[row['Category']]['Average'] = \
+            f"{row['Mean']:.2f}±{row['Error']:.2f}"
+        results[row['Category']]['Significant rank'] = \
+            row['Significant rank']
+
+    result_df = pd.DataFrame(results).transpose()
+    result_df = result_df.reindex(columns=COLUMNS)
+    result_df = result_df.loc[global_df['Category']]
+    result_df.index = [REP_NAMES.get(rep, rep) for rep in result_df.index]
+    return result_df
+
+
+def build_leaderboards(model: str, tables: List[str],
+                       reps: List[str],
+                       db_path: str = DB_PATH) -> Dict[str, pd.DataFrame]:
+    import_results(db_path=db_path)
+    cache = StatsCache(db_path)
+    leaderboards = {}
+    for name in tables:
+        _, experiment, prefix, test = TABLES[name]
+        df = get_scores(experiment, prefix, model, reps, db_path)
+        if len(df) == 0:
+            print(f'Warning: no results for {name} with {model}.')
+            continue
+        leaderboards[name] = define_table(df, test, cache)
+    cache.save()
+    return leaderboards
+
+
+def main(
+    model: str = 'lightgbm',
+    table: List[str] = typer.Option(list(TABLES), help='Tables to build.'),
+    rep: List[str] = typer.Option(list(REP_NAMES),
+                                  help='Representations to include.'),
+    output: Optional[str] = None
+):
+    leaderboards = build_leaderboards(model, table, rep)
+    markdown = []
+    for name, result_df in leaderboards.items():
+        markdown.append(f'### {TABLES[name][0]}\n\nResults with {model}.\n')
+        markdown.append(result_df.to_markdown() + '\n')
+    markdown = '\n'.join(markdown)
+    print(markdown)
+    if output is not None:
+        with open(output, 'w') as fo:
+            fo.write(markdown)
+
+
+if __name__ == '__main__':
+    typer.run(main)
@@ -1,13 +1,15 @@
 from collections import defaultdict
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
+import pandas as pd
 
 from scipy.stats import pearsonr, spearmanr
 from sklearn.metrics import (matthews_corrcoef,
                              accuracy_score, f1_score,
                              precision_score, recall_score, mean_squared_error,
-                             mean_absolute_error, roc_auc_score, r2_score)
+                             mean_absolute_error, roc_auc_score, r2_score,
+                             log_loss)
 
 
 def _pcc(preds, truths):
@@ -22,6 +24,10 @@ def _f1_weighted(preds, truths):
     return f1_score(preds, truths, average='weighted')
 
 
+def _log_loss(preds, truths):
+    return log_loss(truths, preds, normalize=True)
+
+
 def _recall(preds, truths):
     return recall_score(preds, truths, zero_division=True)
 
@@ -50,6 +56,7 @@ CLASSIFICATION_METRICS = {
     'precision': precision_score,
     'recall': _recall,
     'auroc': roc_auc_score,
+    'log_loss': _log_loss,
     'tp': _tp,
     'tn': _tn,
     'fp': _fp,
@@ -66,25 +73,222 @@ REGRESSION_METRICS = {
 }
 
 
-def evaluate(preds, truth, pred_task) -> Dict[str, float]:
-    result = {}
+# Upper bound on the number of elements of each (resamples x n) matrix
+# used by `bootstrap_evaluate`.
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 22
+
+
+def _resample_weights(n: int, n_samples: int) -> np.ndarray:
+    """Bootstrap resamples of `n` items as a (n_samples x n) matrix with the
+    number of times each item is drawn in each resample."""
+    indices = np.random.randint(0, n, size=(n_samples, n))
+    indices += np.arange(n_samples)[:, None] * n
+    counts = np.bincount(indices.ravel(), minlength=n_samples * n)
+    return counts.reshape(n_samples, n).astype(np.float64)
+
+
+def _safe_divide(num: np.ndarray, den: np.ndarray,
+                 default: float = 0.0) -> np.ndarray:
+    out = np.full(np.broadcast(num, den).shape, default, dtype=np.float64)
+    np.divide(num, den, out=out, where=den != 0)
+    return out
+
+
+def _weighted_sum(weights: np.ndarray, values: np.ndarray) -> np.ndarray:
+    if values.ndim == 1:
+        return weights @ values
+    return (weights * values).sum(axis=1)
+
+
+def _confusion_metrics(tp: np.ndarray, tn: np.ndarray, fp: np.ndarray,
+                       fn: np.ndarray) -> Dict[str, np.ndarray]:
+    """Classification metrics from (weighted) confusion matrix entries,
+    following the `zero_division` behaviour of the sklearn scorers."""
+    n = tp + tn + fp + fn
+    f1_pos = _safe_divide(2 * tp, 2 * tp + fp + fn)
+    f1_neg = _safe_divide(2 * tn, 2 * tn + fp + fn)
+    mcc_den = np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn))
+    # The `log_loss` of the published results, that of the predicted labels
+    # given the truth as probabilities, clipped to `eps`: every error costs
+    # -log(eps) and every hit -log(1 - eps). sklearn rejects predictions
+    # that are all of one class, which are reported as 0.
+    eps = np.finfo(np.float64).eps
+    loss = _safe_divide((tp + tn) * -np.log1p(-eps) +
+                        (fp + fn) * -np.log(eps), n)
+    loss = np.where((tp + fp == 0) | (tn + fn == 0), 0.0, loss)
+    return {
+        'mcc': _safe_divide(tp * tn - fp * fn, mcc_den),
+        'acc': _safe_divide(tp + tn, n),
+        'f1': f1_pos,
+        'f1_weighted': _safe_divide(f1_pos * (tp + fn) + f1_neg * (tn + fp),
+                                    n),
+        'precision': _safe_divide(tp, tp + fp),
+        'recall': _safe_divide(tp, tp + fn, default=1.0),
+        'log_loss': loss,
+    }
+
+
+def _weighted_confusion(weights: np.ndarray, labels: np.ndarray,
+                        truth: np.ndarray) -> Tuple[np.ndarray, ...]:
+    labels, truth = labels.astype(bool), truth.astype(bool)
+    tp = _weighted_sum(weights, labels & truth)
+    tn = _weighted_sum(weights, ~labels & ~truth)
+    fp = _weighted_sum(weights, labels & ~truth)
+    fn = _weighted_sum(weights, ~labels & truth)
+    return tp, tn, fp, fn
+
+
+def _tie_groups(values: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """Sorting order of every row of `values` and, for every sorted
+    position, the first and last position of its group of ties."""
+    order = np.argsort(values, axis=1, kind='mergesort')
+    sorted_values = np.take_along_axis(values, order, axis=1)
+    positions = np.arange(values.shape[1])
+    is_start = np.ones(values.shape, dtype=bool)
+    is_start[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    is_end = np.ones(values.shape, dtype=bool)
+    is_end[:, :-1] = is_start[:, 1:]
+    first = np.maximum.accumulate(np.where(is_start, positions, 0), axis=1)
+    last = np.where(is_end, positions, values.shape[1] - 1)
+    last = np.minimum.accumulate(last[:, ::-1], axis=1)[:, ::-1]
+    return order, first, last
+
+
+def _group_weights(sorted_weights: np.ndarray, first: np.ndarray,
+                   last: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Weight below and within the group of ties of every sorted
+    position."""
+    shape = sorted_weights.shape
+    first = np.broadcast_to(first, shape)
+    last = np.broadcast_to(last, shape)
+    cumulative = np.cumsum(sorted_weights, axis=1)
+    below = (np.take_along_axis(cumulative, first, axis=1) -
+             np.take_along_axis(sorted_weights, first, axis=1))
+    within = np.take_along_axis(cumulative, last, axis=1) - below
+    return below, within
+
+
+def _sort_rows(weights: np.ndarray, values: np.ndarray,
+               order: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.broadcast_to(order, weights.shape)
+    return (np.take_along_axis(weights, order, axis=1),
+            np.take_along_axis(np.broadcast_to(values, weights.shape),
+                               order, axis=1))
+
+
+def _weighted_auroc(weights: np.ndarray, scores: np.ndarray,
+                    truth: np.ndarray) -> np.ndarray:
+    """Mann-Whitney AUROC of every row of `weights`, with ties counted as
+    one half. NaN when one of the classes is missing."""
+    order, first, last = _tie_groups(np.atleast_2d(scores))
+    sorted_weights, sorted_truth = _sort_rows(
+        weights, np.atleast_2d(truth).astype(bool), order)
+    pos = sorted_weights * sorted_truth
+    neg = sorted_weights * ~sorted_truth
+    neg_below, neg_within = _group_weights(neg, first, last)
+    auc = (pos * (neg_below + 0.5 * neg_within)).sum(axis=1)
+    return _safe_divide(auc, pos.sum(axis=1) * neg.sum(axis=1),
+                        default=np.nan)
+
+
+def _weighted_midranks(weights: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Ranks, averaged over ties, that every item would have within each
+    row of `weights`."""
+    order, first, last = _tie_groups(np.atleast_2d(values))
+    order = np.broadcast_to(order, weights.shape)
+    below, within = _group_weights(np.take_along_axis(weights, order, axis=1),
+                                   first, last)
+    ranks = np.empty(weights.shape)
+    np.put_along_axis(ranks, order, below + (within + 1) / 2, axis=1)
+    return ranks
+
+
+def _weighted_pearson(weights: np.ndarray, x: np.ndarray,
+                      y: np.ndarray) -> np.ndarray:
+    total = weights.sum(axis=1, keepdims=True)
+    dx = x - _weighted_sum(weights, x)[:, None] / total
+    dy = y - _weighted_sum(weights, y)[:, None] / total
+    cov = (weights * dx * dy).sum(axis=1)
+    var = (weights * dx * dx).sum(axis=1) * (weights * dy * dy).sum(axis=1)
+    return _safe_divide(cov, np.sqrt(var), default=np.nan)
+
+
+def _classification_scores(weights: np.ndarray, preds: np.ndarray,
+                           truth: np.ndarray) -> Dict[str, np.ndarray]:
+    tp, tn, fp, fn = _weighted_confusion(weights, preds > 0.5, truth)
+    scores = _confusion_metrics(tp, tn, fp, fn)
+    scores['auroc'] = _weighted_auroc(weights, preds, truth)
+    scores.update({'tp': tp, 'tn': tn, 'fp': fp, 'fn': fn})
+    return scores
+
+
+def _regression_scores(weights: np.ndarray, preds: np.ndarray,
+                       truth: np.ndarray) -> Dict[str, np.ndarray]:
+    n = weights.sum(axis=1)
+    error = preds - truth
+    ss_res = _weighted_sum(weights, error ** 2)
+    truth_mean = _weighted_sum(weights, truth) / n
+    ss_tot = (weights * (truth - truth_mean[:, None]) ** 2).sum(axis=1)
+    r2 = np.where(ss_res == 0, 1.0, 0.0)
+    np.subtract(1, _safe_divide(ss_res, ss_tot), out=r2, where=ss_tot != 0)
+    return {
+        'mse': _safe_divide(ss_res, n, default=np.nan),
+        'mae': _safe_divide(_weighted_sum(weights, np.abs(error)), n,
+                            default=np.nan),
+        'pcc': _weighted_pearson(weights, preds, truth),
+        'spcc': _weighted_pearson(weights,
+                                  _weighted_midranks(weights, preds),
+                                  _weighted_midranks(weights, truth)),
+        'r2': r2
+    }
+
+
+def evaluate_batch(preds: List[np.ndarray], truth: List[np.ndarray],
+                   pred_task: str,
+                   metric_names: Optional[List[str]] = None) -> pd.DataFrame:
+    """Scores many prediction vectors, e.g., every seed and threshold of a
+    run, at once. Vectors of different lengths are padded and masked out.
+
+    :param preds: Prediction vectors, or a (runs x n) array.
+    :param truth: Ground truth for each vector, or a single vector shared
+        by all of them.
+    :return: One row with the metrics of `evaluate` per prediction vector.
+    """
     if pred_task == 'reg':
-        metrics = REGRESSION_METRICS
+        metrics, score_fn = REGRESSION_METRICS, _regression_scores
     else:
-        metrics = CLASSIFICATION_METRICS
-
-    for key, value in metrics.items():
-        if key in ['auroc'] or pred_task == 'reg':
-            t_pred = preds
-        else:
-            t_pred = preds > 0.5
-        try:
-            result[key] = value(truth, t_pred)
-        except ValueError:
-            result[key] = 0.0
-        if np.isnan(result[key]):
-            result[key] = 0.0
-    return result
+        metrics, score_fn = CLASSIFICATION_METRICS, _classification_scores
+    if metric_names is None:
+        metric_names = list(metrics)
+
+    preds = [np.asarray(p, dtype=np.float64).ravel() for p in preds]
+    if not isinstance(truth, list) and np.ndim(truth) == 1:
+        truth = [truth] * len(preds)
+    truth = [np.asarray(t, dtype=np.float64).ravel() for t in truth]
+    n_max = max([len(p) for p in preds], default=0)
+    mask = np.zeros((len(preds), n_max))
+    padded_preds, padded_truth = np.zeros_like(mask), np.zeros_like(mask)
+    for idx, (p, t) in enumerate(zip(preds, truth)):
+        mask[idx, :len(p)] = 1
+        padded_preds[idx, :len(p)] = p
+        padded_truth[idx, :len(t)] = t
+
+    scores = score_fn(mask, padded_preds, padded_truth)
+    df = pd.DataFrame({key: scores[key] for key in metric_names
+                       if key in scores})
+    df = df.fillna(0.0)
+    for key in ['tp', 'tn', 'fp', 'fn']:
+        if key in df:
+            df[key] = df[key].astype(int)
+    return df
+
+
+def evaluate(preds, truth, pred_task,
+             metric_names: Optional[List[str]] = None) -> Dict[str, float]:
+    """Scores a single prediction vector. Metrics that are undefined, e.g.,
+    AUROC with a single class, are reported as 0."""
+    return evaluate_batch([preds], [truth], pred_task,
+                          metric_names).to_dict('records')[0]
 
 
 def bootstrap_evaluate(
@@ -95,33 +299,37 @@ def bootstrap_evaluate(
     ci: float = 0.95,
     all_results: bool = False
 ) -> Dict[str, Dict[str, float]]:
+    """Bootstrap estimate of the metrics in `evaluate`.
+
+    Resamples are drawn as count weights over the original items and all
+    metrics are computed for a chunk of resamples at a time, so the
+    memory used is bounded by `BOOTSTRAP_CHUNK_ELEMENTS`. Metrics that are
+    undefined for a resample (e.g., AUROC with a single class) are NaN
+    and ignored in the summary.
+    """
+    preds = np.asarray(preds, dtype=np.float64)
+    truth = np.asarray(truth, dtype=np.float64)
     if pred_task == 'reg':
-        metrics = REGRESSION_METRICS
+        metric_fn = _regression_scores
     else:
-        preds = preds > 0.5
-        metrics = CLASSIFICATION_METRICS
+        metric_fn = _classification_scores
 
     n = len(preds)
+    chunk_size = max(1, BOOTSTRAP_CHUNK_ELEMENTS // max(n, 1))
     metric_scores = defaultdict(list)
 
-    for _ in range(n_bootstrap_samples):
-        # Sample with replacement
-        indices = np.random.choice(n, n, replace=True)
-        sample_preds = preds[indices]
-        sample_truth = truth[indices]
-
-        for key, metric_fn in metrics.items():
-            try:
-                score = metric_fn(sample_preds, sample_truth)
-            except Exception:
-                score = np.nan
-            metric_scores[key].append(score)
+    for start in range(0, n_bootstrap_samples, chunk_size):
+        size = min(chunk_size, n_bootstrap_samples - start)
+        weights = _resample_weights(n, size)
+        for key, scores in metric_fn(weights, preds, truth).items():
+            metric_scores[key].append(scores)
+    metric_scores = {key: np.concatenate(scores)
+                     for key, scores in metric_scores.items()}
     if all_results:
-        return metric_scores
+        return {key: scores.tolist() for key, scores in metric_scores.items()}
     results = {}
     alpha = 1 - ci
     for key, scores in metric_scores.items():
-        scores = np.array(scores)
         mean = np.nanmean(scores)
         lower = np.nanpercentile(scores, 100 * alpha / 2)
         upper = np.nanpercentile(scores, 100 * (1 - alpha / 2))
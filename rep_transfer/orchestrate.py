@@ -0,0 +1,430 @@
+"""Runs the whole benchmark as a graph of steps, redoing only stale work.
+
+    data -> partitions -> representations (and binding targets)
+         -> interpolation / extrapolation -> leaderboard
+
+Every step (node) is a call to one of the scripts in `rep_transfer/` and
+declares the files it reads and writes. When a node succeeds, a hash of its
+command and inputs is stored in `.orchestrate/stamps.json`. A node runs
+again only if one of its outputs is missing, its command or inputs changed,
+or it is forced with `--force`. Outputs produced before the orchestrator
+was used have no stamp and are taken as up to date, so that adding a
+representation only computes that representation, its evaluations and the
+leaderboard. Independent nodes run in parallel within a budget of cores and
+accelerators.
+"""
+import hashlib
+import json
+import os
+import os.path as osp
+import subprocess
+import sys
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+from multiprocessing import cpu_count
+from typing import Dict, List
+
+import pandas as pd
+import typer
+
+from leaderboard import REP_NAMES
+from scheduler import DATASETS, EXPERIMENTS
+from utils.devices import device_count, select_device
+from utils.partition_index import file_sha256
+
+
+ROOT = osp.normpath(osp.join(osp.dirname(__file__), '..'))
+STATE_DIR = osp.join(ROOT, '.orchestrate')
+STAMPS = osp.join(STATE_DIR, 'stamps.json')
+LOG_DIR = osp.join(STATE_DIR, 'logs')
+# Representations computed without a model, which ignore `--device`.
+FINGERPRINT_REPS = ['ecfp', 'ecfp-count', 'pepfunn']
+RUN = ['forced', 'missing outputs', 'inputs changed', 'upstream changed']
+
+
+def _path(*parts: str) -> str:
+    return osp.join(ROOT, *parts)
+
+
+def uses_device(rep: str) -> bool:
+    return not (rep in FINGERPRINT_REPS or 'fragfp' in rep)
+
+
+def _node(node_id: str, command: List[str], inputs: List[str],
+          outputs: List[str], runtime: str = None, clean: List[str] = None,
+          cores: int = 1) -> dict:
+    """`runtime` is the resource that is passed to the script when it runs:
+    `device` for `--device` or `cores` for `--cores`. `clean` are removed
+    before rerunning a node whose outputs exist, so that the script does not
+    reuse them."""
+    return {'id': node_id, 'command': command, 'inputs': inputs,
+            'outputs': outputs, 'runtime': runtime,
+            'clean': outputs if clean is None else clean, 'cores': cores,
+            'deps': []}
+
+
+def _journal(results_path: str) -> str:
+    results_dir, filename = osp.split(results_path)
+    return osp.join(results_dir, '.journal',
+                    f'{osp.splitext(filename)[0]}.jsonl')
+
+
+def _eval_path(experiment: str, dataset: str, model: str, rep: str) -> str:
+    if experiment == 'interpolation':
+        return _path('Results', 'no-generalisation',
+                     f'{dataset}_{model}_pre_0.0_post_0.0_{rep}.csv')
+    return _path('Results', experiment, f'{dataset}_{model}_{rep}.csv')
+
+
+def _rep_inputs(rep: str, dataset: str) -> List[str]:
+    inputs = [_path('reps', f'{r}_{dataset}.pickle') for r in rep.split(',')]
+    if dataset.endswith('binding'):
+        inputs.append(
+            _path('reps', f"binding-{dataset.split('-')[0]}-targets.pickle"))
+    return inputs
+
+
+def build_graph(reps: List[str], models: List[str], datasets: List[str],
+                experiments: List[str], train_sets: List[str],
+                n_seeds: int, n_seeds_ood: int, job_cores: int) -> List[dict]:
+    """Nodes of the benchmark in topological order."""
+    tasks = []
+    if 'extrapolation' in experiments:
+        tasks = sorted(set(d.split('-')[-1] for d in datasets))
+    needed = list(datasets) if 'interpolation' in experiments else []
+    for task in tasks:
+        needed += [d for d in [f'c-{task}', f'nc-{task}'] if d not in needed]
+    data = {d: _path('downstream_data', f'{d}.csv') for d in needed}
+    nodes = []
+
+    if not osp.isdir(_path('downstream_data')):
+        nodes.append(_node('data', ['download_data.py', 'downstream_data'],
+                           [], [_path('downstream_data', f'{d}.csv')
+                                for d in DATASETS]))
+
+    compiled = [d for d in needed
+                if osp.exists(_path('partitions', f'{d}.gz'))]
+    if 'interpolation' in experiments and compiled:
+        nodes.append(_node(
+            'partitions', ['compile_partitions.py'] + compiled,
+            [_path('partitions', f'{d}.gz') for d in compiled] +
+            [data[d] for d in compiled],
+            [_path('partitions', f'{d}.npz') for d in compiled]))
+
+    if any(d.endswith('binding') for d in needed):
+        nodes.append(_node(
+            'rep:binding-targets',
+            ['represent_peptides.py', 'binding-targets', 'esm2-8m'],
+            [_path('downstream_data', 'c-binding.csv'),
+             _path('downstream_data', 'nc-binding.csv')],
+            [_path('reps', 'binding-c-targets.pickle'),
+             _path('reps', 'binding-nc-targets.pickle')],
+            runtime='device', cores=job_cores))
+    for rep in sorted(set(r for rep in reps for r in rep.split(','))):
+        for dataset in needed:
+            nodes.append(_node(
+                f'rep:{rep}:{dataset}',
+                ['represent_peptides.py', dataset, rep], [data[dataset]],
+                [_path('reps', f'{rep}_{dataset}.pickle')],
+                runtime='device' if uses_device(rep) else None,
+                cores=job_cores))
+
+    for model in models:
+        for rep in reps:
+            if 'interpolation' in experiments:
+                for dataset in datasets:
+                    out = _eval_path('interpolation', dataset, model, rep)
+                    nodes.append(_node(
+                        f'interpolation:{dataset}:{model}:{rep}',
+                        ['scheduler.py', '--rep', rep, '--model', model,
+                         '--dataset', dataset, '--experiment',
+                         'interpolation', '--n-seeds', str(n_seeds)],
+                        [data[dataset],
+                         _path('partitions', f'{dataset}.npz')] +
+                        _rep_inputs(rep, dataset),
+                        [out], runtime='cores', clean=[out, _journal(out)],
+                        cores=job_cores))
+            for train_set in train_sets:
+                for task in tasks:
+                    out = _eval_path(train_set, task, model, rep)
+                    nodes.append(_node(
+                        f'{train_set}:{task}:{model}:{rep}',
+                        ['scheduler.py', '--rep', rep, '--model', model,
+                         '--dataset', f'c-{task}', '--dataset', f'nc-{task}',
+                         '--experiment', 'extrapolation', '--train-set',
+                         train_set, '--n-seeds-ood', str(n_seeds_ood)],
+                        [data[f'c-{task}'], data[f'nc-{task}']] +
+                        _rep_inputs(rep, f'c-{task}') +
+                        _rep_inputs(rep, f'nc-{task}'),
+                        [out], runtime='cores', clean=[out, _journal(out)],
+                        cores=job_cores))
+
+    producers = {out: node['id'] for node in nodes
+                 for out in node['outputs']}
+    all_reps = list(REP_NAMES) + [rep for rep in reps if rep not in REP_NAMES]
+    for model in models:
+        # Every results file the leaderboard reads, whether it is computed
+        # here or was computed before.
+        all_tasks = sorted(set(d.split('-')[-1] for d in DATASETS))
+        results = [_eval_path('interpolation', dataset, model, rep)
+                   for rep in all_reps for dataset in DATASETS]
+        results += [_eval_path('standard', task, model, rep)
+                    for rep in all_reps for task in all_tasks]
+        results = [path for path in results
+                   if path in producers or osp.exists(path)]
+        command = ['leaderboard.py', '--model', model]
+        for rep in all_reps:
+            command += ['--rep', rep]
+        command += ['--output', osp.join('Results', f'leaderboard_{model}.md')]
+        nodes.append(_node(f'leaderboard:{model}', command, results,
+                           [_path('Results', f'leaderboard_{model}.md')]))
+
+    producers = {out: node['id'] for node in nodes
+                 for out in node['outputs']}
+    for node in nodes:
+        node['deps'] = sorted(set(producers[path] for path in node['inputs']
+                                  if path in producers))
+    return nodes
+
+
+def load_state() -> dict:
+    if not osp.exists(STAMPS):
+        return {'nodes': {}, 'files': {}}
+    return json.load(open(STAMPS))
+
+
+def save_state(state: dict):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp_path = f'{STAMPS}.tmp'
+    json.dump(state, open(tmp_path, 'w'), indent=1)
+    os.replace(tmp_path, STAMPS)
+
+
+def _file_hash(path: str, state: dict) -> str:
+    """Hash of `path`, recomputed only if its size or mtime changed."""
+    stat = os.stat(path)
+    key = osp.relpath(path, ROOT)
+    cached = state['files'].get(key)
+    if cached is not None and cached[:2] == [stat.st_mtime_ns, stat.st_size]:
+        return cached[2]
+    digest = file_sha256(path)
+    state['files'][key] = [stat.st_mtime_ns, stat.st_size, digest]
+    return digest
+
+
+def node_hash(node: dict, state: dict) -> str:
+    inputs = {osp.relpath(path, ROOT): _file_hash(path, state)
+              for path in node['inputs']}
+    content = json.dumps({'command': node['command'], 'inputs': inputs},
+                         sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def plan(nodes: List[dict], state: dict,
+         force: List[str] = ()) -> Dict[str, str]:
+    """Status of every node needed to bring the final nodes up to date: one
+    of `RUN`, `up to date` or `blocked: <reason>`. The dependencies of a node
+    are only checked if the node may have to run, so outputs without a stamp
+    do not require their inputs."""
+    by_id = {node['id']: node for node in nodes}
+    producers = {out: node['id'] for node in nodes
+                 for out in node['outputs']}
+    status = {}
+
+    def visit(node_id: str) -> str:
+        if node_id in status:
+            return status[node_id]
+        node = by_id[node_id]
+        stamp = state['nodes'].get(node_id)
+        if any(fnmatch(node_id, pattern) for pattern in force):
+            reason = 'forced'
+        elif not all(osp.exists(path) for path in node['outputs']):
+            reason = 'missing outputs'
+        elif stamp is None:
+            reason = 'up to date'
+        else:
+            reason = None
+
+        if reason != 'up to date':
+            deps = {dep: visit(dep) for dep in node['deps']}
+            if reason is None:
+                if any(s in RUN for s in deps.values()):
+                    reason = 'upstream changed'
+                elif not all(osp.exists(path) for path in node['inputs']):
+                    reason = 'up to date'
+                elif node_hash(node, state) != stamp:
+                    reason = 'inputs changed'
+                else:
+                    reason = 'up to date'
+            if reason in RUN:
+                for path in node['inputs']:
+                    if osp.exists(path):
+                        continue
+                    if path not in producers:
+                        reason = f'blocked: missing {osp.relpath(path, ROOT)}'
+                        break
+                    if status[producers[path]] not in RUN:
+                        reason = f'blocked by {producers[path]}'
+                        break
+        status[node_id] = reason
+        return reason
+
+    needed = set(dep for node in nodes for dep in node['deps'])
+    for node in nodes:
+        if node['id'] not in needed:
+            visit(node['id'])
+    return {node['id']: status[node['id']] for node in nodes
+            if node['id'] in status}
+
+
+def _run_node(node: dict, args: List[str], env: dict, log_path: str) -> int:
+    script = osp.join('rep_transfer', node['command'][0])
+    with open(log_path, 'w') as log:
+        return subprocess.run(
+            [sys.executable, script] + node['command'][1:] + args,
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+        ).returncode
+
+
+def run(nodes: List[dict], status: Dict[str, str], state: dict,
+        cores: int, device: str) -> Dict[str, str]:
+    """Runs the nodes that need to, each as soon as its dependencies are done
+    and its cores (and accelerator, if it uses one) are free. Returns the
+    outcome of every node that was scheduled."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    pending = [node for node in nodes if status.get(node['id']) in RUN]
+    outcome = {}
+    n_slots = device_count(device)
+    free_cores, free_slots = cores, list(range(n_slots))
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(cores, 1)) as pool:
+        while pending or running:
+            idx = 0
+            while idx < len(pending):
+                node = pending[idx]
+                if any(dep in outcome and outcome[dep] in ['failed', 'skipped']
+                       for dep in node['deps']):
+                    outcome[node['id']] = 'skipped'
+                    pending.pop(idx)
+                    continue
+                if any(status.get(dep) in RUN and dep not in outcome
+                       for dep in node['deps']):
+                    idx += 1
+                    continue
+                if (status[node['id']] == 'upstream changed' and
+                   all(osp.exists(path) for path in node['outputs']) and
+                   node_hash(node, state) == state['nodes'].get(node['id'])):
+                    outcome[node['id']] = 'unchanged'
+                    pending.pop(idx)
+                    continue
+
+                # Models on an accelerator take one of its slots and a
+                # single core; on the CPU they take `cores` like the rest.
+                on_slot = node['runtime'] == 'device' and n_slots > 0
+                threads = 1 if on_slot else min(node['cores'], cores)
+                if threads > free_cores or (on_slot and not free_slots):
+                    idx += 1
+                    continue
+
+                env = dict(os.environ)
+                env['OMP_NUM_THREADS'] = str(threads)
+                args, slot = [], None
+                if node['runtime'] == 'device':
+                    args = ['--device', device]
+                    if on_slot:
+                        slot = free_slots.pop(0)
+                        if device == 'cuda':
+                            env['CUDA_VISIBLE_DEVICES'] = str(slot)
+                elif node['runtime'] == 'cores':
+                    args = ['--cores', str(threads)]
+                if status[node['id']] != 'missing outputs':
+                    for path in node['clean']:
+                        if osp.exists(path):
+                            os.remove(path)
+
+                log_path = osp.join(LOG_DIR,
+                                    f"{node['id'].replace(':', '_')}.log")
+                print(f"Running {node['id']}")
+                future = pool.submit(_run_node, node, args, env, log_path)
+                running[future] = (node, threads, slot, time.time(), log_path)
+                free_cores -= threads
+                pending.pop(idx)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node, threads, slot, start, log_path = running.pop(future)
+                free_cores += threads
+                if slot is not None:
+                    free_slots.append(slot)
+                missing = [path for path in node['outputs']
+                           if not osp.exists(path)]
+                if future.result() == 0 and not missing:
+                    state['nodes'][node['id']] = node_hash(node, state)
+                    save_state(state)
+                    outcome[node['id']] = 'done'
+                    print(f"Done: {node['id']} ({time.time() - start:.0f} s)")
+                else:
+                    outcome[node['id']] = 'failed'
+                    print(f"Failed: {node['id']}, see {log_path}")
+                    for path in missing:
+                        print(f'  Missing output: {osp.relpath(path, ROOT)}')
+    return outcome
+
+
+def main(
+    rep: List[str] = typer.Option(list(REP_NAMES),
+                                  help='Representation(s) to evaluate.'),
+    model: List[str] = typer.Option(['lightgbm'],
+                                    help='Model(s) to evaluate.'),
+    dataset: List[str] = typer.Option(DATASETS, help='Datasets to use.'),
+    experiment: List[str] = typer.Option(EXPERIMENTS),
+    train_set: List[str] = typer.Option(['standard']),
+    cores: int = cpu_count(),
+    job_cores: int = typer.Option(
+        8, help='Cores of every evaluation and fingerprint step.'),
+    device: str = typer.Option(
+        'auto', help='Device for the language models: cuda, mps or cpu.'),
+    n_seeds: int = 5,
+    n_seeds_ood: int = 25,
+    force: List[str] = typer.Option(
+        [], help='Rerun the steps matching the pattern, e.g., `rep:ecfp:*`.'),
+    dry_run: bool = False
+):
+    device = select_device(device)
+    nodes = build_graph(rep, model, dataset, experiment, train_set,
+                        n_seeds, n_seeds_ood, min(job_cores, cores))
+    state = load_state()
+    status = plan(nodes, state, force)
+
+    steps = pd.DataFrame([
+        {'step': node['id'], 'status': status[node['id']],
+         'command': ' '.join(node['command'])}
+        for node in nodes if node['id'] in status
+    ])
+    to_run = steps[steps['status'].isin(RUN)]
+    blocked = steps[steps['status'].str.startswith('blocked')]
+    print(f'{len(to_run)} of {len(steps)} steps to run on {cores} cores '
+          f'and device {device}.')
+    if dry_run:
+        print(steps[steps['status'] != 'up to date'].to_string(index=False))
+        return
+    for _, row in blocked.iterrows():
+        print(f"Warning: {row['step']} is {row['status']}.")
+
+    outcome = run(nodes, status, state, cores, device)
+    failed = [node_id for node_id, out in outcome.items() if out == 'failed']
+    skipped = [node_id for node_id, out in outcome.items()
+               if out == 'skipped']
+    print(f"{sum(out == 'done' for out in outcome.values())} steps done, "
+          f'{len(failed)} failed, {len(skipped)} skipped.')
+    if failed or len(blocked) > 0:
+        raise typer.Exit(code=1)
+
+
+if __name__ == '__main__':
+    typer.run(main)
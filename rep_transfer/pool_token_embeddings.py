@@ -0,0 +1,52 @@
+import os
+import os.path as osp
+import pickle
+
+import typer
+
+from utils.token_embeddings import (LAST_LAYER, POOLINGS, TokenEmbeddings,
+                                    store_path)
+
+
+def rep_name(model: str, pooling: str, layer: int = LAST_LAYER) -> str:
+    """Name of the representation of `model` pooled from its token
+    embeddings."""
+    if layer == LAST_LAYER:
+        return f'tokens-{model}-{pooling}'
+    return f'tokens-{model}-layer{layer}-{pooling}'
+
+
+def main(dataset: str, model: str,
+         poolings: str = typer.Option(
+             'mean', help=f'Comma-separated, any of: {", ".join(POOLINGS)}.'),
+         layer: int = LAST_LAYER, chunk_size: int = 1024):
+    """Pools the token embeddings of `model` saved by
+    `represent_peptides.py <dataset> tokens-<model>` into representations
+    in `reps/`."""
+    poolings = poolings.split(',')
+    unknown = set(poolings) - set(POOLINGS)
+    if unknown:
+        raise ValueError(f'Poolings: {", ".join(sorted(unknown))} are not '
+                         f'supported. Choose from: {", ".join(POOLINGS)}.')
+    store = TokenEmbeddings(store_path(model, dataset))
+    # The last layer has the same name whichever index it is given by.
+    if store.resolve(layer) == store.resolve(LAST_LAYER):
+        layer = LAST_LAYER
+    out_paths = {
+        pooling: osp.join(osp.dirname(__file__), '..', 'reps',
+                          f'{rep_name(model, pooling, layer)}_{dataset}.pickle')
+        for pooling in poolings
+    }
+    out_paths = {pooling: path for pooling, path in out_paths.items()
+                 if not osp.exists(path)}
+    if not out_paths:
+        return
+    pooled = store.pool(list(out_paths), layer, chunk_size)
+    for pooling, out_path in out_paths.items():
+        os.makedirs(osp.dirname(out_path), exist_ok=True)
+        pickle.dump(pooled[pooling], open(out_path, 'wb'))
+        print(f'{rep_name(model, pooling, layer)}: {pooled[pooling].shape}')
+
+
+if __name__ == '__main__':
+    typer.run(main)
@@ -6,9 +6,169 @@ import pandas as pd
 import typer
 
 from multiprocessing import cpu_count
+from typing import List, Optional, Sequence
+
 from tqdm import tqdm
 from tqdm.contrib.concurrent import thread_map
 
+from utils.devices import select_device
+from utils.peptide_dataset import load_dataset
+from utils.token_embeddings import LAST_LAYER
+
+
+# PeptideCLM representations, by the pooling of the last hidden states.
+PEPCLM_POOLINGS = {'pepclm': 'mean', 'pepclm-cls': 'cls',
+                   'pepclm-max': 'max', 'gram-pepclm': 'gram'}
+# Language models of SMILES, the others take the sequences.
+SMILES_LMS = ['chemberta-2', 'molformer-xl', 'peptideclm']
+# Set by `main` when the language models run in CPU inference mode.
+CPU_INFERENCE = None
+# Set by `main` to shard the inputs of the language models across
+# processes on the CPU, and the intra-op threads of each.
+CPU_WORKERS = 1
+WORKER_THREADS = None
+# Set by `main` to the hidden states that the language models save, see
+# `utils.lm_inference.resolve_layers`, only the last if `None`.
+LAYERS = None
+# Set by `main` to the dimension of the sketched Gram representations, exact
+# if 0, and to the storage of the exact ones: `full` matrices as lists or
+# their upper triangle in float16, `triu16`.
+GRAM_SKETCH = 0
+GRAM_STORAGE = 'full'
+# Set by `main` to embed the inputs of the language models by windows of
+# `WINDOW` residues or SMILES atoms, every `STRIDE`, not embedded by windows
+# if `None`.
+WINDOW = None
+STRIDE = None
+
+
+def _optimize_for_cpu(re, inputs: List[str]):
+    """Applies `CPU_INFERENCE` to the model of a `RepEngineLM` and reports
+    the deviation of its embeddings on the first `inputs`."""
+    if CPU_INFERENCE is None:
+        return
+    n_params = re.get_num_params()
+    sample = list(inputs[:CPU_INFERENCE.check_size])
+    # The optimized model applies its own autocast.
+    re.fp16 = False
+    if sample:
+        reference = re.compute_reps(sample, batch_size=16)
+    re.model = CPU_INFERENCE.optimize(re.model, re.name)
+    # Quantized layers have no parameters, which sets the batch size.
+    re.get_num_params = lambda human_readable=False: n_params
+    if sample:
+        CPU_INFERENCE.report(re.name, reference,
+                             re.compute_reps(sample, batch_size=16))
+
+
+def _compute_reps(re, inputs: List[str], batch_size: int,
+                  smiles: bool = False) -> np.ndarray:
+    """`re.compute_reps` of `inputs`, or of their windows of `WINDOW`
+    residues, or atoms if they are `smiles`, sharded across `CPU_WORKERS`
+    processes."""
+    if WINDOW is not None:
+        from utils.windows import embed_windows, smiles_units
+
+        if WINDOW > re.max_len():
+            print(f'Warning: windows of {WINDOW} are longer than the '
+                  f'{re.max_len()} of {re.name}, and will be truncated.')
+        return embed_windows(
+            lambda texts: _shard_reps(re, texts, batch_size), list(inputs),
+            WINDOW, STRIDE, smiles_units if smiles else list)
+    return _shard_reps(re, inputs, batch_size)
+
+
+def _shard_reps(re, inputs: List[str], batch_size: int) -> np.ndarray:
+    if CPU_WORKERS < 2:
+        return re.compute_reps(inputs, batch_size=batch_size, verbose=True)
+    from utils.cpu_shards import map_sharded
+
+    inputs = list(inputs)
+
+    def compute(idxs: np.ndarray) -> dict:
+        return {'reps': np.stack(re.compute_reps(
+            [inputs[idx] for idx in idxs], batch_size=batch_size,
+            verbose=False))}
+
+    return map_sharded(compute, [len(seq) for seq in inputs], CPU_WORKERS,
+                       WORKER_THREADS)['reps']
+
+
+def _stack(re, layers: List[int]):
+    """Replaces the model of a `RepEngineLM` by one whose last hidden
+    states are those of `layers`, side by side, so that they are pooled
+    from one forward pass."""
+    from utils.lm_inference import stack_layers
+
+    re.model = stack_layers(re.model, layers)
+    # Keeps the traced models of different layers apart.
+    re.name = f"{re.name}-layers{'-'.join(map(str, layers))}"
+
+
+def _stack_layers(re) -> List[int]:
+    """Stacks the `LAYERS` of a `RepEngineLM`, see `_stack`. Returns the
+    layers, only `LAST_LAYER` if `LAYERS` is not set."""
+    if LAYERS is None:
+        return [LAST_LAYER]
+    from utils.lm_inference import resolve_layers
+
+    layers = resolve_layers(LAYERS, re.model.config.num_hidden_layers)
+    _stack(re, layers)
+    return layers
+
+
+def _layer_paths(rep: str, dataset: str, layers: List[int]) -> dict:
+    """Path of the representation of each layer, `<rep>-layer<layer>`, or
+    only that of `rep` for `LAST_LAYER`."""
+    reps = {LAST_LAYER: rep} if layers == [LAST_LAYER] else \
+        {layer: f'{rep}-layer{layer}' for layer in layers}
+    return {layer: os.path.join(os.path.dirname(__file__), '..', 'reps',
+                                f'{name}_{dataset}.pickle')
+            for layer, name in reps.items()}
+
+
+def _dump_layers(fp, out_paths: dict):
+    """Saves the representations of `_stack_layers` models, one per layer
+    of `out_paths`."""
+    if list(out_paths) == [LAST_LAYER]:
+        fp = [f.tolist() for f in fp]
+        pickle.dump(fp, open(out_paths[LAST_LAYER], 'wb'))
+        return
+    from utils.lm_inference import split_layers
+
+    layers_fp = split_layers(np.stack(fp), len(out_paths))
+    for layer_fp, out_path in zip(layers_fp, out_paths.values()):
+        pickle.dump(layer_fp, open(out_path, 'wb'))
+
+
+def _gram_engine(model: str):
+    """`RepEngineLM` with the Gram pooling of `model`, exact or sketched to
+    `GRAM_SKETCH` values, and the prefix of its representations."""
+    from autopeptideml.reps.lms import RepEngineLM
+
+    if not GRAM_SKETCH:
+        return RepEngineLM(model, gram_pooling=True), 'gram'
+    from utils.gram_sketch import tensor_sketch
+
+    # The mean of the sketches of the tokens is the sketch of the Gram.
+    re = RepEngineLM(model, average_pooling=True)
+    re.model = tensor_sketch(re.model, GRAM_SKETCH)
+    re.name = f'{re.name}-sketch{GRAM_SKETCH}'
+    return re, f'gram-sketch{GRAM_SKETCH}'
+
+
+def _dump_gram(fp, out_path: str):
+    """Saves Gram representations, sketched or exact, in `GRAM_STORAGE`."""
+    if GRAM_SKETCH:
+        fp = np.stack(fp).astype(np.float32)
+    elif GRAM_STORAGE == 'triu16':
+        from utils.gram_sketch import gram_triu
+
+        fp = gram_triu(fp)
+    else:
+        fp = [f.tolist() for f in fp]
+    pickle.dump(fp, open(out_path, 'wb'))
+
 
 def protein_data_binding(device: str):
     from autopeptideml.reps.lms import RepEngineLM
@@ -22,18 +182,15 @@ def protein_data_binding(device: str):
         os.path.dirname(__file__),
         '..', 'reps', f'binding-nc-targets.pickle'
     )
-    df1 = pd.read_csv(
-        os.path.join(os.path.dirname(__file__), '..', 'downstream_data',
-                     f'c-binding.csv'))
-    df2 = pd.read_csv(
-        os.path.join(os.path.dirname(__file__), '..', 'downstream_data',
-                     f'nc-binding.csv'))
-    fp = re.compute_reps(df1['seq1'], batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
+    df1 = load_dataset('c-binding', ['target_sequence'])
+    df2 = load_dataset('nc-binding', ['target_sequence'])
+    _optimize_for_cpu(re, df1['target_sequence'])
+    fp = _compute_reps(re, df1['target_sequence'],
+                       batch_size=64 if re.get_num_params() < 1e8 else 16)
     fp = [f.tolist() for f in fp]
     pickle.dump(fp, open(os.path.join(out_path1), 'wb'))
-    fp = re.compute_reps(df2['seq1'], batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
+    fp = _compute_reps(re, df2['target_sequence'],
+                       batch_size=64 if re.get_num_params() < 1e8 else 16)
     fp = [f.tolist() for f in fp]
     pickle.dump(fp, open(os.path.join(out_path2), 'wb'))
 
@@ -50,17 +207,14 @@ def calculate_fragfp(dataset: str, radius: int):
         '..', 'reps')), exist_ok=True)
     if os.path.exists(out_path):
         return
-    df = pd.read_csv(os.path.join(
-        os.path.dirname(__file__),
-        '..', 'downstream_data', f'{dataset}.csv'
-    ))
+    df = load_dataset(dataset, ['smiles'])
     fpgen = FragFPGenerator(
        fpSize=2_048, out_radius=radius
     )
     fps = []
-    fps = thread_map(fpgen, df['SMILES'], max_workers=cpu_count())
+    fps = thread_map(fpgen, df['smiles'], max_workers=cpu_count())
 
-    # for smiles in tqdm(df['SMILES']):
+    # for smiles in tqdm(df['smiles']):
     #     print("-\n", smiles, "-\n")
     #     fps.append(fpgen(smiles))
     fps = np.stack(fps)
@@ -82,14 +236,12 @@ def calculate_new_esm(dataset: str, model: str, device: str):
     )
     re = RepEngineLM(model, average_pooling=True)
     re.move_to_device(device)
-    out_path = os.path.join(
-        os.path.dirname(__file__),
-        '..', 'reps', f'new-{model}_{dataset}.pickle'
-    )
+    layers = _stack_layers(re)
+    out_paths = _layer_paths(f'new-{model}', dataset, layers)
     os.makedirs((os.path.join(
         os.path.dirname(__file__),
         '..', 'reps')), exist_ok=True)
-    if os.path.exists(out_path):
+    if all(os.path.exists(path) for path in out_paths.values()):
         return
     df = pd.read_csv(os.path.join(
         os.path.dirname(__file__),
@@ -99,14 +251,13 @@ def calculate_new_esm(dataset: str, model: str, device: str):
         seqs = df.sequence.tolist()
     else:
         seqs = pipe(df['SMILES'].tolist())
-    fp = re.compute_reps(seqs, batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
-    fp = [f.tolist() for f in fp]
-    pickle.dump(fp, open(os.path.join(out_path), 'wb'))
+    _optimize_for_cpu(re, seqs)
+    fp = _compute_reps(re, seqs,
+                       batch_size=64 if re.get_num_params() < 1e8 else 16)
+    _dump_layers(fp, out_paths)
 
 
 def calculate_esm_gram(dataset: str, model: str, device: str):
-    from autopeptideml.reps.lms import RepEngineLM
     from autopeptideml.pipeline import Pipeline
     from autopeptideml.pipeline.smiles import SmilesToSequence
     from autopeptideml.pipeline.sequence import CanonicalCleaner
@@ -116,11 +267,11 @@ def calculate_esm_gram(dataset: str, model: str, device: str):
                   CanonicalCleaner(substitution='X')],
         name='pipe',
     )
-    re = RepEngineLM(model, gram_pooling=True)
+    re, prefix = _gram_engine(model)
     re.move_to_device(device)
     out_path = os.path.join(
         os.path.dirname(__file__),
-        '..', 'reps', f'gram-{model}_{dataset}.pickle'
+        '..', 'reps', f'{prefix}-{model}_{dataset}.pickle'
     )
     os.makedirs((os.path.join(
         os.path.dirname(__file__),
@@ -135,10 +286,10 @@ def calculate_esm_gram(dataset: str, model: str, device: str):
         seqs = df.sequence.tolist()
     else:
         seqs = pipe(df['SMILES'].tolist())
-    fp = re.compute_reps(seqs, batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
-    fp = [f.tolist() for f in fp]
-    pickle.dump(fp, open(os.path.join(out_path), 'wb'))
+    _optimize_for_cpu(re, seqs)
+    fp = _compute_reps(re, seqs,
+                       batch_size=64 if re.get_num_params() < 1e8 else 16)
+    _dump_gram(fp, out_path)
 
 
 def calculate_esm(dataset: str, model: str, device: str):
@@ -154,14 +305,12 @@ def calculate_esm(dataset: str, model: str, device: str):
     )
     re = RepEngineLM(model, average_pooling=True)
     re.move_to_device(device)
-    out_path = os.path.join(
-        os.path.dirname(__file__),
-        '..', 'reps', f'{model}_{dataset}.pickle'
-    )
+    layers = _stack_layers(re)
+    out_paths = _layer_paths(model, dataset, layers)
     os.makedirs((os.path.join(
         os.path.dirname(__file__),
         '..', 'reps')), exist_ok=True)
-    if os.path.exists(out_path):
+    if all(os.path.exists(path) for path in out_paths.values()):
         return
     df = pd.read_csv(os.path.join(
         os.path.dirname(__file__),
@@ -171,10 +320,10 @@ def calculate_esm(dataset: str, model: str, device: str):
         seqs = df.sequence.tolist()
     else:
         seqs = pipe(df['SMILES'].tolist())
-    fp = re.compute_reps(seqs, batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
-    fp = [f.tolist() for f in fp]
-    pickle.dump(fp, open(os.path.join(out_path), 'wb'))
+    _optimize_for_cpu(re, seqs)
+    fp = _compute_reps(re, seqs,
+                       batch_size=64 if re.get_num_params() < 1e8 else 16)
+    _dump_layers(fp, out_paths)
 
 
 def calculate_ecfp(dataset: str):
@@ -244,13 +393,11 @@ def calculate_ecfp_count(dataset: str):
 
 
 def calculate_gram_chemberta(dataset: str, device: str):
-    from autopeptideml.reps.lms import RepEngineLM
-
-    re = RepEngineLM('chemberta-2', gram_pooling=True)
+    re, prefix = _gram_engine('chemberta-2')
     re.move_to_device(device)
     out_path = os.path.join(
         os.path.dirname(__file__),
-        '..', 'reps', f'gram-chemberta_{dataset}.pickle'
+        '..', 'reps', f'{prefix}-chemberta_{dataset}.pickle'
     )
     os.makedirs((os.path.join(
         os.path.dirname(__file__),
@@ -261,21 +408,20 @@ def calculate_gram_chemberta(dataset: str, device: str):
         os.path.dirname(__file__),
         '..', 'downstream_data', f'{dataset}.csv'
     ))
-    fp = re.compute_reps(df['SMILES'], batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
-    fp = [f.tolist() for f in fp]
-    pickle.dump(fp, open(os.path.join(out_path), 'wb'))
+    _optimize_for_cpu(re, df['SMILES'])
+    fp = _compute_reps(re, df['SMILES'],
+                       batch_size=64 if re.get_num_params() < 1e8 else 16,
+                       smiles=True)
+    _dump_gram(fp, out_path)
     return fp
 
 
 def calculate_gram_molformer(dataset: str, device: str):
-    from autopeptideml.reps.lms import RepEngineLM
-
-    re = RepEngineLM('molformer-xl', gram_pooling=True)
+    re, prefix = _gram_engine('molformer-xl')
     re.move_to_device(device)
     out_path = os.path.join(
         os.path.dirname(__file__),
-        '..', 'reps', f'gram-molformer_{dataset}.pickle'
+        '..', 'reps', f'{prefix}-molformer_{dataset}.pickle'
     )
     os.makedirs((os.path.join(
         os.path.dirname(__file__),
@@ -286,10 +432,11 @@ def calculate_gram_molformer(dataset: str, device: str):
         os.path.dirname(__file__),
         '..', 'downstream_data', f'{dataset}.csv'
     ))
-    fp = re.compute_reps(df['SMILES'], batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
-    fp = [f.tolist() for f in fp]
-    pickle.dump(fp, open(os.path.join(out_path), 'wb'))
+    _optimize_for_cpu(re, df['SMILES'])
+    fp = _compute_reps(re, df['SMILES'],
+                       batch_size=64 if re.get_num_params() < 1e8 else 16,
+                       smiles=True)
+    _dump_gram(fp, out_path)
     return fp
 
 
@@ -298,23 +445,22 @@ def calculate_chemberta(dataset: str, device: str):
 
     re = RepEngineLM('chemberta-2', average_pooling=True)
     re.move_to_device(device)
-    out_path = os.path.join(
-        os.path.dirname(__file__),
-        '..', 'reps', f'chemberta_{dataset}.pickle'
-    )
+    layers = _stack_layers(re)
+    out_paths = _layer_paths('chemberta', dataset, layers)
     os.makedirs((os.path.join(
         os.path.dirname(__file__),
         '..', 'reps')), exist_ok=True)
-    if os.path.exists(out_path):
+    if all(os.path.exists(path) for path in out_paths.values()):
         return
     df = pd.read_csv(os.path.join(
         os.path.dirname(__file__),
         '..', 'downstream_data', f'{dataset}.csv'
     ))
-    fp = re.compute_reps(df['SMILES'], batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
-    fp = [f.tolist() for f in fp]
-    pickle.dump(fp, open(os.path.join(out_path), 'wb'))
+    _optimize_for_cpu(re, df['SMILES'])
+    fp = _compute_reps(re, df['SMILES'],
+                       batch_size=64 if re.get_num_params() < 1e8 else 16,
+                       smiles=True)
+    _dump_layers(fp, out_paths)
     return fp
 
 
@@ -323,36 +469,101 @@ def calculate_molformer(dataset: str, device: str):
 
     re = RepEngineLM('molformer-xl', average_pooling=True)
     re.move_to_device(device)
-    out_path = os.path.join(
-        os.path.dirname(__file__),
-        '..', 'reps', f'molformer_{dataset}.pickle'
-    )
+    layers = _stack_layers(re)
+    out_paths = _layer_paths('molformer', dataset, layers)
     os.makedirs((os.path.join(
         os.path.dirname(__file__),
         '..', 'reps')), exist_ok=True)
-    if os.path.exists(out_path):
+    if all(os.path.exists(path) for path in out_paths.values()):
         return
     df = pd.read_csv(os.path.join(
         os.path.dirname(__file__),
         '..', 'downstream_data', f'{dataset}.csv'
     ))
-    fp = re.compute_reps(df['SMILES'], batch_size=64 if re.get_num_params() < 1e8 else 16,
-                         verbose=True)
-    fp = [f.tolist() for f in fp]
-    pickle.dump(fp, open(os.path.join(out_path), 'wb'))
+    _optimize_for_cpu(re, df['SMILES'])
+    fp = _compute_reps(re, df['SMILES'],
+                       batch_size=64 if re.get_num_params() < 1e8 else 16,
+                       smiles=True)
+    _dump_layers(fp, out_paths)
     return fp
 
 
-def calculate_pepclm(dataset: str):
-    from utils.pepclm_tokenizer import SMILES_SPE_Tokenizer
-    import transformers as hf
-    import torch
+def calculate_token_embeddings(dataset: str, model: str, device: str,
+                               chunk_size: int = 1024):
+    """Saves the last hidden states, or those of `LAYERS`, of every token
+    of `model` in a token embedding store, see `utils/token_embeddings.py`,
+    from which `pool_token_embeddings.py` computes any pooling."""
+    from autopeptideml.reps.lms import RepEngineLM
+    from utils.lm_inference import resolve_layers, split_layers
+    from utils.token_embeddings import (TokenEmbeddings,
+                                        TokenEmbeddingWriter, store_path)
 
-    device = 'mps'
-    batch_size = 8
-    out_path = os.path.join(os.path.dirname(__file__),
-        '..', 'reps', f'pepclm_{dataset}.pickle')
+    # The same tokens as the mean pooling of `calculate_esm`, unpooled.
+    re = RepEngineLM(model, average_pooling=False)
+    re.move_to_device(device)
+    n_layers = re.model.config.num_hidden_layers
+    # Only the layers that the store lacks, which are added to it.
+    layers = resolve_layers(LAYERS, n_layers)
+    out_path = store_path(model, dataset)
     if os.path.exists(out_path):
+        stored = TokenEmbeddings(out_path)
+        layers = [layer for layer in layers if not stored.has_layer(layer)]
+    if not layers:
+        return
+    if layers != [n_layers]:
+        _stack(re, layers)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    df = pd.read_csv(os.path.join(
+        os.path.dirname(__file__),
+        '..', 'downstream_data', f'{dataset}.csv'
+    ))
+    if model in SMILES_LMS:
+        seqs = df['SMILES'].tolist()
+    elif 'sequence' in df.columns:
+        seqs = df.sequence.tolist()
+    else:
+        from autopeptideml.pipeline import Pipeline
+        from autopeptideml.pipeline.smiles import SmilesToSequence
+        from autopeptideml.pipeline.sequence import CanonicalCleaner
+
+        pipe = Pipeline(
+            elements=[SmilesToSequence(keep_analog=False),
+                      CanonicalCleaner(substitution='X')],
+            name='pipe',
+        )
+        seqs = pipe(df['SMILES'].tolist())
+    _optimize_for_cpu(re, seqs)
+    if CPU_WORKERS > 1:
+        print('Warning: token embeddings are computed by a single process.')
+    writer = TokenEmbeddingWriter(out_path, layers, n_layers)
+    for start in tqdm(range(0, len(seqs), chunk_size)):
+        states = re.compute_reps(
+            seqs[start:start + chunk_size],
+            batch_size=64 if re.get_num_params() < 1e8 else 16)
+        writer.append([split_layers(state, len(layers))
+                       for state in states])
+    writer.close()
+
+
+def calculate_pepclm(dataset: str, device: str,
+                     poolings: Sequence[str] = ('mean',),
+                     batch_size: int = 8):
+    """PeptideCLM representations with each of `poolings`, see
+    `PEPCLM_POOLINGS`, computed from the same forward pass."""
+    from utils.lm_inference import embed
+    from utils.spe_tokenizer import SPETokenizer
+    from utils.token_store import TokenStore
+    import transformers as hf
+
+    names = {pooling: rep for rep, pooling in PEPCLM_POOLINGS.items()}
+    out_paths = {
+        pooling: os.path.join(os.path.dirname(__file__), '..', 'reps',
+                              f'{names[pooling]}_{dataset}.pickle')
+        for pooling in poolings
+    }
+    out_paths = {pooling: path for pooling, path in out_paths.items()
+                 if not os.path.exists(path)}
+    if not out_paths:
         return
     os.makedirs((os.path.join(
         os.path.dirname(__file__),
@@ -361,34 +572,44 @@ def calculate_pepclm(dataset: str):
         os.path.dirname(__file__),
         '..', 'downstream_data', f'{dataset}.csv'
     ))
-    tokenizer = SMILES_SPE_Tokenizer(
-        os.path.join(os.path.dirname(__file__), 'utils',
-                     'tokenizer', 'new_vocab.txt'),
-        os.path.join(os.path.dirname(__file__), 'utils',
-                     'tokenizer', 'new_splits.txt')
-    )
+    tokenizer = SPETokenizer()
     model = hf.AutoModel.from_pretrained('aaronfeller/PeptideCLM-23M-all',
                                          trust_remote_code=True)
     model.to(device)
+    model.eval()
     n_params = sum(p.numel() for p in model.parameters())
     if n_params / 1e6 < 1e3:
         print(f'Number of model parameters are: {n_params/1e6:.1f} M')
     else:
         print(f'Number of model parameters are: {n_params/1e9:.1f} B')
-    smiles = df['SMILES'].tolist()
-    batched = [smiles[i:i+batch_size] for i in
-               range(0, len(smiles), batch_size)]
-    fps = []
-    for batch in tqdm(batched):
-        input_ids = tokenizer(batch, return_tensors='pt',
-                              padding='longest').to(device)
-        with torch.no_grad():
-            vector = model(**input_ids).last_hidden_state
-            mask = input_ids['attention_mask']
-            for i in range(mask.shape[0]):
-                length = mask[i].sum()
-                fps.append(vector[i, :length].mean(0).detach().cpu().tolist())
-    pickle.dump(fps, open(os.path.join(out_path), 'wb'))
+    tokens = TokenStore(tokenizer.name).encode(df['SMILES'].tolist(),
+                                               tokenizer.encode)
+    if CPU_INFERENCE is not None:
+        sample = tokens.take(range(min(CPU_INFERENCE.check_size,
+                                       len(tokens))))
+        reference = embed(model, sample, tokenizer.pad_token_id, device,
+                          list(out_paths), batch_size, verbose=False)
+        model = CPU_INFERENCE.optimize(model, 'PeptideCLM-23M-all')
+    if CPU_WORKERS > 1:
+        from utils.cpu_shards import map_sharded
+
+        def compute(idxs: np.ndarray) -> dict:
+            return embed(model, tokens.take(idxs), tokenizer.pad_token_id,
+                         device, list(out_paths), batch_size, verbose=False)
+
+        fps = map_sharded(compute, tokens.lengths, CPU_WORKERS,
+                          WORKER_THREADS)
+    else:
+        fps = embed(model, tokens, tokenizer.pad_token_id, device,
+                    list(out_paths), batch_size)
+    if CPU_INFERENCE is not None:
+        for pooling, values in reference.items():
+            CPU_INFERENCE.report(f'PeptideCLM {pooling}', values,
+                                 fps[pooling][:len(values)])
+    if 'gram' in fps and GRAM_STORAGE == 'triu16':
+        fps['gram'] = fps['gram'].astype(np.float16)
+    for pooling, out_path in out_paths.items():
+        pickle.dump(fps[pooling], open(out_path, 'wb'))
 
 
 def calculate_pepfunnfp(dataset: str):
@@ -455,7 +676,69 @@ def calculate_pepland(dataset: str):
     pickle.dump(embds, open(out_path, 'w'))
 
 
-def main(dataset: str, rep: str, device: str = 'mps'):
+def main(
+    dataset: str, rep: str, device: str = 'auto', batch_size: int = 8,
+    cpu_inference: bool = typer.Option(
+        False, help='Optimize the language models for CPU inference with '
+                    'the options below.'),
+    quantize: bool = typer.Option(
+        True, help='Quantize the linear layers to int8 dynamically.'),
+    bf16: str = typer.Option(
+        'auto', help='bfloat16 autocast: auto (if the CPU supports it and '
+                     'the model is not quantized), on or off.'),
+    compile: str = typer.Option('none', help='none, compile or trace.'),
+    threads: Optional[int] = None,
+    interop_threads: Optional[int] = None,
+    check_size: int = typer.Option(
+        64, help='Inputs compared with the fp32 model, none if 0.'),
+    workers: int = typer.Option(
+        1, help='Processes that share the language models on the CPU, each '
+                'pinned to its own cores and with --threads threads, all '
+                'of its cores by default.'),
+    layers: Optional[str] = typer.Option(
+        None, help='Hidden states of the language models to save, "all" or '
+                   'comma-separated layers, 0 for the embeddings and -1 for '
+                   'the last layer, each as a <rep>-layer<layer> '
+                   'representation. Only the last hidden states if not '
+                   'given.'),
+    gram_sketch: int = typer.Option(
+        0, help='Dimension of the Tensor Sketch of Gram representations, '
+                'saved as gram-sketch<dim>-<model>, exact if 0.'),
+    gram_storage: str = typer.Option(
+        'full', help='Storage of the exact Gram representations: full or '
+                     'triu16, their upper triangle in float16.'),
+    window: Optional[int] = typer.Option(
+        None, help='Embed inputs longer than this many residues or SMILES '
+                   'atoms by windows, not truncated.'),
+    stride: Optional[int] = typer.Option(
+        None, help='Residues or atoms between windows, half a window by '
+                   'default.')
+):
+    global CPU_INFERENCE, CPU_WORKERS, WORKER_THREADS, LAYERS, \
+        GRAM_SKETCH, GRAM_STORAGE, WINDOW, STRIDE
+
+    if gram_storage not in ['full', 'triu16']:
+        raise ValueError(f'Gram storage: {gram_storage} is not one of: '
+                         'full, triu16.')
+    LAYERS = layers
+    GRAM_SKETCH = gram_sketch
+    GRAM_STORAGE = gram_storage
+    WINDOW = window
+    STRIDE = stride
+    device = select_device(device)
+    if workers > 1 and device != 'cpu':
+        print(f'Warning: CPU workers are ignored on {device}.')
+    elif workers > 1:
+        CPU_WORKERS = workers
+        WORKER_THREADS = threads
+    if cpu_inference and device != 'cpu':
+        print(f'Warning: CPU inference mode is ignored on {device}.')
+    elif cpu_inference:
+        from utils.cpu_inference import CPUInference
+
+        CPU_INFERENCE = CPUInference(quantize, bf16, compile, threads,
+                                     interop_threads, check_size)
+        CPU_INFERENCE.setup()
     if dataset == 'binding-targets':
         protein_data_binding(device)
         return
@@ -477,15 +760,25 @@ def main(dataset: str, rep: str, device: str = 'mps'):
     elif rep == 'gram-molformer':
         print('Calculating Molformer-XL representations with Gram pooling')
         calculate_gram_molformer(dataset, device)
-    elif rep == 'pepclm':
+    elif rep.startswith('tokens-'):
+        print(f'Calculating {rep[7:]} token embeddings...')
+        calculate_token_embeddings(dataset, rep[7:], device)
+    elif set(rep.split(',')) <= set(PEPCLM_POOLINGS):
         print('Calculating PeptideCLM representations...')
-        calculate_pepclm(dataset)
+        calculate_pepclm(dataset, device,
+                         [PEPCLM_POOLINGS[r] for r in rep.split(',')],
+                         batch_size)
     elif rep == 'pepland':
         print('Calculating Pepland representations...')
         calculate_pepland(dataset)
     elif rep == 'pepfunn':
         print('Calculating pepfunn fingerprint...')
         calculate_pepfunnfp(dataset)
+    elif rep.startswith('gram-') and \
+            ('esm' in rep or 'prot' in rep or 'prost' in rep):
+        print(f'Calculating {rep[5:].upper()} representations with Gram '
+              'pooling...')
+        calculate_esm_gram(dataset, rep[5:], device)
     elif 'new-esm' in rep or 'new-prot' in rep or 'new-prost' in rep:
         print(f'Calculating {rep.upper()} representations...')
         calculate_new_esm(dataset, rep.replace('new-', ''), device)
@@ -0,0 +1,69 @@
+import os
+import os.path as osp
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+from typing import List
+
+import pandas as pd
+import typer
+
+from metrics import evaluate_batch
+from utils.artifacts import iter_artifacts, load_artifact
+
+
+def score_artifact(path: str, metric_names: List[str] = None) -> List[dict]:
+    artifact = load_artifact(path)
+    df = evaluate_batch(artifact['preds'], artifact['truth'],
+                        artifact['pred_task'], metric_names)
+    for key, value in artifact['unit'].items():
+        df[key] = value
+    df['seed'] = artifact['seeds']
+    return df.to_dict('records')
+
+
+def _sort_key(row: dict) -> tuple:
+    th = row.get('threshold')
+    return (row['seed'], isinstance(th, str), th if th is not None else 0)
+
+
+def main(
+    experiment: str = typer.Argument(
+        ..., help='Results directory, e.g., `no-generalisation`.'),
+    metric: List[str] = typer.Option(
+        None, help='Metrics to compute. Defaults to all in `metrics.py`.'),
+    dataset: List[str] = typer.Option(None, help='Datasets to rescore.'),
+    output_dir: str = None,
+    n_jobs: int = cpu_count()
+):
+    results_dir = osp.join(osp.dirname(__file__), '..', 'Results', experiment)
+    if output_dir is None:
+        output_dir = osp.join(osp.dirname(__file__), '..', 'Results',
+                              'rescored', experiment)
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = list(iter_artifacts(results_dir))
+    if dataset:
+        paths = [path for path in paths
+                 if osp.basename(osp.dirname(path)).split('_')[0] in dataset]
+    if len(paths) == 0:
+        print(f'Warning: no artifacts found in {results_dir}.')
+        return
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        scores = pool.map(score_artifact, paths,
+                          [metric or None] * len(paths), chunksize=16)
+        by_file = {}
+        for path, rows in zip(paths, scores):
+            by_file.setdefault(osp.basename(osp.dirname(path)), []).extend(rows)
+
+    for name, rows in by_file.items():
+        rows.sort(key=_sort_key)
+        pd.DataFrame(rows).to_csv(osp.join(output_dir, f'{name}.csv'),
+                                  index=False)
+    print(f'Rescored {len(paths)} runs into {len(by_file)} files in '
+          f'{output_dir}.')
+
+
+if __name__ == '__main__':
+    typer.run(main)
@@ -0,0 +1,283 @@
+"""Runs the interpolation and extrapolation benchmarks as a single job grid.
+
+Every (dataset, representation, model, seed, threshold) unit of
+`evaluation.py` and every (dataset, representation, model, seed, train_set)
+unit of `evaluation_ood.py` becomes an independent job. Jobs are run on a
+process pool, longest first, without ever using more cores than the budget.
+"""
+import os
+import os.path as osp
+import pickle
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from multiprocessing import cpu_count
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import typer
+
+from utils.journal import (append_unit, compact, completed_units,
+                           journal_path, unit_key)
+from utils.results_db import write_results
+from utils.work_queue import format_exception
+
+
+DATASETS = ['c-binding', 'c-cpp', 'c-antibacterial', 'c-antiviral',
+            'nc-binding', 'nc-cpp', 'nc-antibacterial', 'nc-antiviral']
+EXPERIMENTS = ['interpolation', 'extrapolation']
+# Threads used by a single model fit; the HPO loop itself is sequential.
+MODEL_THREADS = {'svm': 1, 'lightgbm': 4, 'rf': 4}
+
+
+def _data_path(dataset: str) -> str:
+    return osp.join(osp.dirname(__file__), '..', 'downstream_data',
+                    f'{dataset}.csv')
+
+
+@lru_cache(maxsize=None)
+def _load_df(dataset: str) -> pd.DataFrame:
+    df = pd.read_csv(_data_path(dataset))
+    df['name'] = dataset
+    return df
+
+
+@lru_cache(maxsize=None)
+def _load_thresholds(dataset: str) -> Tuple[tuple, ...]:
+    import evaluation
+
+    return tuple(evaluation.load_thresholds(dataset, _load_df(dataset)))
+
+
+@lru_cache(maxsize=None)
+def _load_x(dataset: str, representation: str):
+    import evaluation
+
+    return evaluation.load_representation(dataset, representation)
+
+
+@lru_cache(maxsize=None)
+def _load_x_ood(dataset: str, representation: str):
+    import evaluation_ood
+
+    return evaluation_ood.load_representations(dataset, representation)
+
+
+@lru_cache(maxsize=None)
+def _feature_dim(dataset: str, representation: str) -> int:
+    dim = 0
+    for rep in representation.split(','):
+        path = osp.join(osp.dirname(__file__), '..', 'reps',
+                        f'{rep}_{dataset}.pickle')
+        dim += len(pickle.load(open(path, 'rb'))[0])
+    return dim
+
+
+def expand_grid(reps: List[str], models: List[str], datasets: List[str],
+                experiments: List[str], train_sets: List[str],
+                n_seeds: int, n_seeds_ood: int) -> List[dict]:
+    """Expands the benchmark into independent jobs with a runtime estimate.
+
+    The estimate is the number of training rows times the feature
+    dimension, which is only used to order the jobs.
+    """
+    jobs = []
+    for rep in reps:
+        for model in models:
+            if 'interpolation' in experiments:
+                for dataset in datasets:
+                    dim = _feature_dim(dataset, rep)
+                    for th_idx, (th, part) in enumerate(
+                        _load_thresholds(dataset)
+                    ):
+                        n_rows = len(part['train']) + len(part['valid'])
+                        for seed in range(n_seeds):
+                            jobs.append({
+                                'experiment': 'interpolation',
+                                'dataset': dataset, 'model': model,
+                                'rep': rep, 'seed': seed,
+                                'threshold': th, 'order': (seed, th_idx),
+                                'cost': n_rows * dim
+                            })
+            if 'extrapolation' in experiments:
+                ood_datasets = sorted(set(d.split('-')[-1] for d in datasets))
+                for dataset in ood_datasets:
+                    for train_set in train_sets:
+                        source = 'c' if train_set == 'standard' else 'nc'
+                        n_rows = len(_load_df(f'{source}-{dataset}'))
+                        dim = _feature_dim(f'{source}-{dataset}', rep)
+                        for seed in range(n_seeds_ood):
+                            jobs.append({
+                                'experiment': train_set,
+                                'dataset': dataset, 'model': model,
+                                'rep': rep, 'seed': seed,
+                                'threshold': None, 'order': (seed, 0),
+                                'cost': n_rows * dim
+                            })
+    return sorted(jobs, key=lambda job: job['cost'], reverse=True)
+
+
+def _results_path(job: dict) -> str:
+    if job['experiment'] == 'interpolation':
+        import evaluation
+
+        return evaluation.get_results_path(job['dataset'], job['model'],
+                                           job['rep'])
+    import evaluation_ood
+
+    return evaluation_ood.get_results_path(job['dataset'], job['model'],
+                                           job['rep'], job['experiment'])
+
+
+def run_job(job: dict, n_jobs: int, save_model: bool = False) -> List[dict]:
+    from threadpoolctl import threadpool_limits
+    import optuna
+
+    optuna.logging.set_verbosity(optuna.logging.CRITICAL)
+    with threadpool_limits(limits=n_jobs):
+        if job['experiment'] == 'interpolation':
+            import evaluation
+            import numpy as np
+
+            np.random.seed(job['seed'])
+            partitions = dict(_load_thresholds(job['dataset']))[
+                job['threshold']]
+            result = evaluation.run_threshold(
+                evaluation.get_pred_task(job['dataset']), job['model'],
+                _load_x(job['dataset'], job['rep']),
+                _load_df(job['dataset']).labels.to_numpy(),
+                partitions, job['seed'], n_jobs, _results_path(job),
+                _unit(job), save_model
+            )
+            result['seed'] = job['seed']
+            result['threshold'] = job['threshold']
+            return [result]
+
+        import evaluation_ood
+
+        result_df = evaluation_ood.experiment(
+            job['dataset'], job['model'], job['rep'], job['experiment'],
+            _load_df(f"c-{job['dataset']}"),
+            _load_df(f"nc-{job['dataset']}"),
+            job['seed'], n_jobs, _load_x_ood(job['dataset'], job['rep']),
+            _results_path(job), save_model
+        )
+        return result_df.to_dict('records')
+
+
+def _init_worker():
+    # Each job gets its thread budget explicitly; keep BLAS from
+    # spawning one thread per core in every worker.
+    for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        os.environ[var] = '1'
+
+
+def _unit(job: dict) -> dict:
+    if job['experiment'] == 'interpolation':
+        return {'seed': job['seed'], 'threshold': job['threshold']}
+    return {'seed': job['seed']}
+
+
+def _describe(job: dict) -> str:
+    return (f"{job['experiment']} {job['dataset']} {job['model']} "
+            f"{job['rep']} seed={job['seed']} threshold={job['threshold']}")
+
+
+def run_grid(jobs: List[dict], cores: int,
+             save_model: bool = False) -> Dict[str, pd.DataFrame]:
+    """Runs the jobs longest-first, keeping the sum of the threads in use
+    below `cores`. Completed jobs are appended to the journal of their
+    output file, so that a restarted grid skips them. A job that fails is
+    reported at the end instead of stopping the grid. Returns the results
+    for each output file.
+    """
+    journals, expected = {}, {}
+    for job in jobs:
+        path = _results_path(job)
+        if path not in journals:
+            journals[path] = journal_path(path)
+            expected[path] = 0
+    done_units = {path: completed_units(journal)
+                  for path, journal in journals.items()}
+    pending = []
+    for job in jobs:
+        path = _results_path(job)
+        if unit_key(_unit(job)) not in done_units[path]:
+            pending.append(job)
+            expected[path] += 1
+    print(f'{len(jobs) - len(pending)} jobs already completed.')
+
+    written = {}
+    for path in expected:
+        if expected[path] == 0:
+            written[path] = compact(journals[path], path)
+            write_results(written[path], path)
+    free = cores
+    running, failed = {}, []
+
+    with ProcessPoolExecutor(max_workers=cores,
+                             initializer=_init_worker) as pool:
+        while pending or running:
+            idx = 0
+            while idx < len(pending):
+                job = pending[idx]
+                threads = min(MODEL_THREADS.get(job['model'], 1), cores)
+                if threads <= free:
+                    future = pool.submit(run_job, job, threads, save_model)
+                    running[future] = (job, threads)
+                    free -= threads
+                    pending.pop(idx)
+                else:
+                    idx += 1
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, threads = running.pop(future)
+                free += threads
+                path = _results_path(job)
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    # The other jobs, and those done at the same time, are
+                    # still journaled.
+                    failed.append((job, e))
+                    print(f'Failed: {_describe(job)}: {e}')
+                    continue
+                append_unit(journals[path], _unit(job), rows,
+                            order=list(job['order']))
+                expected[path] -= 1
+                print(f'Done: {_describe(job)}')
+                if expected[path] == 0:
+                    written[path] = compact(journals[path], path)
+                    write_results(written[path], path)
+    if failed:
+        print(f'Warning: {len(failed)} jobs failed and are retried when the '
+              'grid is run again:')
+        for job, e in failed:
+            print(f'{_describe(job)}:\n{format_exception(e)}')
+    return written
+
+
+def main(
+    rep: List[str] = typer.Option(..., help='Representation(s) to evaluate.'),
+    model: List[str] = typer.Option(..., help='Model(s) to evaluate.'),
+    dataset: List[str] = typer.Option(DATASETS, help='Datasets to use.'),
+    experiment: List[str] = typer.Option(EXPERIMENTS),
+    train_set: List[str] = typer.Option(['standard']),
+    cores: int = cpu_count(),
+    n_seeds: int = 5,
+    n_seeds_ood: int = 25,
+    dry_run: bool = False,
+    save_model: bool = False
+):
+    jobs = expand_grid(rep, model, dataset, experiment, train_set,
+                       n_seeds, n_seeds_ood)
+    print(f'Scheduling {len(jobs)} jobs on {cores} cores.')
+    if dry_run:
+        print(pd.DataFrame(jobs).drop(columns='order').to_string())
+        return
+    run_grid(jobs, cores, save_model)
+
+
+if __name__ == '__main__':
+    typer.run(main)
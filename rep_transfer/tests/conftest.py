@@ -0,0 +1,7 @@
+import os.path as osp
+import sys
+
+# The scripts of `rep_transfer` import each other as top-level modules.
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..'))
+
+RESULTS_DIR = osp.join(osp.dirname(__file__), '..', '..', 'Results')
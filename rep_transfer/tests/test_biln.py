@@ -0,0 +1,112 @@
+import random
+
+import pandas as pd
+import pytest
+
+from utils.biln import BILNConverter
+
+
+SPECIAL_1 = ['ac-', 'deca-', 'glyco-', 'medl-', 'Mono21-', 'Mono22-']
+SPECIAL_2 = ['-pip']
+CANONICAL = {
+    "ALA": "A", "ASP": "D", "GLU": "E", "PHE": "F", "HIS": "H",
+    "ILE": "I", "LYS": "K", "LEU": "L", "MET": "M", "GLY": "G",
+    "ASN": "N", "PRO": "P", "GLN": "Q", "ARG": "R", "SER": "S",
+    "THR": "T", "VAL": "V", "TRP": "W", "TYR": "Y", "CYS": "C"
+}
+# Monomers that contain one another, three-letter codes that cascade into
+# one-letter codes and a monomer listed twice.
+MONOMERS = SPECIAL_1 + SPECIAL_2 + [
+    'D-Ala', 'D-Al', 'Ala', 'N-Me-Ala', 'Me-Ala', 'ALA', 'SER', 'MSE',
+    'Orn', 'Dab', 'Aib', 'Nle', 'Hyp', 'ac', 'pip', 'D-Ala', 'A', 'Sar',
+]
+ALPHABET = 'ACDEFGHIKLMNPQRSTVWYacdeilnopbr'
+TOKENS = [m.strip('-') for m in MONOMERS] + list(CANONICAL) + \
+    list(CANONICAL.values())
+
+
+def _old_fasta2biln(seq: str, monomers: list) -> str:
+    """The per-monomer loop that `BILNConverter` replaced."""
+    biln = '-'.join(seq)
+    new_biln = biln
+    for monomer in monomers:
+        if (f'-{monomer}-' in biln or f'({monomer}-' in biln or
+           f'-{monomer}(' in biln):
+            new_biln = new_biln.replace(monomer, f'[{monomer}]')
+        elif monomer in SPECIAL_1 and f'{monomer}-' in biln:
+            new_biln = new_biln.replace(monomer, f'[{monomer}]')
+        elif monomer in SPECIAL_2 and f'-{monomer}' in biln:
+            new_biln = new_biln.replace(monomer, f'[{monomer}]')
+        elif monomer in CANONICAL:
+            new_biln = new_biln.replace(monomer, CANONICAL[monomer])
+    for monomer in CANONICAL:
+        new_biln = new_biln.replace(monomer, CANONICAL[monomer])
+    return new_biln
+
+
+def _old_pepseqres2biln(biln: str, monomers: list) -> str:
+    new_biln = biln
+    for monomer in monomers:
+        if (f'-{monomer}-' in biln or f'({monomer}-' in biln or
+           f'-{monomer}(' in biln):
+            new_biln = new_biln.replace(monomer, f'[{monomer}]')
+        elif monomer in SPECIAL_1 and f'{monomer}-' in biln:
+            new_biln = new_biln.replace(monomer, f'[{monomer}]')
+        elif monomer in SPECIAL_2 and f'-{monomer}' in biln:
+            new_biln = new_biln.replace(monomer, f'[{monomer}]')
+    for monomer in CANONICAL:
+        new_biln = new_biln.replace(monomer, CANONICAL[monomer])
+    return new_biln
+
+
+def _seqres(rng: random.Random) -> str:
+    tokens = [rng.choice(TOKENS) for _ in range(rng.randint(1, 12))]
+    biln = '-'.join(tokens)
+    if rng.random() < 0.3:
+        biln = f'{rng.choice(SPECIAL_1)}{biln}'
+    if rng.random() < 0.3:
+        biln = f'{biln}{rng.choice(SPECIAL_2)}'
+    if rng.random() < 0.2 and len(tokens) > 2:
+        # A branch, as in cyclic or stapled peptides.
+        idx = biln.index('-')
+        biln = f'{biln[:idx]}({rng.choice(TOKENS)}-{biln[idx:]})'
+    return biln
+
+
+@pytest.fixture(params=['full', 'empty', 'special'])
+def monomers(request):
+    return {'full': MONOMERS, 'empty': [],
+            'special': SPECIAL_1 + SPECIAL_2}[request.param]
+
+
+def test_fasta2biln(monomers):
+    converter = BILNConverter(monomers, SPECIAL_1, SPECIAL_2, CANONICAL)
+    rng = random.Random(0)
+    for _ in range(2000):
+        seq = ''.join(rng.choice(ALPHABET)
+                      for _ in range(rng.randint(1, 30)))
+        assert converter.fasta2biln(seq) == _old_fasta2biln(seq, monomers)
+
+
+def test_pepseqres2biln(monomers):
+    converter = BILNConverter(monomers, SPECIAL_1, SPECIAL_2, CANONICAL)
+    rng = random.Random(1)
+    for _ in range(2000):
+        biln = _seqres(rng)
+        assert converter.pepseqres2biln(biln) == \
+            _old_pepseqres2biln(biln, monomers)
+
+
+def test_series():
+    converter = BILNConverter(MONOMERS, SPECIAL_1, SPECIAL_2, CANONICAL)
+    rng = random.Random(2)
+    seqs = pd.Series([''.join(rng.choice(ALPHABET) for _ in range(8))
+                      for _ in range(50)] * 3, index=range(300, 150, -1))
+    bilns = pd.Series([_seqres(rng) for _ in range(50)] * 3)
+    pd.testing.assert_series_equal(
+        converter.fasta2biln_series(seqs),
+        seqs.map(lambda seq: _old_fasta2biln(seq, MONOMERS)).astype(object))
+    pd.testing.assert_series_equal(
+        converter.pepseqres2biln_series(bilns),
+        bilns.map(lambda biln: _old_pepseqres2biln(biln, MONOMERS))
+        .astype(object))
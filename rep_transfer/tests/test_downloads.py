@@ -0,0 +1,137 @@
+import hashlib
+import io
+import os
+import os.path as osp
+import threading
+import zipfile
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import downloads
+from utils.downloads import ChecksumError, fetch, fetch_all, unpack
+
+
+def _zip_bytes() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr('data/peptides.csv', 'sequence,labels\nAC,1\n')
+    return buffer.getvalue()
+
+
+FILES = {
+    '/data.bin': bytes(range(256)) * 64,
+    '/archive.zip': _zip_bytes(),
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves `FILES`, with range requests, and records every request."""
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        content = FILES.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+            if start >= len(content):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{len(content) - 1}/'
+                             f'{len(content)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server, path: str) -> str:
+    return f'http://127.0.0.1:{server.server_address[1]}{path}'
+
+
+def _part_path(cache_dir: str, url: str) -> str:
+    os.makedirs(osp.join(cache_dir, 'partial'), exist_ok=True)
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return osp.join(cache_dir, 'partial', f'{name}.part')
+
+
+def test_fetch_caches(server, tmp_path):
+    url = _url(server, '/data.bin')
+    path = fetch(url, cache_dir=str(tmp_path))
+    assert open(path, 'rb').read() == FILES['/data.bin']
+    assert fetch(url, cache_dir=str(tmp_path)) == path
+    assert len(server.requests) == 1
+
+
+def test_fetch_resumes_truncated_part(server, tmp_path):
+    url = _url(server, '/data.bin')
+    content = FILES['/data.bin']
+    with open(_part_path(str(tmp_path), url), 'wb') as fo:
+        fo.write(content[:1000])
+    path = fetch(url, cache_dir=str(tmp_path))
+    assert open(path, 'rb').read() == content
+    assert server.requests == [('/data.bin', 'bytes=1000-')]
+
+
+def test_fetch_restarts_after_416(server, tmp_path):
+    url = _url(server, '/data.bin')
+    content = FILES['/data.bin']
+    # Longer than the content, which the server rejects.
+    with open(_part_path(str(tmp_path), url), 'wb') as fo:
+        fo.write(content + b'stale')
+    path = fetch(url, cache_dir=str(tmp_path))
+    assert open(path, 'rb').read() == content
+    assert server.requests == [('/data.bin', f'bytes={len(content) + 5}-'),
+                               ('/data.bin', None)]
+
+
+def test_fetch_checksum(server, tmp_path):
+    url = _url(server, '/data.bin')
+    with pytest.raises(ChecksumError):
+        fetch(url, sha256='0' * 64, cache_dir=str(tmp_path))
+    assert not osp.exists(_part_path(str(tmp_path), url))
+    digest = hashlib.sha256(FILES['/data.bin']).hexdigest()
+    path = fetch(url, sha256=digest, cache_dir=str(tmp_path))
+    assert osp.basename(path) == digest
+
+
+def test_fetch_all_shares_urls(server, tmp_path):
+    url = _url(server, '/data.bin')
+    paths = fetch_all({'first': url, 'second': url},
+                      cache_dir=str(tmp_path))
+    assert paths['first'] == paths['second']
+    assert len(server.requests) == 1
+
+
+def test_unpack_once(server, tmp_path, monkeypatch):
+    path = fetch(_url(server, '/archive.zip'), cache_dir=str(tmp_path))
+    calls = []
+    unpack_archive = downloads.shutil.unpack_archive
+    monkeypatch.setattr(downloads.shutil, 'unpack_archive',
+                        lambda *args, **kwargs: calls.append(args) or
+                        unpack_archive(*args, **kwargs))
+    out_dir = unpack(path, str(tmp_path), 'zip')
+    assert unpack(path, str(tmp_path), 'zip') == out_dir
+    assert len(calls) == 1
+    with open(osp.join(out_dir, 'data', 'peptides.csv')) as fi:
+        assert fi.read() == 'sequence,labels\nAC,1\n'
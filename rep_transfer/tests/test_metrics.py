@@ -0,0 +1,176 @@
+import glob
+import os.path as osp
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scipy.stats import pearsonr, spearmanr
+from sklearn.metrics import (accuracy_score, f1_score, log_loss,
+                             matthews_corrcoef, mean_absolute_error,
+                             mean_squared_error, precision_score, r2_score,
+                             recall_score, roc_auc_score)
+
+from conftest import RESULTS_DIR
+from metrics import (_resample_weights, bootstrap_evaluate, evaluate,
+                     evaluate_batch)
+
+CONFUSION_METRICS = ['mcc', 'acc', 'f1', 'f1_weighted', 'precision',
+                     'recall', 'log_loss']
+
+
+def _sklearn_class(preds, truth):
+    labels = preds > 0.5
+    out = {
+        'mcc': matthews_corrcoef(truth, labels),
+        'acc': accuracy_score(truth, labels),
+        'f1': f1_score(truth, labels, zero_division=0),
+        'f1_weighted': f1_score(truth, labels, average='weighted',
+                                zero_division=0),
+        'precision': precision_score(truth, labels, zero_division=0),
+        'recall': recall_score(truth, labels, zero_division=1),
+        'tp': int((labels & (truth == 1)).sum()),
+        'tn': int((~labels & (truth == 0)).sum()),
+        'fp': int((labels & (truth == 0)).sum()),
+        'fn': int((~labels & (truth == 1)).sum()),
+    }
+    try:
+        out['auroc'] = roc_auc_score(truth, preds)
+    except ValueError:
+        out['auroc'] = 0.
+    try:
+        out['log_loss'] = log_loss(labels, truth)
+    except ValueError:
+        out['log_loss'] = 0.
+    return out
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_classification_matches_sklearn(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 200))
+    truth = rng.integers(0, 2, n)
+    # Rounded so that some predictions tie.
+    preds = np.round(rng.random(n), 1 + seed % 3)
+    if seed % 5 == 0:
+        preds = np.full(n, 0.2)
+    got = evaluate(preds, truth, 'class')
+    for key, value in _sklearn_class(preds, truth).items():
+        assert got[key] == pytest.approx(value, rel=1e-9, abs=1e-12), key
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_regression_matches_sklearn(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(3, 200))
+    truth = rng.normal(size=n)
+    preds = np.round(truth + rng.normal(size=n), 1)
+    got = evaluate(preds, truth, 'reg')
+    expected = {
+        'mse': mean_squared_error(truth, preds),
+        'mae': mean_absolute_error(truth, preds),
+        'pcc': pearsonr(preds, truth)[0],
+        'spcc': spearmanr(preds, truth)[0],
+        'r2': r2_score(truth, preds),
+    }
+    for key, value in expected.items():
+        assert got[key] == pytest.approx(value, rel=1e-9, abs=1e-12), key
+
+
+def test_batch_matches_single():
+    rng = np.random.default_rng(0)
+    preds = [rng.random(n) for n in (10, 50, 30)]
+    truth = [rng.integers(0, 2, n) for n in (10, 50, 30)]
+    batch = evaluate_batch(preds, truth, 'class')
+    for idx, (p, t) in enumerate(zip(preds, truth)):
+        single = evaluate(p, t, 'class')
+        for key, value in single.items():
+            assert batch[key][idx] == pytest.approx(value), key
+
+
+def _resamples(n: int, n_samples: int, seed: int):
+    """The resamples that `bootstrap_evaluate` draws with `seed`, as
+    indices."""
+    np.random.seed(seed)
+    weights = _resample_weights(n, n_samples).astype(int)
+    return [np.repeat(np.arange(n), counts) for counts in weights]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_bootstrap_classification_matches_sklearn(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(5, 60))
+    truth = rng.integers(0, 2, n)
+    preds = np.round(rng.random(n), 1)
+    np.random.seed(seed)
+    got = bootstrap_evaluate(preds, truth, 'class', 50, all_results=True)
+    for idx, sample in enumerate(_resamples(n, 50, seed)):
+        expected = _sklearn_class(preds[sample], truth[sample])
+        if len(np.unique(truth[sample])) < 2:
+            # Undefined, and left out of the summary.
+            expected['auroc'] = np.nan
+        for key, value in expected.items():
+            assert got[key][idx] == pytest.approx(value, rel=1e-9, abs=1e-12,
+                                                  nan_ok=True), key
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_bootstrap_regression_matches_scipy(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(5, 60))
+    truth = rng.normal(size=n)
+    preds = np.round(truth + rng.normal(size=n), 1)
+    np.random.seed(seed)
+    got = bootstrap_evaluate(preds, truth, 'reg', 50, all_results=True)
+    for idx, sample in enumerate(_resamples(n, 50, seed)):
+        p, t = preds[sample], truth[sample]
+        expected = {
+            'mse': mean_squared_error(t, p),
+            'mae': mean_absolute_error(t, p),
+            'pcc': pearsonr(p, t)[0],
+            'spcc': spearmanr(p, t)[0],
+            'r2': r2_score(t, p),
+        }
+        for key, value in expected.items():
+            assert got[key][idx] == pytest.approx(value, rel=1e-9,
+                                                  abs=1e-12), key
+
+
+def test_bootstrap_summary():
+    rng = np.random.default_rng(0)
+    truth = rng.integers(0, 2, 40)
+    preds = rng.random(40)
+    np.random.seed(0)
+    scores = bootstrap_evaluate(preds, truth, 'class', 200,
+                                all_results=True)
+    np.random.seed(0)
+    summary = bootstrap_evaluate(preds, truth, 'class', 200, ci=0.9)
+    for key, values in scores.items():
+        assert summary[key] == pytest.approx({
+            'mean': np.nanmean(values),
+            'ci_lower': np.nanpercentile(values, 5),
+            'ci_upper': np.nanpercentile(values, 95)
+        }), key
+
+
+def _published_classification():
+    paths = sorted(glob.glob(osp.join(RESULTS_DIR, '*', '*.csv')))
+    return [path for path in paths
+            if 'tp' in pd.read_csv(path, nrows=0).columns]
+
+
+@pytest.mark.parametrize('path', _published_classification(),
+                         ids=osp.basename)
+def test_published_results(path):
+    """The results in `Results` were scored by autopeptideml's
+    `evaluate`. Predictions with their confusion matrix get the same
+    scores, except for `fp` and `fn`, which it swapped."""
+    for row in pd.read_csv(path).to_dict('records'):
+        tp, tn, fn, fp = (int(row[key]) for key in ('tp', 'tn', 'fp', 'fn'))
+        truth = np.array([1] * tp + [0] * tn + [0] * fp + [1] * fn)
+        preds = np.array([.9] * tp + [.1] * tn + [.9] * fp + [.1] * fn)
+        got = evaluate(preds, truth, 'class')
+        for key in CONFUSION_METRICS:
+            assert got[key] == pytest.approx(row[key], rel=1e-9,
+                                             abs=1e-12), key
+        assert (got['fp'], got['fn']) == (row['fn'], row['fp'])
@@ -0,0 +1,96 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scipy.stats import wilcoxon
+
+from utils.significance import (cached_pairwise_wilcoxon, pairwise_wilcoxon,
+                                significance_clusters)
+
+
+def _scipy_pvalue(x: np.ndarray, y: np.ndarray, alternative: str) -> float:
+    """`wilcoxon`, with undefined tests at p-value 1 as in the rankings."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            pvalue = wilcoxon(x, y, alternative=alternative)[1]
+        except ValueError:
+            return 1.
+    return 1. if np.isnan(pvalue) else pvalue
+
+
+def _groups(n: int, kind: str, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if kind == 'continuous':
+        values = rng.normal(size=(3, n))
+    elif kind == 'integer':
+        # Ties and zeros.
+        values = rng.integers(0, 4, size=(3, n)).astype(float)
+    else:
+        values = np.round(rng.normal(size=(3, n)), 1)
+    values[2, :n // 2] = values[0, :n // 2]
+    return values
+
+
+# Exact null distribution, permutation test with ties or zeros and normal
+# approximation. The permutation tests of scipy are slow above 10 pairs.
+@pytest.mark.parametrize('n', [3, 6, 10, 20, 50, 51, 120])
+@pytest.mark.parametrize('kind', ['continuous', 'integer', 'rounded'])
+@pytest.mark.parametrize('alternative', ['greater', 'less', 'two-sided'])
+def test_pairwise_matches_scipy(n, kind, alternative):
+    values = _groups(n, kind, n)
+    got = pairwise_wilcoxon(values, alternative)
+    assert len(got) == 6
+    for (i, j), pvalue in got.items():
+        assert pvalue == pytest.approx(
+            _scipy_pvalue(values[i], values[j], alternative),
+            rel=1e-9, abs=1e-12), (i, j)
+
+
+def test_pairwise_identical_groups():
+    values = np.tile(np.arange(5.), (2, 1))
+    assert pairwise_wilcoxon(values) == {(0, 1): 1., (1, 0): 1.}
+
+
+def test_pairwise_subset_of_pairs():
+    values = _groups(30, 'rounded', 0)
+    assert pairwise_wilcoxon(values, pairs=[(2, 0)]) == \
+        {(2, 0): pairwise_wilcoxon(values)[(2, 0)]}
+
+
+class _DictCache(dict):
+    def get_pvalue(self, key):
+        return self.get(key)
+
+    def set_pvalue(self, key, pvalue):
+        self[key] = pvalue
+
+
+def test_cached_pairwise_wilcoxon():
+    rng = np.random.default_rng(0)
+    scores = pd.DataFrame(rng.normal(size=(40, 3)), columns=['b', 'a', 'c'],
+                          index=pd.MultiIndex.from_product(
+                              [range(20), range(2)]))
+    # Only the keys that both groups have are paired.
+    scores.iloc[:15, 2] = np.nan
+    cache = _DictCache()
+    pvalues = cached_pairwise_wilcoxon(scores, cache)
+    assert len(pvalues) == 6 and len(cache) == 6
+    for (name1, name2), pvalue in pvalues.items():
+        shared = scores[[name1, name2]].dropna()
+        assert pvalue == pytest.approx(_scipy_pvalue(
+            shared[name1].to_numpy(), shared[name2].to_numpy(), 'greater'))
+
+    cache.set_pvalue = None
+    assert cached_pairwise_wilcoxon(scores, cache) == pvalues
+
+
+def test_significance_clusters():
+    names = ['a', 'b', 'c', 'd']
+    pvalues = {('b', 'c'): 0.5, ('b', 'd'): 0.001, ('d', 'a'): 0.5}
+    # `c` is not worse than `b`, which anchors the first cluster, `d` is,
+    # and starts the next.
+    assert significance_clusters(names, pvalues) == [1, 1, 1, 2]
+    assert significance_clusters(names, pvalues, alpha=1e-4) == [1, 1, 1, 1]
@@ -0,0 +1,63 @@
+import glob
+import os.path as osp
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.spe_tokenizer import SPE_FILE, VOCAB_FILE, SPETokenizer
+
+
+DATA_DIR = osp.join(osp.dirname(__file__), '..', '..', 'downstream_data')
+
+
+def _smiles() -> list:
+    smiles = []
+    for path in sorted(glob.glob(osp.join(DATA_DIR, '*.csv'))):
+        smiles.extend(pd.read_csv(path)['SMILES'].dropna())
+    return list(dict.fromkeys(smiles))
+
+
+def _perturbed(smiles: list, n: int) -> list:
+    """Random cuts and splices of `smiles`, and a few degenerate strings."""
+    rng = random.Random(0)
+    out = ['', 'C', '[', '()', 'Q', 'CC(=O)', 'c1ccccc1', '[Na+].[Cl-]']
+    for _ in range(n):
+        a, b = rng.choice(smiles), rng.choice(smiles)
+        i, j = sorted(rng.randrange(len(a) + 1) for _ in range(2))
+        out.append(a[i:j] + b[rng.randrange(len(b) + 1):])
+    return out
+
+
+@pytest.fixture(scope='module')
+def smiles():
+    return _smiles()
+
+
+def test_tokens(smiles):
+    tokenizer_module = pytest.importorskip('SmilesPE.tokenizer')
+    with open(SPE_FILE, encoding='utf-8') as fi:
+        reference = tokenizer_module.SPE_Tokenizer(fi)
+    tokenizer = SPETokenizer()
+    for smi in smiles + _perturbed(smiles, 1000):
+        assert tokenizer.tokenize(smi) == reference.tokenize(smi).split(' ')
+
+
+def test_encode_batch(smiles):
+    pytest.importorskip('SmilesPE')
+    pytest.importorskip('transformers')
+    from utils.pepclm_tokenizer import SMILES_SPE_Tokenizer
+
+    reference = SMILES_SPE_Tokenizer(VOCAB_FILE, SPE_FILE)
+    tokenizer = SPETokenizer()
+    batch = smiles[:200] + _perturbed(smiles, 200)
+    for start in range(0, len(batch), 32):
+        expected = reference(batch[start:start + 32], return_tensors='np',
+                             padding='longest')
+        encoded = tokenizer.encode_batch(batch[start:start + 32])
+        # Depending on its version, transformers may leave out
+        # `token_type_ids`, which are all zeros.
+        assert not encoded['token_type_ids'].any()
+        for key, value in expected.items():
+            np.testing.assert_array_equal(encoded[key], value)
@@ -0,0 +1,67 @@
+import os
+
+from utils import work_queue
+from utils.work_queue import Lease, WorkQueue
+
+
+def _submit(root: str, lease: float = 900.) -> WorkQueue:
+    queue = WorkQueue(root, lease=lease, max_attempts=2)
+    queue.submit([{'dataset': 'c-cpp'}, {'dataset': 'nc-cpp'}],
+                 ['c-cpp', 'nc-cpp'])
+    return queue
+
+
+def test_claim_complete_fail(tmp_path):
+    queue = _submit(str(tmp_path))
+    lease = queue.claim('w1')
+    assert lease.job == {'dataset': 'c-cpp', 'name': 'c-cpp',
+                         'attempts': 1, 'worker': 'w1'}
+    assert lease.complete()
+    assert queue.list('done') == ['0000000_c-cpp.json']
+
+    for _ in range(2):
+        lease = queue.claim('w2')
+        assert lease.job['name'] == 'nc-cpp'
+        assert lease.fail('error')
+    assert queue.claim('w2') is None
+    assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 1,
+                              'failed': 1}
+    assert queue.failed()[0]['error'] == 'error'
+
+
+def test_expired_lease_is_not_completed(tmp_path):
+    queue = _submit(str(tmp_path), lease=900.)
+    lease = queue.claim('w1')
+    os.utime(lease.path, (0, 0))
+    assert queue.requeue_expired() == 1
+    assert not lease.complete()
+    assert queue.counts()['done'] == 0
+
+
+def test_lease_expiring_while_moved(tmp_path, monkeypatch):
+    """A lease that expires right after its last heartbeat is left to the
+    worker that requeued it, not written back and completed as well."""
+    queue = _submit(str(tmp_path), lease=-1.)
+    lease = queue.claim('w1')
+    heartbeat = Lease.heartbeat
+
+    def expiring_heartbeat(self):
+        alive = heartbeat(self)
+        queue.requeue_expired()
+        return alive
+
+    monkeypatch.setattr(Lease, 'heartbeat', expiring_heartbeat)
+    assert not lease.complete()
+    assert queue.counts() == {'pending': 2, 'leased': 0, 'done': 0,
+                              'failed': 0}
+
+
+def test_claim_of_vanished_job(tmp_path, monkeypatch):
+    queue = _submit(str(tmp_path))
+
+    def vanished(path):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(work_queue, '_read', vanished)
+    assert queue.claim('w1') is None
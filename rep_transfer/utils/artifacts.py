@@ -0,0 +1,94 @@
+"""Per-run prediction artifacts for re-scoring without retraining.
+
+Every unit of work (e.g., one seed and threshold) stores its test indices,
+ground truth, predictions and the chosen hyperparameters as an uncompressed
+`.npz` in a hidden `.artifacts/<results-file>/` directory next to the
+results CSV. `preds` has one row per scored model, so that the extrapolation
+runs, which score every fold model separately, fit the same layout.
+Optionally, the fitted model is pickled next to it.
+"""
+import json
+import os
+import os.path as osp
+import pickle
+
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .journal import _to_builtin
+
+
+def artifact_dir(results_path: str) -> str:
+    results_dir, filename = osp.split(results_path)
+    return osp.join(results_dir, '.artifacts', osp.splitext(filename)[0])
+
+
+def artifact_name(unit: dict) -> str:
+    return '_'.join(f'{key}-{value}' for key, value in sorted(unit.items()))
+
+
+def save_artifact(results_path: str, unit: dict, pred_task: str,
+                  preds: np.ndarray, truth: np.ndarray,
+                  test_idx: Optional[np.ndarray] = None,
+                  seeds: Optional[List[int]] = None,
+                  params: Optional[dict] = None,
+                  model: Optional[object] = None) -> str:
+    """Stores the predictions of a unit of work and returns the path."""
+    out_dir = artifact_dir(results_path)
+    os.makedirs(out_dir, exist_ok=True)
+    path = osp.join(out_dir, f'{artifact_name(unit)}.npz')
+
+    preds = np.atleast_2d(np.asarray(preds, dtype=np.float32))
+    if test_idx is None:
+        test_idx = np.arange(preds.shape[1])
+    if seeds is None:
+        seeds = [unit.get('seed', 0)] * preds.shape[0]
+
+    tmp_path = f'{path[:-4]}.tmp.npz'
+    np.savez(
+        tmp_path,
+        preds=preds,
+        truth=np.asarray(truth, dtype=np.float32),
+        test_idx=np.asarray(test_idx, dtype=np.int32),
+        seeds=np.asarray(seeds, dtype=np.int32),
+        unit=np.array(json.dumps(unit, default=_to_builtin)),
+        pred_task=np.array(pred_task),
+        params=np.array(json.dumps(params, default=_to_builtin))
+    )
+    os.replace(tmp_path, path)
+
+    if model is not None:
+        tmp_path = f'{path[:-4]}.tmp.pickle'
+        pickle.dump(model, open(tmp_path, 'wb'))
+        os.replace(tmp_path, f'{path[:-4]}.pickle')
+    return path
+
+
+def load_artifact(path: str) -> Dict[str, object]:
+    with np.load(path) as data:
+        artifact = {key: data[key] for key in data.files}
+    for key in ['unit', 'params']:
+        artifact[key] = json.loads(str(artifact[key]))
+    artifact['pred_task'] = str(artifact['pred_task'])
+    return artifact
+
+
+def load_model(path: str):
+    model_path = f'{osp.splitext(path)[0]}.pickle'
+    if not osp.exists(model_path):
+        raise FileNotFoundError(f'No model was stored with {path}.')
+    return pickle.load(open(model_path, 'rb'))
+
+
+def iter_artifacts(results_dir: str) -> Iterator[str]:
+    """Paths of all artifacts stored for the results files in
+    `results_dir`."""
+    root = osp.join(results_dir, '.artifacts')
+    if not osp.isdir(root):
+        return
+    for name in sorted(os.listdir(root)):
+        run_dir = osp.join(root, name)
+        for filename in sorted(os.listdir(run_dir)):
+            if filename.endswith('.npz') and '.tmp.' not in filename:
+                yield osp.join(run_dir, filename)
@@ -0,0 +1,127 @@
+"""Compiled converter of FASTA and PDB SEQRES sequences into BILN.
+
+The original conversion checks every monomer of the library against the
+sequence and replaces it wherever it appears, one monomer after another.
+`BILNConverter` finds the monomers that occur in a sequence with a single
+scan of one compiled regular expression and only replays the replacements
+of those, in library order, so its output is identical, including for
+monomers that contain one another or appear more than once in the library.
+"""
+import re
+
+from typing import Dict, List
+
+import pandas as pd
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """Regular expression that matches the longest of `words` at a
+    position, with the words merged into a trie so that the regex engine
+    does not try every word at every position."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def to_pattern(node: dict) -> str:
+        branches = [re.escape(char) + to_pattern(child)
+                    for char, child in sorted(node.items()) if char != '']
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else \
+            '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # Greedy, so that longer words are preferred.
+            pattern = f'(?:{pattern})?'
+        return pattern
+
+    return to_pattern(trie)
+
+
+class BILNConverter:
+    """
+    :param monomers: Monomer library, in the order in which the monomers
+        are bracketed.
+    :param special_1: Monomers that are bracketed when they start a chain.
+    :param special_2: Monomers that are bracketed when they end a chain.
+    :param canonical: Three-letter to one-letter codes of the canonical
+        amino acids.
+    """
+    def __init__(self, monomers: List[str], special_1: List[str],
+                 special_2: List[str], canonical: Dict[str, str]):
+        self.monomers = list(monomers)
+        self.special_1 = set(special_1)
+        self.special_2 = set(special_2)
+        self.canonical = dict(canonical)
+
+        # Positions of every monomer in the library, which may list a
+        # monomer more than once.
+        self.positions = {}
+        for idx, monomer in enumerate(self.monomers):
+            self.positions.setdefault(monomer, []).append(idx)
+        unique = list(self.positions)
+        # At every position, the lookahead matches the longest monomer that
+        # starts there; the others are its prefixes.
+        self.pattern = re.compile(
+            f'(?=({_trie_pattern(unique)}))') if unique else None
+        self.prefixes = {
+            monomer: [other for other in unique if monomer.startswith(other)]
+            for monomer in unique
+        }
+
+    def _found(self, sequence: str) -> List[str]:
+        """Monomers of the library in `sequence`, in library order and
+        repeated as in the library."""
+        if self.pattern is None:
+            return []
+        found = set()
+        for match in self.pattern.finditer(sequence):
+            longest = match.group(1)
+            if longest not in found:
+                found.update(self.prefixes[longest])
+        idxs = sorted(idx for monomer in found
+                      for idx in self.positions[monomer])
+        return [self.monomers[idx] for idx in idxs]
+
+    def _to_one_letter(self, biln: str) -> str:
+        for monomer, code in self.canonical.items():
+            if monomer in biln:
+                biln = biln.replace(monomer, code)
+        return biln
+
+    def _bracket(self, biln: str, canonical_branch: bool) -> str:
+        new_biln = biln
+        for monomer in self._found(biln):
+            if (f'-{monomer}-' in biln or f'({monomer}-' in biln or
+               f'-{monomer}(' in biln):
+                new_biln = new_biln.replace(monomer, f'[{monomer}]')
+            elif monomer in self.special_1 and f'{monomer}-' in biln:
+                new_biln = new_biln.replace(monomer, f'[{monomer}]')
+            elif monomer in self.special_2 and f'-{monomer}' in biln:
+                new_biln = new_biln.replace(monomer, f'[{monomer}]')
+            elif canonical_branch and monomer in self.canonical:
+                new_biln = new_biln.replace(monomer, self.canonical[monomer])
+        return new_biln
+
+    def fasta2biln(self, seq: str) -> str:
+        return self._to_one_letter(self._bracket('-'.join(seq), True))
+
+    def pepseqres2biln(self, biln: str) -> str:
+        return self._to_one_letter(self._bracket(biln, False))
+
+    def fasta2biln_series(self, seqs: pd.Series) -> pd.Series:
+        """`fasta2biln` of every element, converting repeated sequences
+        once."""
+        return self._map_unique(seqs, self.fasta2biln)
+
+    def pepseqres2biln_series(self, bilns: pd.Series) -> pd.Series:
+        return self._map_unique(bilns, self.pepseqres2biln)
+
+    @staticmethod
+    def _map_unique(values: pd.Series, fn) -> pd.Series:
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        converted = [fn(value) for value in uniques]
+        return pd.Series([converted[code] for code in codes],
+                         index=values.index, dtype=object)
@@ -0,0 +1,191 @@
+"""Faster inference of the language models on CPU.
+
+`CPUInference` wraps a model with any of:
+
+- dynamic int8 quantization of its linear layers,
+- bfloat16 autocast, by default only where the CPU has native bfloat16
+  instructions (AVX512-BF16 or AMX) and the model is not quantized,
+- `torch.compile`, whose compiled kernels are cached in
+  `<cache>/torch-compile`, or TorchScript tracing, whose traced modules are
+  saved in `<cache>/torchscript` and reused by later runs,
+
+and sets the number of intra- and inter-op threads of PyTorch. All of them
+change the embeddings slightly, so `cosine_deviation` measures how far the
+embeddings of a sample of inputs are from those of the fp32 eager model.
+"""
+import os
+import os.path as osp
+
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from .downloads import CACHE_DIR
+
+
+COMPILE_MODES = ['none', 'compile', 'trace']
+
+
+def bf16_supported() -> bool:
+    """Whether the CPU has native bfloat16 instructions."""
+    try:
+        with open('/proc/cpuinfo') as fi:
+            flags = fi.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def cosine_deviation(reference: Sequence[np.ndarray],
+                     other: Sequence[np.ndarray]) -> Dict[str, float]:
+    """Mean and maximum of `1 - cos` between the embeddings of the same
+    inputs, which may be matrices of token embeddings."""
+    deviation = []
+    for ref, oth in zip(reference, other):
+        ref = np.ravel(ref).astype(np.float64)
+        oth = np.ravel(oth).astype(np.float64)
+        norm = np.linalg.norm(ref) * np.linalg.norm(oth)
+        deviation.append(1 - ref @ oth / max(norm, 1e-12))
+    return {'mean': float(np.mean(deviation)),
+            'max': float(np.max(deviation))}
+
+
+class _Output(dict):
+    """Dictionary output of a traced model with the attribute access of the
+    outputs of transformers."""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _module():
+    import torch
+
+    class OptimizedModel(torch.nn.Module):
+        def __init__(self, model, bf16: bool, trace_path: Optional[str]):
+            super().__init__()
+            self.model = model
+            self.bf16 = bf16
+            self.trace_path = trace_path
+            self.traced = None
+
+        def _trace(self, inputs: dict):
+            # A traced module only accepts the inputs it was traced with.
+            path = f"{self.trace_path}_{'-'.join(sorted(inputs))}.pt"
+            if osp.exists(path):
+                self.traced = torch.jit.load(path)
+                return
+            self.traced = torch.jit.trace(self.model,
+                                          example_kwarg_inputs=inputs,
+                                          strict=False)
+            os.makedirs(osp.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            torch.jit.save(self.traced, tmp_path)
+            os.replace(tmp_path, path)
+
+        def forward(self, **inputs):
+            if self.bf16:
+                autocast = torch.autocast('cpu', dtype=torch.bfloat16)
+            else:
+                autocast = torch.autocast('cpu', enabled=False)
+            with autocast:
+                if self.trace_path is None:
+                    return self.model(**inputs)
+                if self.traced is None:
+                    self._trace(inputs)
+                output = self.traced(**inputs)
+            if isinstance(output, dict):
+                return _Output(output)
+            return _Output(last_hidden_state=output[0])
+
+    return OptimizedModel
+
+
+class CPUInference:
+    """
+    :param quantize: Quantize the linear layers to int8 dynamically.
+    :param bf16: `'auto'` to use bfloat16 autocast only if the CPU supports
+        it natively and the model is not quantized, `'on'` or `'off'`.
+    :param compile: `'none'`, `'compile'` for `torch.compile` or `'trace'`
+        for TorchScript tracing.
+    :param threads: Intra-op threads, all the cores if `None`.
+    :param interop_threads: Inter-op threads, PyTorch's default if `None`.
+    :param check_size: Inputs whose embeddings are compared with those of
+        the fp32 eager model, none if 0.
+    :param cache_dir: Directory of the compiled and traced models.
+    """
+    def __init__(self, quantize: bool = False, bf16: str = 'auto',
+                 compile: str = 'none', threads: Optional[int] = None,
+                 interop_threads: Optional[int] = None,
+                 check_size: int = 64, cache_dir: str = CACHE_DIR):
+        if compile not in COMPILE_MODES:
+            raise ValueError(f'Compile mode: {compile} is not supported. '
+                             f'Choose one of: {", ".join(COMPILE_MODES)}.')
+        if bf16 not in ['auto', 'on', 'off']:
+            raise ValueError(f'bf16: {bf16} is not one of: auto, on, off.')
+        if quantize and bf16 == 'on':
+            raise ValueError('Quantized linear layers do not accept '
+                             'bfloat16 inputs, use either quantize or bf16.')
+        self.quantize = quantize
+        self.bf16 = bf16 == 'on' or (bf16 == 'auto' and not quantize and
+                                     bf16_supported())
+        self.compile = compile
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.check_size = check_size
+        self.cache_dir = cache_dir
+
+    def __str__(self) -> str:
+        return (f'quantize={self.quantize}, bf16={self.bf16}, '
+                f'compile={self.compile}, threads={self.threads}, '
+                f'interop_threads={self.interop_threads}')
+
+    def setup(self):
+        """Sets the threads of PyTorch. Must be called before any model
+        runs."""
+        import torch
+
+        if self.threads is not None:
+            torch.set_num_threads(self.threads)
+        if self.interop_threads is not None:
+            torch.set_num_interop_threads(self.interop_threads)
+        if self.compile == 'compile':
+            os.environ.setdefault(
+                'TORCHINDUCTOR_CACHE_DIR',
+                osp.join(self.cache_dir, 'torch-compile'))
+
+    def optimize(self, model, name: str):
+        """`model`, in evaluation mode on the CPU, with the optimizations.
+        `name` identifies the model in the cache of traced models."""
+        import torch
+
+        model = model.to('cpu').eval().requires_grad_(False)
+        if self.compile == 'trace':
+            # Traced modules are reused only for the same weights.
+            with torch.no_grad():
+                checksum = sum(float(param.double().sum())
+                               for param in model.parameters())
+        if self.quantize:
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8)
+        trace_path = None
+        if self.compile == 'compile':
+            model = torch.compile(model, dynamic=True)
+        elif self.compile == 'trace':
+            trace_path = osp.join(
+                self.cache_dir, 'torchscript',
+                f"{name.replace('/', '_')}_{checksum:.6e}_"
+                f"torch-{torch.__version__}_"
+                f"{'int8' if self.quantize else 'fp32'}"
+                f"{'-bf16' if self.bf16 else ''}")
+        return _module()(model, self.bf16, trace_path).eval()
+
+    def report(self, name: str, reference: Sequence[np.ndarray],
+               other: Sequence[np.ndarray]) -> Dict[str, float]:
+        deviation = cosine_deviation(reference, other)
+        print(f"{name} ({self}): cosine deviation from fp32 on "
+              f"{len(reference)} inputs, mean {deviation['mean']:.2e}, "
+              f"max {deviation['max']:.2e}.")
+        return deviation
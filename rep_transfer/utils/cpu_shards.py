@@ -0,0 +1,178 @@
+"""Data-parallel inference of the language models on multi-socket CPUs.
+
+A single PyTorch process stops scaling long before it uses all the cores of
+a large machine. `map_sharded` instead forks several workers, each pinned
+to its own group of cores, from `cpu_groups`, which follow the NUMA nodes,
+and running PyTorch with as many threads as it has cores. The model is
+loaded once, before forking, so its weights are shared copy-on-write by
+all the workers. The inputs are split into shards whose total lengths are
+proportional to the cores of their workers, and every worker writes its outputs straight into arrays in shared memory,
+in the original order of the inputs.
+"""
+import glob
+import os
+import time
+import traceback
+
+from multiprocessing import get_context, shared_memory
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from tqdm import tqdm
+
+
+def _parse_cpulist(cpulist: str) -> List[int]:
+    """Cores of a Linux cpu list, e.g., `0-3,8-11`."""
+    cores = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        cores.extend(range(int(start), int(end or start) + 1))
+    return cores
+
+
+def numa_nodes() -> List[List[int]]:
+    """Cores of each NUMA node that this process may run on, a single node
+    with all of them where the topology is not available."""
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    paths = glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')
+    for path in sorted(paths, key=lambda p: int(p.split('node')[-1]
+                                                 .split('/')[0])):
+        with open(path) as fi:
+            cores = [core for core in _parse_cpulist(fi.read())
+                     if core in allowed]
+        if cores:
+            nodes.append(cores)
+    return nodes or [sorted(allowed)]
+
+
+def cpu_groups(n_workers: int) -> List[List[int]]:
+    """Cores of each of `n_workers`. Workers are spread evenly over the
+    NUMA nodes and split the cores of their node, so that no worker spans
+    two nodes unless there are fewer workers than nodes."""
+    nodes = numa_nodes()
+    n_cores = sum(len(node) for node in nodes)
+    if n_workers > n_cores:
+        raise ValueError(f'{n_workers} workers do not fit in the {n_cores} '
+                         'available cores.')
+    if n_workers < len(nodes):
+        return [sorted(core for idx in part for core in nodes[idx])
+                for part in np.array_split(np.arange(len(nodes)),
+                                           n_workers)]
+    groups = []
+    for idx, node in enumerate(nodes):
+        n_node_workers = len(range(idx, n_workers, len(nodes)))
+        # More workers than cores in a small node go to the others.
+        n_node_workers = min(n_node_workers, len(node))
+        groups.extend(part.tolist() for part in
+                      np.array_split(np.array(node), n_node_workers))
+    while len(groups) < n_workers:
+        largest = max(range(len(groups)), key=lambda i: len(groups[i]))
+        cores = groups.pop(largest)
+        groups.extend([cores[:len(cores) // 2], cores[len(cores) // 2:]])
+    return groups
+
+
+def balanced_shards(lengths: Sequence[int],
+                    capacities: Sequence[int]) -> List[np.ndarray]:
+    """Positions of the inputs of each shard, longest first, such that the
+    total length of each shard is about proportional to its capacity, e.g.,
+    the cores of the worker that runs it."""
+    lengths = np.asarray(lengths)
+    capacities = np.asarray(capacities, dtype=np.float64)
+    shards = [[] for _ in range(len(capacities))]
+    totals = np.zeros(len(capacities))
+    for idx in np.argsort(-lengths, kind='stable'):
+        # The shard that would finish this input first.
+        shard = int(np.argmin((totals + lengths[idx]) / capacities))
+        shards[shard].append(idx)
+        totals[shard] += lengths[idx]
+    return [np.array(shard, dtype=np.int64) for shard in shards]
+
+
+def _work(compute: Callable[[np.ndarray], Dict[str, np.ndarray]],
+          shard: np.ndarray, cores: List[int], threads: Optional[int],
+          chunk_size: int, out: Dict[str, np.ndarray], progress: np.ndarray,
+          worker: int):
+    try:
+        import torch
+
+        os.sched_setaffinity(0, cores)
+        torch.set_num_threads(threads or len(cores))
+        for start in range(0, len(shard), chunk_size):
+            idxs = shard[start:start + chunk_size]
+            for key, values in compute(idxs).items():
+                out[key][idxs] = values
+            progress[worker] += len(idxs)
+    except BaseException:
+        traceback.print_exc()
+        os._exit(1)
+    os._exit(0)
+
+
+def map_sharded(compute: Callable[[np.ndarray], Dict[str, np.ndarray]],
+                lengths: Sequence[int], n_workers: int,
+                threads: Optional[int] = None, chunk_size: int = 256,
+                verbose: bool = True) -> Dict[str, np.ndarray]:
+    """Outputs of `compute` for every input, computed by `n_workers` forked
+    processes.
+
+    :param compute: Arrays, `(len(idxs), ...)`, of the inputs at positions
+        `idxs`, e.g., one per pooling. The model it runs must be loaded
+        before calling this function, so that the workers share it.
+    :param lengths: Length of every input, to balance the shards.
+    :param threads: Intra-op threads of each worker, as many as its cores
+        if `None`.
+    :param chunk_size: Inputs given to `compute` at a time.
+    """
+    lengths = np.asarray(lengths)
+    if len(lengths) == 0:
+        return {}
+    groups = cpu_groups(n_workers)
+    shards = balanced_shards(lengths, [len(cores) for cores in groups])
+    # The shapes of the outputs, from the shortest input.
+    first = compute(np.array([np.argmin(lengths)]))
+    segments, out = [], {}
+    for key, values in first.items():
+        shape = (len(lengths),) + values.shape[1:]
+        size = max(int(np.prod(shape)) * values.dtype.itemsize, 1)
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        segments.append(segment)
+        out[key] = np.ndarray(shape, dtype=values.dtype, buffer=segment.buf)
+    progress_segment = shared_memory.SharedMemory(
+        create=True, size=n_workers * 8)
+    segments.append(progress_segment)
+    progress = np.ndarray((n_workers,), dtype=np.int64,
+                          buffer=progress_segment.buf)
+    progress[:] = 0
+    try:
+        context = get_context('fork')
+        workers = [
+            context.Process(target=_work,
+                            args=(compute, shard, cores, threads,
+                                  chunk_size, out, progress, worker))
+            for worker, (shard, cores) in enumerate(zip(shards, groups))
+        ]
+        for worker in workers:
+            worker.start()
+        with tqdm(total=len(lengths), disable=not verbose) as pbar:
+            while any(worker.is_alive() for worker in workers):
+                pbar.update(int(progress.sum()) - pbar.n)
+                time.sleep(0.5)
+            pbar.update(int(progress.sum()) - pbar.n)
+        for worker in workers:
+            worker.join()
+        failed = [idx for idx, worker in enumerate(workers)
+                  if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError(f'Workers {failed} failed, see their '
+                               'errors above.')
+        return {key: values.copy() for key, values in out.items()}
+    finally:
+        out = progress = None
+        for segment in segments:
+            segment.close()
+            segment.unlink()
@@ -0,0 +1,42 @@
+"""Selection of the device used to compute the representations."""
+
+
+def available_device() -> str:
+    """Best available accelerator: `cuda`, then `mps`, then `cpu`."""
+    try:
+        import torch
+    except ImportError:
+        return 'cpu'
+    if torch.cuda.is_available():
+        return 'cuda'
+    mps = getattr(torch.backends, 'mps', None)
+    if mps is not None and mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def device_count(device: str) -> int:
+    """Number of models that can run at the same time on `device`, one per
+    GPU. `cpu` has no device slots."""
+    if device == 'cuda':
+        import torch
+
+        return max(torch.cuda.device_count(), 1)
+    if device == 'mps':
+        return 1
+    return 0
+
+
+def select_device(device: str = 'auto') -> str:
+    """Resolves `auto` to the best available device. A requested device
+    that is not available falls back, with a warning, to the best available
+    one, ultimately the CPU."""
+    available = available_device()
+    if device == 'auto':
+        return available
+    kind = device.split(':')[0]
+    if kind in ('cuda', 'mps') and kind != available:
+        print(f'Warning: device {device} is not available, using '
+              f'{available}.')
+        return available
+    return device
@@ -0,0 +1,174 @@
+"""Concurrent, resumable downloads into a content-addressed local cache.
+
+Every file is stored once, under the SHA-256 of its content, in
+`<cache>/blobs/`, and `<cache>/urls.json` maps the URLs to their hashes, so
+a URL that was downloaded before is not fetched again, whichever dataset
+needs it. Interrupted downloads are kept in `<cache>/partial/` and resumed
+with HTTP range requests. Archives are unpacked once into
+`<cache>/unpacked/<hash>/`. The cache is `~/.cache/peptide-benchmarks`
+unless `PEPTIDE_BENCHMARKS_CACHE` points elsewhere.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import os.path as osp
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request as request
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple, Union
+
+from .partition_index import file_sha256
+
+
+CACHE_DIR = os.environ.get(
+    'PEPTIDE_BENCHMARKS_CACHE',
+    osp.join(osp.expanduser('~'), '.cache', 'peptide-benchmarks')
+)
+CHUNK_SIZE = 1 << 20
+_index_lock = threading.Lock()
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def _index_path(cache_dir: str) -> str:
+    return osp.join(cache_dir, 'urls.json')
+
+
+def _read_index(cache_dir: str) -> Dict[str, str]:
+    if not osp.exists(_index_path(cache_dir)):
+        return {}
+    return json.load(open(_index_path(cache_dir)))
+
+
+def _add_to_index(cache_dir: str, url: str, digest: str):
+    with _index_lock:
+        index = _read_index(cache_dir)
+        index[url] = digest
+        tmp_path = f'{_index_path(cache_dir)}.{os.getpid()}.tmp'
+        json.dump(index, open(tmp_path, 'w'), indent=1)
+        os.replace(tmp_path, _index_path(cache_dir))
+
+
+def blob_path(digest: str, cache_dir: str = CACHE_DIR) -> str:
+    return osp.join(cache_dir, 'blobs', digest[:2], digest)
+
+
+def _download(url: str, part_path: str, timeout: float):
+    """Downloads `url` into `part_path`, resuming from its current size."""
+    offset = osp.getsize(part_path) if osp.exists(part_path) else 0
+    req = request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    if offset > 0:
+        req.add_header('Range', f'bytes={offset}-')
+    try:
+        response = request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 416:
+            # The partial file is not a prefix of the current content.
+            os.remove(part_path)
+            return _download(url, part_path, timeout)
+        raise
+    with response:
+        if offset > 0 and response.status != 206:
+            offset = 0
+        expected = response.headers.get('Content-Length')
+        expected = None if expected is None else offset + int(expected)
+        with open(part_path, 'ab' if offset > 0 else 'wb') as fo:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                fo.write(chunk)
+    if expected is not None and osp.getsize(part_path) != expected:
+        raise urllib.error.URLError(
+            f'Incomplete download of {url}: {osp.getsize(part_path)} of '
+            f'{expected} bytes.')
+
+
+def fetch(url: str, sha256: Optional[str] = None,
+          cache_dir: str = CACHE_DIR, retries: int = 3,
+          timeout: float = 60.) -> str:
+    """Path of the cached content of `url`, which is downloaded if it is not
+    in the cache. If `sha256` is given, the content must match it.
+
+    :raises urllib.error.URLError: If the download fails `retries` times,
+        or `ConnectionError` or `TimeoutError`, whichever the last attempt
+        raised.
+    :raises ChecksumError: If the content does not match `sha256`.
+    """
+    digest = sha256 or _read_index(cache_dir).get(url)
+    if digest is not None and osp.exists(blob_path(digest, cache_dir)):
+        return blob_path(digest, cache_dir)
+
+    partial_dir = osp.join(cache_dir, 'partial')
+    os.makedirs(partial_dir, exist_ok=True)
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    part_path = osp.join(partial_dir, f'{name}.part')
+    # Other processes downloading the same URL wait for this one.
+    with open(osp.join(partial_dir, f'{name}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        digest = sha256 or _read_index(cache_dir).get(url)
+        if digest is not None and osp.exists(blob_path(digest, cache_dir)):
+            return blob_path(digest, cache_dir)
+
+        for attempt in range(retries):
+            try:
+                _download(url, part_path, timeout)
+                break
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                if attempt == retries - 1:
+                    raise
+                time.sleep(2 ** attempt)
+
+        digest = file_sha256(part_path)
+        if sha256 is not None and digest != sha256:
+            os.remove(part_path)
+            raise ChecksumError(f'{url} has SHA-256 {digest}, expected '
+                                f'{sha256}.')
+        os.makedirs(osp.dirname(blob_path(digest, cache_dir)), exist_ok=True)
+        os.replace(part_path, blob_path(digest, cache_dir))
+        _add_to_index(cache_dir, url, digest)
+    return blob_path(digest, cache_dir)
+
+
+def fetch_all(sources: Dict[str, Union[str, Tuple[str, Optional[str]]]],
+              cache_dir: str = CACHE_DIR,
+              max_workers: int = 8) -> Dict[str, Union[str, Exception]]:
+    """Fetches all `sources` (name: url or (url, sha256)) concurrently.
+    Returns the cached path of each, or the exception that stopped it."""
+    sources = {name: (source, None) if isinstance(source, str) else source
+               for name, source in sources.items()}
+    unique = sorted(set(sources.values()), key=str)
+
+    def _fetch(source):
+        try:
+            return fetch(source[0], source[1], cache_dir)
+        except (urllib.error.URLError, ChecksumError, OSError) as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(min(max_workers,
+                                                len(unique)), 1)) as pool:
+        paths = dict(zip(unique, pool.map(_fetch, unique)))
+    return {name: paths[source] for name, source in sources.items()}
+
+
+def unpack(path: str, cache_dir: str = CACHE_DIR,
+           archive_format: Optional[str] = None) -> str:
+    """Directory with the contents of the cached archive at `path`, which
+    is only extracted the first time."""
+    digest = osp.basename(path)
+    out_dir = osp.join(cache_dir, 'unpacked', digest)
+    if osp.isdir(out_dir):
+        return out_dir
+    os.makedirs(osp.dirname(out_dir), exist_ok=True)
+    tmp_dir = f'{out_dir}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.unpack_archive(path, tmp_dir, format=archive_format)
+    try:
+        os.rename(tmp_dir, out_dir)
+    except OSError:
+        # Unpacked at the same time by another thread or process.
+        shutil.rmtree(tmp_dir)
+    return out_dir
@@ -0,0 +1,79 @@
+"""Compact Gram (second-order) representations of the language models.
+
+The Gram pooling of a model with `dim` features has `dim ** 2` values per
+input. Two smaller alternatives are provided:
+
+- `gram_triu` keeps the exact Gram matrix, but only its upper triangle
+  and in float16, about a quarter of the memory.
+- `tensor_sketch` wraps a model so that the hidden state of every token is
+  replaced by the Tensor Sketch of its outer product with itself, computed
+  on the device of the model. The sketch is linear, so the mean of the
+  sketches over the tokens, e.g., the mean pooling of `RepEngineLM`, is
+  the sketch of the mean Gram matrix, with `out_dim` values, and the inner
+  products of sketches approximate those of the Gram matrices (Pham and
+  Pagh, 2013; Gao et al., Compact Bilinear Pooling, 2016).
+"""
+import math
+
+import numpy as np
+
+from .lm_inference import call_model
+
+
+def gram_triu(reps) -> np.ndarray:
+    """`(n_inputs, dim * (dim + 1) / 2)` float16 upper triangles of Gram
+    matrices, given as `(dim, dim)` or flattened `dim ** 2` arrays."""
+    reps = np.stack([np.asarray(rep) for rep in reps])
+    dim = math.isqrt(int(np.prod(reps.shape[1:])))
+    if dim * dim != np.prod(reps.shape[1:]):
+        raise ValueError(f'Representations of shape {reps.shape[1:]} are '
+                         'not square Gram matrices.')
+    rows, cols = np.triu_indices(dim)
+    return reps.reshape(len(reps), dim, dim)[:, rows, cols].astype(
+        np.float16)
+
+
+def _module():
+    import torch
+
+    class TensorSketch(torch.nn.Module):
+        def __init__(self, model, dim: int, out_dim: int, seed: int):
+            super().__init__()
+            self.model = model
+            self.out_dim = out_dim
+            generator = torch.Generator().manual_seed(seed)
+            for idx in range(2):
+                self.register_buffer(f'hash{idx}', torch.randint(
+                    out_dim, (dim,), generator=generator))
+                self.register_buffer(f'sign{idx}', torch.randint(
+                    2, (dim,), generator=generator).float() * 2 - 1)
+
+        def _count_sketch(self, hidden, idx: int):
+            sketch = hidden.new_zeros(hidden.shape[:-1] + (self.out_dim,))
+            return sketch.index_add_(
+                -1, getattr(self, f'hash{idx}'),
+                hidden * getattr(self, f'sign{idx}'))
+
+        def forward(self, input_ids=None, attention_mask=None,
+                    token_type_ids=None, decoder_input_ids=None):
+            from transformers.modeling_outputs import BaseModelOutput
+
+            hidden = call_model(self.model, input_ids, attention_mask,
+                                token_type_ids,
+                                decoder_input_ids).last_hidden_state
+            # FFTs are not available in half precision on every device.
+            hidden = hidden.float()
+            sketch = torch.fft.irfft(
+                torch.fft.rfft(self._count_sketch(hidden, 0)) *
+                torch.fft.rfft(self._count_sketch(hidden, 1)),
+                n=self.out_dim)
+            return BaseModelOutput(last_hidden_state=sketch)
+
+    return TensorSketch
+
+
+def tensor_sketch(model, out_dim: int, seed: int = 0):
+    """`model` whose last hidden states are the `out_dim` Tensor Sketches
+    of the outer products of its hidden states. The same `seed` gives the
+    same sketch, which every dataset must share."""
+    return _module()(model, model.config.hidden_size, out_dim, seed)
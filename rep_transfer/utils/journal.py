@@ -0,0 +1,112 @@
+"""Append-only results journal for resumable evaluations.
+
+Each completed unit of work (e.g., one seed and threshold) is appended as a
+single JSON line, so a crash can lose at most the unit that was running.
+Writers on several nodes each append to their own shard of the journal,
+from `shard_path`, since `flock` is not reliable over NFS. `compact` turns
+the journal and its shards into the usual `Results/` CSV.
+"""
+import fcntl
+import json
+import os
+import os.path as osp
+import socket
+
+from typing import List, Optional, Set, Tuple
+
+import pandas as pd
+
+
+def _to_builtin(obj):
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def unit_key(unit: dict) -> Tuple:
+    return tuple(sorted(unit.items()))
+
+
+def journal_path(results_path: str) -> str:
+    """Journal used to build `results_path`, kept in a hidden
+    `.journal` directory next to it."""
+    results_dir, filename = osp.split(results_path)
+    journal_dir = osp.join(results_dir, '.journal')
+    os.makedirs(journal_dir, exist_ok=True)
+    return osp.join(journal_dir, f'{osp.splitext(filename)[0]}.jsonl')
+
+
+def _shard_dir(path: str) -> str:
+    return f'{osp.splitext(path)[0]}.shards'
+
+
+def shard_path(path: str, shard: str) -> str:
+    """Shard `shard` of the journal at `path`, written by a single writer,
+    e.g., one worker, and read along with the journal."""
+    os.makedirs(_shard_dir(path), exist_ok=True)
+    return osp.join(_shard_dir(path), f'{shard}.jsonl')
+
+
+def _journal_files(path: str) -> List[str]:
+    shard_dir = _shard_dir(path)
+    shards = []
+    if osp.isdir(shard_dir):
+        shards = [osp.join(shard_dir, f) for f in sorted(os.listdir(shard_dir))
+                  if f.endswith('.jsonl')]
+    return [path] + shards
+
+
+def append_unit(path: str, unit: dict, rows: List[dict],
+                order: Optional[list] = None):
+    """Atomically appends the result rows of a completed unit."""
+    record = {'unit': unit, 'order': order, 'rows': rows}
+    line = (json.dumps(record, default=_to_builtin) + '\n').encode('utf-8')
+    fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # A crash during an earlier append may have left a torn last line,
+        # which would swallow this record if it were not terminated.
+        size = os.fstat(fd).st_size
+        if size and os.pread(fd, 1, size - 1) != b'\n':
+            line = b'\n' + line
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def read_journal(path: str) -> List[dict]:
+    """Reads all complete records of the journal and its shards. A
+    partially written line, left by a crash during `append_unit`, is
+    ignored."""
+    records = {}
+    for file_path in _journal_files(path):
+        if not osp.exists(file_path):
+            continue
+        with open(file_path, 'r', encoding='utf-8') as fi:
+            for line in fi:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[unit_key(record['unit'])] = record
+    return list(records.values())
+
+
+def completed_units(path: str) -> Set[Tuple]:
+    return set(unit_key(record['unit']) for record in read_journal(path))
+
+
+def compact(path: str, results_path: str) -> pd.DataFrame:
+    """Writes the rows of every unit in the journal and its shards to
+    `results_path`, ordered by the `order` of each unit."""
+    records = read_journal(path)
+    records.sort(key=lambda r: r['order'] if r['order'] is not None else [])
+    rows = [row for record in records for row in record['rows']]
+    df = pd.DataFrame(rows)
+    # Workers on several nodes may compact the same journal at once.
+    tmp_path = f'{results_path}.{socket.gethostname()}.{os.getpid()}.tmp'
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, results_path)
+    return df
@@ -0,0 +1,159 @@
+"""Batched inference of language models with pooling on the device.
+
+`embed` runs a model over the length-sorted batches of a `RaggedTokens`.
+Every requested pooling of the last hidden states is computed from the same
+forward pass, as one tensor operation per batch, and copied to the host
+once per batch into preallocated arrays in the original order of the
+inputs.
+
+`stack_layers` wraps a model so that its last hidden states are those of
+several layers side by side, which code that only reads the last hidden
+states, such as `RepEngineLM`, then pools all at once. `split_layers`
+separates them again.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from tqdm import tqdm
+
+from .token_store import RaggedTokens
+
+
+POOLINGS = ['mean', 'cls', 'max', 'gram']
+
+
+def pool_hidden_states(hidden, attention_mask, poolings: List[str]) -> dict:
+    """Pooled `hidden` states, `(batch, length, dim)`, over the positions
+    of `attention_mask`, whichever side the padding is on.
+
+    `mean` and `max` are taken over all the tokens, including `[CLS]` and
+    `[SEP]`; `cls` is the first unmasked token; `gram` is the upper
+    triangle of the mean outer product of the token states,
+    `dim * (dim + 1) / 2` values.
+    """
+    import torch
+
+    mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+    count = mask.sum(1).clamp(min=1)
+    pooled = {}
+    for pooling in poolings:
+        if pooling == 'mean':
+            pooled[pooling] = (hidden * mask).sum(1) / count
+        elif pooling == 'cls':
+            first = attention_mask.to(torch.int8).argmax(1)
+            pooled[pooling] = hidden[
+                torch.arange(len(hidden), device=hidden.device), first]
+        elif pooling == 'max':
+            pooled[pooling] = hidden.masked_fill(
+                mask == 0, torch.finfo(hidden.dtype).min).max(1).values
+        elif pooling == 'gram':
+            masked = hidden * mask
+            gram = torch.einsum('bld,ble->bde', masked, masked) / \
+                count.unsqueeze(-1)
+            rows, cols = torch.triu_indices(gram.shape[1], gram.shape[2],
+                                            device=gram.device)
+            pooled[pooling] = gram[:, rows, cols]
+        else:
+            raise ValueError(f'Pooling: {pooling} is not supported. '
+                             f'Choose one of: {", ".join(POOLINGS)}.')
+    return pooled
+
+
+def embed(model, tokens: RaggedTokens, pad_token_id: int, device: str,
+          poolings: List[str], batch_size: int = 8,
+          verbose: bool = True) -> Dict[str, np.ndarray]:
+    """`(n_inputs, dim)` float32 array of each pooling of the last hidden
+    states of `model` for every input of `tokens`."""
+    import torch
+
+    out = {}
+    batches = tokens.batches(batch_size, pad_token_id)
+    with torch.inference_mode():
+        for idxs, batch in tqdm(batches, total=-(-len(tokens) // batch_size),
+                                disable=not verbose):
+            inputs = {key: torch.from_numpy(value).to(device)
+                      for key, value in batch.items()}
+            hidden = model(**inputs).last_hidden_state
+            pooled = pool_hidden_states(hidden, inputs['attention_mask'],
+                                        poolings)
+            for pooling, values in pooled.items():
+                values = values.float().cpu().numpy()
+                if pooling not in out:
+                    out[pooling] = np.empty((len(tokens), values.shape[1]),
+                                            dtype=np.float32)
+                out[pooling][idxs] = values
+    return out
+
+
+def resolve_layers(layers: Optional[str], n_layers: int) -> List[int]:
+    """Indices of the hidden states in `layers`, `'all'` or comma-separated
+    indices, where 0 is the output of the embeddings and `n_layers` that of
+    the last layer. Negative indices count from the last layer."""
+    if layers is None:
+        return [n_layers]
+    if layers == 'all':
+        return list(range(n_layers + 1))
+    out = []
+    for layer in layers.split(','):
+        layer = int(layer)
+        if layer < 0:
+            layer += n_layers + 1
+        if not 0 <= layer <= n_layers:
+            raise ValueError(f'Layer {layer} is not one of the {n_layers} '
+                             'layers of the model.')
+        if layer not in out:
+            out.append(layer)
+    return out
+
+
+def call_model(model, input_ids=None, attention_mask=None,
+               token_type_ids=None, decoder_input_ids=None, **kwargs):
+    """`model` called with the inputs that are given. Wrappers of models
+    have these explicit inputs, which TorchScript tracing requires."""
+    inputs = {'input_ids': input_ids, 'attention_mask': attention_mask,
+              'token_type_ids': token_type_ids,
+              'decoder_input_ids': decoder_input_ids}
+    return model(**{key: value for key, value in inputs.items()
+                    if value is not None}, **kwargs)
+
+
+def _module():
+    import torch
+
+    class LayerStack(torch.nn.Module):
+        def __init__(self, model, layers: List[int]):
+            super().__init__()
+            self.model = model
+            self.layers = layers
+
+        def forward(self, input_ids=None, attention_mask=None,
+                    token_type_ids=None, decoder_input_ids=None):
+            from transformers.modeling_outputs import BaseModelOutput
+
+            output = call_model(self.model, input_ids, attention_mask,
+                                token_type_ids, decoder_input_ids,
+                                output_hidden_states=True)
+            hidden_states = output.hidden_states
+            if hidden_states is None:
+                raise ValueError('The model does not return its hidden '
+                                 'states.')
+            return BaseModelOutput(last_hidden_state=torch.cat(
+                [hidden_states[layer] for layer in self.layers], dim=-1))
+
+    return LayerStack
+
+
+def stack_layers(model, layers: List[int]):
+    """`model` with the hidden states of `layers`, from `resolve_layers`,
+    concatenated along the features as its last hidden states, all from
+    one forward pass."""
+    return _module()(model, layers)
+
+
+def split_layers(reps: np.ndarray, n_layers: int) -> np.ndarray:
+    """`(n_layers, ..., dim)` representations of each layer from those of
+    the concatenated layers, `(..., n_layers * dim)`."""
+    reps = np.asarray(reps)
+    return np.moveaxis(reps.reshape(reps.shape[:-1] + (n_layers, -1)),
+                       -2, 0)
@@ -0,0 +1,141 @@
+"""Compact, memory-mappable index of the Hestia-GOOD partitions.
+
+`partitions/<dataset>.gz` are pickled `HestiaGenerator` outputs. They are
+compiled once into `partitions/<dataset>.npz`, an uncompressed archive with
+one int32 array per threshold and subset (`<threshold>_train`, ...), and an
+entry in `partitions/manifest.json` with the thresholds, subset sizes and
+the hashes of the source files. Reading a threshold maps only its arrays
+and requires neither hestia nor unpickling the whole file.
+"""
+import hashlib
+import json
+import os
+import os.path as osp
+import pickle
+import struct
+import zipfile
+
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+PARTITION_DIR = osp.join(osp.dirname(__file__), '..', '..', 'partitions')
+DATA_DIR = osp.join(osp.dirname(__file__), '..', '..', 'downstream_data')
+MANIFEST = osp.join(PARTITION_DIR, 'manifest.json')
+SUBSETS = ['train', 'valid', 'test']
+
+
+def file_sha256(path: str) -> Optional[str]:
+    if not osp.exists(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fi:
+        for chunk in iter(lambda: fi.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def read_manifest() -> dict:
+    if not osp.exists(MANIFEST):
+        return {}
+    return json.load(open(MANIFEST))
+
+
+def compile_partitions(dataset: str) -> dict:
+    """Compiles `partitions/<dataset>.gz` into the `.npz` index and
+    records it in the manifest."""
+    source = osp.join(PARTITION_DIR, f'{dataset}.gz')
+    raw = pickle.load(open(source, 'rb'))
+    partitions = raw['partitions'] if 'partitions' in raw else raw
+
+    arrays, sizes = {}, {}
+    for th, part in partitions.items():
+        sizes[str(th)] = {}
+        for subset in SUBSETS:
+            arrays[f'{th}_{subset}'] = np.asarray(part[subset], dtype=np.int32)
+            sizes[str(th)][subset] = len(part[subset])
+    out_path = osp.join(PARTITION_DIR, f'{dataset}.npz')
+    np.savez(out_path, **arrays)
+
+    data_path = osp.join(DATA_DIR, f'{dataset}.csv')
+    if osp.exists(data_path):
+        n_rows = len(pd.read_csv(data_path))
+    else:
+        n_rows = max(sum(s.values()) for s in sizes.values())
+    entry = {
+        'thresholds': list(partitions.keys()),
+        'sizes': sizes,
+        'n_rows': n_rows,
+        'source_sha256': file_sha256(source),
+        'data_sha256': file_sha256(data_path),
+        'index_sha256': file_sha256(out_path),
+    }
+    manifest = read_manifest()
+    manifest[dataset] = entry
+    tmp_path = f'{MANIFEST}.tmp'
+    json.dump(manifest, open(tmp_path, 'w'), indent=2)
+    os.replace(tmp_path, MANIFEST)
+    return entry
+
+
+def _memmap_member(path: str, name: str) -> np.ndarray:
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return np.load(path)[name[:-4]]
+    with open(path, 'rb') as fi:
+        fi.seek(info.header_offset)
+        local_header = fi.read(30)
+        name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+        fi.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(fi)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(fi)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(fi)
+        offset = fi.tell()
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                     shape=shape, order='F' if fortran else 'C')
+
+
+class PartitionIndex:
+    """Read-only view of a compiled partition index.
+
+    :param dataset: Name of the dataset, e.g., `c-cpp`.
+    """
+    def __init__(self, dataset: str):
+        manifest = read_manifest()
+        if dataset not in manifest:
+            raise FileNotFoundError(
+                f'Partition index for {dataset} has not been compiled.')
+        self.dataset = dataset
+        self.entry = manifest[dataset]
+        self.path = osp.join(PARTITION_DIR, f'{dataset}.npz')
+
+    @classmethod
+    def exists(cls, dataset: str) -> bool:
+        return (dataset in read_manifest() and
+                osp.exists(osp.join(PARTITION_DIR, f'{dataset}.npz')))
+
+    def check_data(self) -> bool:
+        """Whether the dataset on disk is the one the index was built for."""
+        expected = self.entry['data_sha256']
+        if expected is None:
+            return True
+        data_hash = file_sha256(osp.join(DATA_DIR, f'{self.dataset}.csv'))
+        return data_hash == expected
+
+    def thresholds(self, filter: float = 0.0) -> List[Union[float, str]]:
+        """Thresholds with at least `filter` x n_rows test entries, as in
+        `HestiaGenerator.get_partitions`."""
+        min_test = self.entry['n_rows'] * filter
+        return [th for th in self.entry['thresholds']
+                if self.entry['sizes'][str(th)]['test'] >= min_test]
+
+    def get(self, threshold: Union[float, str]) -> Dict[str, np.ndarray]:
+        return {subset: _memmap_member(self.path, f'{threshold}_{subset}.npy')
+                for subset in SUBSETS}
@@ -0,0 +1,103 @@
+"""Parallel conversion of PDB files into SMILES with a per-file cache.
+
+The files are converted in chunks on a process pool. Every conversion that
+succeeds is appended to a JSON-lines cache keyed by the SHA-256 of the PDB
+file, so an interrupted conversion resumes where it stopped and rebuilding
+a dataset only converts new or changed files. The cache file is specific to
+the versions of RDKit and datamol that produced it.
+"""
+import json
+import os
+import os.path as osp
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import cpu_count
+from typing import Dict, List, Optional, Tuple
+
+from .partition_index import file_sha256
+
+
+def pdb_to_smiles(path: str) -> Tuple[Optional[str], Optional[str]]:
+    """SMILES of the molecule in a PDB file, or `None` and the reason it
+    could not be converted."""
+    import datamol as dm
+    from rdkit.Chem import rdmolfiles
+
+    dm.disable_rdkit_log()
+    try:
+        mol = rdmolfiles.MolFromPDBFile(path, sanitize=False, removeHs=False)
+        mol = dm.fix_mol(mol)
+        mol = dm.fix_valence(mol)
+        mol = dm.remove_hs(mol)
+        if mol is None:
+            return None, 'has not generated a valid molecule'
+        return dm.to_smiles(mol), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def _convert_chunk(paths: List[str]) -> List[Tuple[Optional[str],
+                                                   Optional[str]]]:
+    return [pdb_to_smiles(path) for path in paths]
+
+
+def cache_path(cache_dir: str) -> str:
+    import datamol as dm
+    import rdkit
+
+    return osp.join(cache_dir,
+                    f'pdb_smiles_rdkit-{rdkit.__version__}_'
+                    f'datamol-{dm.__version__}.jsonl')
+
+
+def _read_cache(path: str) -> Dict[str, str]:
+    cache = {}
+    if path is None or not osp.exists(path):
+        return cache
+    with open(path) as fi:
+        for line in fi:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            cache[record['sha256']] = record['smiles']
+    return cache
+
+
+def convert_pdb_files(
+    paths: List[str], cache_file: Optional[str] = None,
+    n_jobs: int = cpu_count(), chunk_size: int = 32
+) -> List[Tuple[Optional[str], Optional[str]]]:
+    """`(smiles, error)` for each of `paths`, in the same order, where
+    exactly one of the two is `None`.
+
+    :param cache_file: JSON-lines file with the SMILES of the files that
+        were converted before, which is extended with the new ones.
+    """
+    hashes = [file_sha256(path) for path in paths]
+    cache = _read_cache(cache_file)
+    results = {h: (cache[h], None) for h in hashes if h in cache}
+    todo = sorted(set(idx for idx, h in enumerate(hashes)
+                      if h not in results),
+                  key=lambda idx: hashes[idx])
+    # Identical files are converted once.
+    todo = [idx for pos, idx in enumerate(todo)
+            if pos == 0 or hashes[todo[pos - 1]] != hashes[idx]]
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+    if cache_file is not None:
+        os.makedirs(osp.dirname(osp.abspath(cache_file)), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max(n_jobs, 1)) as pool:
+        futures = {pool.submit(_convert_chunk, [paths[idx] for idx in chunk]):
+                   chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            records = []
+            for idx, (smiles, error) in zip(chunk, future.result()):
+                results[hashes[idx]] = (smiles, error)
+                if smiles is not None:
+                    records.append({'sha256': hashes[idx], 'smiles': smiles})
+            if cache_file is not None and records:
+                with open(cache_file, 'a') as fo:
+                    fo.write(''.join(json.dumps(r) + '\n' for r in records))
+    return [results[h] for h in hashes]
@@ -0,0 +1,171 @@
+"""Canonical columnar format of the datasets in `downstream_data/`.
+
+The CSV files have different columns depending on their source. Each is
+converted into `<dataset>.parquet`, next to it, with the fixed schema in
+`SCHEMA`:
+
+    id                 Row of the peptide in the CSV, which is also its row
+                       in the representations and partitions.
+    smiles             SMILES as in the CSV, which the representations use.
+    canonical_smiles   RDKit canonical SMILES.
+    sequence           One-letter sequence of canonical peptides, or null.
+    biln               BILN, or null.
+    label              Label or regression target.
+    target_id          Index of the protein target in `target_sequence`
+                       order of appearance, for the binding datasets.
+    target_sequence    Sequence of the protein target, or null.
+    smiles_hash        64-bit hash of the canonical SMILES, a key that is
+                       stable across datasets.
+    n_heavy_atoms      Heavy atoms of the molecule, or null if RDKit cannot
+                       parse it.
+    n_tokens           Atom-level SMILES tokens, a proxy of the length of
+                       the molecule for chemical language models.
+
+The Parquet file records the SHA-256 of the CSV it was built from, and
+`load_dataset` rebuilds it when the CSV changes, so the CSV files remain
+the source of truth.
+"""
+import hashlib
+import os
+import os.path as osp
+import re
+
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .partition_index import DATA_DIR, file_sha256
+
+
+COLUMNS = ['id', 'smiles', 'canonical_smiles', 'sequence', 'biln', 'label',
+           'target_id', 'target_sequence', 'smiles_hash', 'n_heavy_atoms',
+           'n_tokens']
+# Atom-level SMILES tokens, as in `pepclm_tokenizer.Atomwise_Tokenizer`.
+ATOM_REGEX = re.compile(
+    r"(\([^\(\)]{0,4}\)|\[[^\]]+]|Br?|Cl?|N|O|S|P|F|I|b|c|n|o|s|p|\(|\)|"
+    r"\.|=|#|-|\+|\\|\/\/?|:|~|@|\?|>>?|\*|\$|\%[0-9]{2}|[0-9])"
+)
+SOURCE_KEY = b'source_sha256'
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('id', pa.int64()),
+        ('smiles', pa.string()),
+        ('canonical_smiles', pa.string()),
+        ('sequence', pa.string()),
+        ('biln', pa.string()),
+        ('label', pa.float64()),
+        ('target_id', pa.int32()),
+        ('target_sequence', pa.string()),
+        ('smiles_hash', pa.int64()),
+        ('n_heavy_atoms', pa.int32()),
+        ('n_tokens', pa.int32()),
+    ])
+
+
+def smiles_hash(smiles: str) -> int:
+    digest = hashlib.blake2b(smiles.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def dataset_path(dataset: str, data_dir: str = DATA_DIR) -> str:
+    return osp.join(data_dir, f'{dataset}.parquet')
+
+
+def _molecule_keys(smiles: str):
+    from rdkit import Chem, RDLogger
+
+    RDLogger.DisableLog('rdApp.*')
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return smiles, None
+    return Chem.MolToSmiles(mol), mol.GetNumHeavyAtoms()
+
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    if name in df.columns:
+        return df[name].astype(object).where(df[name].notna(), None)
+    return pd.Series([None] * len(df), index=df.index, dtype=object)
+
+
+def to_canonical(df: pd.DataFrame) -> pd.DataFrame:
+    """Dataset with the columns of a `downstream_data` CSV in the canonical
+    schema."""
+    keys = [_molecule_keys(smiles) for smiles in df['SMILES']]
+    canonical = [key[0] for key in keys]
+    out = pd.DataFrame({
+        'id': np.arange(len(df), dtype=np.int64),
+        'smiles': df['SMILES'].to_numpy(dtype=object),
+        'canonical_smiles': canonical,
+        'sequence': _column(df, 'sequence').to_numpy(),
+        'biln': _column(df, 'BILN').to_numpy(),
+        'label': df['labels'].astype(np.float64).to_numpy(),
+        'smiles_hash': np.array([smiles_hash(s) for s in canonical],
+                                dtype=np.int64),
+        'n_heavy_atoms': pd.array([key[1] for key in keys], dtype='Int32'),
+        'n_tokens': np.array([len(ATOM_REGEX.findall(s))
+                              for s in df['SMILES']], dtype=np.int32),
+    })
+    targets = _column(df, 'seq1')
+    codes, _ = pd.factorize(targets)
+    out['target_id'] = pd.array(np.where(codes < 0, None, codes),
+                                dtype='Int32')
+    out['target_sequence'] = targets.to_numpy()
+    return out[COLUMNS]
+
+
+def write_dataset(df: pd.DataFrame, path: str,
+                  source_sha256: Optional[str] = None):
+    """Writes a dataset in the canonical schema into the Parquet file at
+    `path`."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df[COLUMNS], schema=_schema(),
+                                 preserve_index=False)
+    if source_sha256 is not None:
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}),
+             SOURCE_KEY: source_sha256.encode('utf-8')})
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def convert_csv(dataset: str, data_dir: str = DATA_DIR) -> str:
+    """Converts `<dataset>.csv` into `<dataset>.parquet`. Returns the path
+    of the Parquet file."""
+    csv_path = osp.join(data_dir, f'{dataset}.csv')
+    out_path = dataset_path(dataset, data_dir)
+    write_dataset(to_canonical(pd.read_csv(csv_path)), out_path,
+                  file_sha256(csv_path))
+    return out_path
+
+
+def is_stale(dataset: str, data_dir: str = DATA_DIR) -> bool:
+    """Whether the Parquet file is missing or was built from a different
+    version of the CSV."""
+    import pyarrow.parquet as pq
+
+    path = dataset_path(dataset, data_dir)
+    csv_path = osp.join(data_dir, f'{dataset}.csv')
+    if not osp.exists(path):
+        return True
+    if not osp.exists(csv_path):
+        return False
+    metadata = pq.read_schema(path).metadata or {}
+    source = metadata.get(SOURCE_KEY, b'').decode('utf-8')
+    return source != file_sha256(csv_path)
+
+
+def load_dataset(dataset: str, columns: Optional[List[str]] = None,
+                 data_dir: str = DATA_DIR) -> pd.DataFrame:
+    """Dataset in the canonical schema, reading only `columns` if given.
+    The Parquet file is rebuilt first if its CSV has changed."""
+    if is_stale(dataset, data_dir):
+        convert_csv(dataset, data_dir)
+    return pd.read_parquet(dataset_path(dataset, data_dir), columns=columns)
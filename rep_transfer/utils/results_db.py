@@ -0,0 +1,182 @@
+"""Indexed SQLite store of all evaluation results.
+
+`Results/results.db` keeps every row of every results CSV in a single
+`results` table, with the information that is otherwise only encoded in the
+file names (experiment, dataset, model, PCA settings and representation) as
+indexed columns. Metric columns are added as new metrics appear. The CSVs
+remain the submission format; each results file is stored as a whole and
+replaced when it is rewritten.
+"""
+import os
+import os.path as osp
+import sqlite3
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+
+RESULTS_DIR = osp.join(osp.dirname(__file__), '..', '..', 'Results')
+DB_PATH = osp.join(RESULTS_DIR, 'results.db')
+KEY_COLUMNS = ['experiment', 'dataset', 'model', 'pre_pca', 'post_pca', 'rep']
+ROW_COLUMNS = ['seed', 'threshold']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    experiment TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    model TEXT NOT NULL,
+    pre_pca REAL NOT NULL,
+    post_pca REAL NOT NULL,
+    rep TEXT NOT NULL,
+    seed INTEGER,
+    threshold TEXT
+);
+CREATE INDEX IF NOT EXISTS results_key
+    ON results (experiment, dataset, model, rep);
+CREATE INDEX IF NOT EXISTS results_rep ON results (rep);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+);
+"""
+
+
+def parse_results_path(results_path: str) -> Dict[str, object]:
+    """Key of a results file, e.g.,
+    `no-generalisation/c-cpp_svm_pre_0.0_post_0.0_ecfp.csv` or
+    `standard/cpp_svm_ecfp.csv`."""
+    experiment = osp.basename(osp.dirname(osp.abspath(results_path)))
+    fields = osp.splitext(osp.basename(results_path))[0].split('_')
+    if len(fields) == 7 and fields[2] == 'pre' and fields[4] == 'post':
+        dataset, model, _, pre_pca, _, post_pca, rep = fields
+    elif len(fields) == 3:
+        (dataset, model, rep), pre_pca, post_pca = fields, 0.0, 0.0
+    else:
+        raise ValueError(f'Results file name not understood: {results_path}')
+    return {'experiment': experiment, 'dataset': dataset, 'model': model,
+            'pre_pca': float(pre_pca), 'post_pca': float(post_pca),
+            'rep': rep}
+
+
+@contextmanager
+def connect(path: str = DB_PATH) -> Iterator[sqlite3.Connection]:
+    """Connection to the results database, committed on exit."""
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _columns(conn: sqlite3.Connection) -> List[str]:
+    return [row[1] for row in conn.execute('PRAGMA table_info(results)')]
+
+
+def _add_columns(conn: sqlite3.Connection, df: pd.DataFrame):
+    existing = set(_columns(conn))
+    for column in df.columns:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE results ADD COLUMN "{column}" REAL')
+
+
+def _insert(conn: sqlite3.Connection, key: Dict[str, object],
+            df: pd.DataFrame):
+    conn.execute(
+        'DELETE FROM results WHERE ' +
+        ' AND '.join(f'{column} = ?' for column in KEY_COLUMNS),
+        [key[column] for column in KEY_COLUMNS]
+    )
+    df = df.copy()
+    for column in KEY_COLUMNS:
+        df[column] = key[column]
+    if 'threshold' in df:
+        df['threshold'] = df['threshold'].map(
+            lambda th: None if pd.isna(th) else str(th))
+    _add_columns(conn, df)
+    columns = ', '.join(f'"{column}"' for column in df.columns)
+    placeholders = ', '.join('?' for _ in df.columns)
+    df = df.astype(object).where(df.notna(), None)
+    conn.executemany(
+        f'INSERT INTO results ({columns}) VALUES ({placeholders})',
+        df.itertuples(index=False, name=None)
+    )
+
+
+def write_results(df: pd.DataFrame, results_path: str,
+                  db_path: str = DB_PATH):
+    """Replaces the rows of `results_path` in the database with `df`."""
+    with connect(db_path) as conn:
+        _insert(conn, parse_results_path(results_path), df)
+        _mark_source(conn, results_path)
+
+
+def _mark_source(conn: sqlite3.Connection, results_path: str):
+    if not osp.exists(results_path):
+        return
+    stat = os.stat(results_path)
+    conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)',
+                 (osp.relpath(results_path, RESULTS_DIR), stat.st_mtime,
+                  stat.st_size))
+
+
+def _results_files(results_dir: str) -> Iterator[str]:
+    for experiment in sorted(os.listdir(results_dir)):
+        experiment_dir = osp.join(results_dir, experiment)
+        if not osp.isdir(experiment_dir) or experiment.startswith('.'):
+            continue
+        for filename in sorted(os.listdir(experiment_dir)):
+            if filename.endswith('.csv'):
+                yield osp.join(experiment_dir, filename)
+
+
+def import_results(results_dir: str = RESULTS_DIR, db_path: str = DB_PATH,
+                   force: bool = False) -> List[str]:
+    """Imports every results CSV under `results_dir` that is new or has
+    changed since it was last imported. Returns the imported files."""
+    imported = []
+    with connect(db_path) as conn:
+        known = {path: (mtime, size) for path, mtime, size in
+                 conn.execute('SELECT path, mtime, size FROM sources')}
+        for path in _results_files(results_dir):
+            stat = os.stat(path)
+            rel_path = osp.relpath(path, RESULTS_DIR)
+            if not force and known.get(rel_path) == (stat.st_mtime,
+                                                      stat.st_size):
+                continue
+            try:
+                key = parse_results_path(path)
+            except ValueError as e:
+                print(f'Warning: {e}')
+                continue
+            _insert(conn, key, pd.read_csv(path))
+            _mark_source(conn, path)
+            imported.append(path)
+    return imported
+
+
+def load_results(experiment: Optional[str] = None,
+                 dataset: Optional[str] = None,
+                 model: Optional[str] = None,
+                 rep: Optional[str] = None,
+                 db_path: str = DB_PATH) -> pd.DataFrame:
+    """Rows of the results table, optionally filtered by any of the
+    arguments, ordered by results file and then as in the file. Metric
+    columns that are empty for all the selected rows are dropped."""
+    filters = {'experiment': experiment, 'dataset': dataset,
+               'model': model, 'rep': rep}
+    filters = {key: value for key, value in filters.items()
+               if value is not None}
+    query = 'SELECT * FROM results'
+    if filters:
+        query += ' WHERE ' + ' AND '.join(f'{key} = ?' for key in filters)
+    query += f" ORDER BY {', '.join(KEY_COLUMNS)}, rowid"
+    with connect(db_path) as conn:
+        df = pd.read_sql_query(query, conn, params=list(filters.values()))
+    metrics = [c for c in df.columns if c not in KEY_COLUMNS + ROW_COLUMNS]
+    return df.drop(columns=[c for c in metrics if df[c].isna().all()])
@@ -0,0 +1,235 @@
+"""Vectorised pairwise significance tests for ranking representations.
+
+`pairwise_wilcoxon` computes the Wilcoxon signed-rank test of every pair of
+groups at once, with the same defaults as `scipy.stats.wilcoxon`: zero
+differences are dropped, the exact null distribution is used for up to 50
+pairs without ties or zeros, a permutation test over every sign flip of
+the differences for up to 13 pairs with ties or zeros, and the normal
+approximation (with tie correction) otherwise. Each unordered pair of
+groups is tested once, the p-value of the reversed pair follows from the
+same statistic with the opposite alternative.
+"""
+import hashlib
+
+from functools import lru_cache
+from typing import Dict, List, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from scipy.stats import norm, rankdata
+
+
+EXACT_MAX_N = 50
+PERMUTATION_MAX_N = 13
+OPPOSITE = {'greater': 'less', 'less': 'greater', 'two-sided': 'two-sided'}
+
+
+class PValueCache(Protocol):
+    def get_pvalue(self, key: Tuple[str, str, str]) -> Optional[float]: ...
+
+    def set_pvalue(self, key: Tuple[str, str, str], pvalue: float): ...
+
+
+def fingerprint(values: np.ndarray, keys: Optional[Sequence] = None) -> str:
+    """Hash of `values` and of the `keys` they are paired on, if any."""
+    digest = hashlib.sha1(
+        np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    if keys is not None:
+        digest.update(repr(list(keys)).encode())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _exact_sf(n: int) -> np.ndarray:
+    """P(W+ >= k) for k = 0, ..., n(n+1)/2 with n non-zero differences and
+    no ties."""
+    counts = np.zeros(n * (n + 1) // 2 + 1)
+    counts[0] = 1
+    for i in range(1, n + 1):
+        counts[i:] = counts[i:] + counts[:-i].copy()
+    pmf = counts / 2. ** n
+    return np.cumsum(pmf[::-1])[::-1]
+
+
+def _exact_pvalue(r_plus: float, n: int, alternative: str) -> float:
+    sf = _exact_sf(n)
+    max_k = len(sf) - 1
+
+    def upper(k):
+        return sf[int(k)] if k <= max_k else 0.
+
+    def lower(k):
+        return 1. - sf[int(k) + 1] if k < max_k else 1.
+
+    if alternative == 'greater':
+        return upper(np.floor(r_plus))
+    elif alternative == 'less':
+        return lower(np.ceil(r_plus))
+    return min(1., 2 * min(upper(np.floor(r_plus)), lower(np.ceil(r_plus))))
+
+
+def _normal_pvalue(z: np.ndarray, alternative: str) -> np.ndarray:
+    if alternative == 'greater':
+        return norm.sf(z)
+    elif alternative == 'less':
+        return norm.cdf(z)
+    return np.minimum(1., 2 * norm.sf(np.abs(z)))
+
+
+def _permutation_pvalue(ranks: np.ndarray, r_plus: float,
+                        alternative: str) -> float:
+    """P-value of `r_plus` under every sign flip of the differences with
+    `ranks`, zero for zero differences, as scipy's permutation test."""
+    signs = (np.arange(2 ** len(ranks))[:, None] >>
+             np.arange(len(ranks))) & 1
+    null = signs @ ranks
+    # scipy's tolerance for statistics that are equal but for rounding.
+    gamma = abs(np.finfo(np.float64).eps * 100 * r_plus)
+    less = np.mean(null <= r_plus + gamma)
+    greater = np.mean(null >= r_plus - gamma)
+    if alternative == 'greater':
+        return float(greater)
+    elif alternative == 'less':
+        return float(less)
+    return float(min(1., 2 * min(less, greater)))
+
+
+def pairwise_wilcoxon(values: np.ndarray, alternative: str = 'greater',
+                      pairs: Optional[List[Tuple[int, int]]] = None
+                      ) -> Dict[Tuple[int, int], float]:
+    """P-values of `wilcoxon(values[i], values[j], alternative)` for every
+    ordered pair of rows of `values` (groups x paired observations), or
+    only for `pairs`. Undefined tests, e.g., between identical groups, have
+    p-value 1."""
+    values = np.asarray(values, dtype=np.float64)
+    if pairs is None:
+        pairs = [(i, j) for i in range(len(values))
+                 for j in range(len(values)) if i != j]
+    if len(pairs) == 0:
+        return {}
+    unordered = sorted(set((min(pair), max(pair)) for pair in pairs))
+    first, second = np.array(unordered).T
+    d = values[first] - values[second]
+    n = d.shape[1]
+
+    zeros = d == 0
+    count = n - zeros.sum(axis=1)
+    # Zeros are ranked after every non-zero difference and ignored.
+    abs_d = np.where(zeros, np.inf, np.abs(d))
+    ranks = rankdata(abs_d, method='average', axis=1)
+    ties = (rankdata(abs_d, method='max', axis=1) -
+            rankdata(abs_d, method='min', axis=1) + 1)
+    ties = np.where(zeros, 1, ties)
+    has_ties = (ties > 1).any(axis=1)
+    r_plus = (ranks * (d > 0)).sum(axis=1)
+
+    mean = count * (count + 1) / 4
+    var = (count * (count + 1) * (2 * count + 1) -
+           (ties ** 2 - 1).sum(axis=1) / 2) / 24
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (r_plus - mean) / np.sqrt(var)
+
+    exact = (n <= EXACT_MAX_N) & ~has_ties & (count == n)
+    permutation = ((n <= PERMUTATION_MAX_N) & ~exact) & (count > 0)
+
+    def pvalues(alternative: str) -> np.ndarray:
+        out = _normal_pvalue(z, alternative)
+        for idx in np.flatnonzero(exact):
+            out[idx] = _exact_pvalue(r_plus[idx], n, alternative)
+        for idx in np.flatnonzero(permutation):
+            out[idx] = _permutation_pvalue(np.where(zeros[idx], 0, ranks[idx]),
+                                           r_plus[idx], alternative)
+        return np.where((count == 0) | np.isnan(out), 1., out)
+
+    # Swapping the groups negates the differences, so the reversed pair has
+    # the p-value of the opposite alternative.
+    forward = pvalues(alternative)
+    backward = (forward if OPPOSITE[alternative] == alternative
+                else pvalues(OPPOSITE[alternative]))
+    out = {}
+    for pair, p_forward, p_backward in zip(unordered, forward, backward):
+        out[pair] = float(p_forward)
+        out[pair[::-1]] = float(p_backward)
+    return {pair: out[pair] for pair in pairs}
+
+
+def cached_pairwise_wilcoxon(scores: pd.DataFrame, cache: PValueCache,
+                             alternative: str = 'greater'
+                             ) -> Dict[Tuple[str, str], float]:
+    """`pairwise_wilcoxon` between all the columns of `scores`, whose rows
+    are the keys the scores are paired on, e.g., dataset and seed. Each pair
+    is tested on the keys that both groups have, and the p-values in `cache`
+    are reused, keyed by the fingerprints of the paired scores and keys."""
+    names = sorted(scores.columns)
+    present = {name: scores[name].notna().to_numpy() for name in names}
+    fps = {}
+
+    def fp(name: str, shared: np.ndarray) -> str:
+        key = (name, shared.tobytes())
+        if key not in fps:
+            fps[key] = fingerprint(scores[name].to_numpy()[shared],
+                                   scores.index[shared])
+        return fps[key]
+
+    test = f'wilcoxon-{alternative}'
+    pvalues, missing = {}, {}
+    for idx, name1 in enumerate(names):
+        for name2 in names[idx + 1:]:
+            shared = present[name1] & present[name2]
+            if not shared.any():
+                continue
+            fp1, fp2 = fp(name1, shared), fp(name2, shared)
+            forward = cache.get_pvalue((fp1, fp2, test))
+            backward = cache.get_pvalue((fp2, fp1, test))
+            if forward is None or backward is None:
+                missing.setdefault(shared.tobytes(), (shared, []))[1].append(
+                    (name1, name2))
+            else:
+                pvalues[(name1, name2)] = forward
+                pvalues[(name2, name1)] = backward
+
+    for shared, pairs in missing.values():
+        paired = sorted(set(name for pair in pairs for name in pair))
+        index = {name: idx for idx, name in enumerate(paired)}
+        values = np.stack([scores[name].to_numpy()[shared]
+                           for name in paired])
+        computed = pairwise_wilcoxon(
+            values, alternative,
+            [(index[name1], index[name2]) for name1, name2 in pairs] +
+            [(index[name2], index[name1]) for name1, name2 in pairs])
+        for pair in pairs:
+            for name1, name2 in (pair, pair[::-1]):
+                pvalue = computed[(index[name1], index[name2])]
+                cache.set_pvalue((fp(name1, shared), fp(name2, shared), test),
+                                 pvalue)
+                pvalues[(name1, name2)] = pvalue
+    return pvalues
+
+
+def significance_clusters(names: List[str], pvalues: Dict[Tuple[str, str],
+                                                         float],
+                          alpha: float = 0.05) -> List[int]:
+    """Significant rank of each of `names`, sorted from best to worst mean.
+
+    A group shares the rank of the current cluster unless it is
+    significantly worse (one-sided p-value below the Bonferroni-corrected
+    `alpha`) than the group the cluster is anchored at. Groups that cannot
+    be compared, because they share no keys, share the rank.
+    """
+    def pvalue(idx1: int, idx2: int) -> float:
+        if idx1 == idx2:
+            return 1.
+        return pvalues.get((names[idx1], names[idx2]), 2.)
+
+    # The first cluster is anchored at the second best group, as in the
+    # analysis used for the published leaderboards.
+    rank, rank_cluster = [1], [1]
+    for idx in range(1, len(names)):
+        if pvalue(rank_cluster[-1], idx) > alpha / len(names):
+            rank.append(rank[-1])
+            rank_cluster.append(rank_cluster[-1])
+        else:
+            rank.append(rank[-1] + 1)
+            rank_cluster.append(idx)
+    return rank
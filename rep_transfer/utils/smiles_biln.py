@@ -0,0 +1,191 @@
+"""Parallel annotation of SMILES with their BILN, through pepfunn's
+`peptideFromSMILES`, with a timeout per molecule and a persistent cache.
+
+The molecules are converted on a pool of worker processes, one molecule at
+a time, and a worker that takes longer than `timeout` seconds, or crashes,
+is killed and replaced. Every result, including failures and timeouts, is
+appended to a JSON-lines cache keyed by the canonical SMILES, so an
+interrupted annotation resumes where it stopped and molecules shared by
+several datasets are converted once. The cache file is specific to the
+version of pepfunn that produced it.
+"""
+import json
+import multiprocessing as mp
+import os
+import os.path as osp
+import time
+
+from collections import deque
+from importlib.metadata import version
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional, Tuple
+
+from tqdm import tqdm
+
+
+def smiles_to_biln(smiles: str) -> Tuple[Optional[str], Optional[str]]:
+    """BILN of a peptide SMILES, or `None` and the reason it could not be
+    converted."""
+    from pepfunn.sequence import peptideFromSMILES
+
+    try:
+        biln = peptideFromSMILES(smiles)
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+    if not biln:
+        return None, 'has not generated a valid BILN'
+    return biln, None
+
+
+def canonical_smiles(smiles: str) -> str:
+    """Canonical form of `smiles`, or `smiles` itself if RDKit cannot parse
+    it."""
+    from rdkit import Chem, RDLogger
+
+    RDLogger.DisableLog('rdApp.*')
+    mol = Chem.MolFromSmiles(smiles)
+    return smiles if mol is None else Chem.MolToSmiles(mol)
+
+
+def cache_path(cache_dir: str) -> str:
+    return osp.join(cache_dir,
+                    f"smiles_biln_pepfunn-{version('pepfunn')}.jsonl")
+
+
+def _read_cache(path: Optional[str]) -> Dict[str, dict]:
+    cache = {}
+    if path is None or not osp.exists(path):
+        return cache
+    with open(path) as fi:
+        for line in fi:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            cache[record['smiles']] = record
+    return cache
+
+
+def _serve(conn):
+    while True:
+        smiles = conn.recv()
+        if smiles is None:
+            return
+        conn.send(smiles_to_biln(smiles))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.smiles = None
+        self.deadline = None
+
+    def submit(self, smiles: str, timeout: float):
+        self.smiles = smiles
+        self.deadline = time.monotonic() + timeout
+        self.conn.send(smiles)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+def _convert(smiles: List[str], timeout: float, n_jobs: int, on_result):
+    """Converts every SMILES on `n_jobs` workers and calls
+    `on_result(smiles, biln, error)` with each result as it arrives."""
+    ctx = mp.get_context()
+    todo = deque(smiles)
+    workers = [_Worker(ctx) for _ in range(max(min(n_jobs, len(todo)), 0))]
+    try:
+        while True:
+            for worker in workers:
+                if worker.smiles is None and todo:
+                    worker.submit(todo.popleft(), timeout)
+            busy = [worker for worker in workers if worker.smiles is not None]
+            if not busy:
+                return
+            next_deadline = min(worker.deadline for worker in busy)
+            ready = wait([worker.conn for worker in busy],
+                         timeout=max(next_deadline - time.monotonic(), 0))
+            for idx, worker in enumerate(workers):
+                if worker.smiles is None:
+                    continue
+                if worker.conn in ready:
+                    try:
+                        biln, error = worker.conn.recv()
+                    except EOFError:
+                        biln, error = None, 'the worker process crashed'
+                        worker.kill()
+                        workers[idx] = _Worker(ctx)
+                elif time.monotonic() >= worker.deadline:
+                    biln, error = None, f'timed out after {timeout:g} s'
+                    worker.kill()
+                    workers[idx] = _Worker(ctx)
+                else:
+                    continue
+                on_result(worker.smiles, biln, error)
+                worker.smiles = None
+    finally:
+        for worker in workers:
+            worker.close()
+
+
+def annotate_biln(
+    smiles: List[str], cache_file: Optional[str] = None,
+    n_jobs: int = mp.cpu_count(), timeout: float = 120.,
+    retry_failed: bool = False
+) -> List[Tuple[Optional[str], Optional[str]]]:
+    """`(biln, error)` for each of `smiles`, in the same order, where
+    exactly one of the two is `None`.
+
+    :param cache_file: JSON-lines file with the results of the molecules
+        that were converted before, which is extended with the new ones.
+    :param timeout: Seconds after which the conversion of a molecule is
+        abandoned.
+    :param retry_failed: Convert again the molecules whose conversion
+        failed or timed out before, e.g., with a longer `timeout`.
+    """
+    canonical = [canonical_smiles(smi) for smi in smiles]
+    cache = _read_cache(cache_file)
+    results = {
+        smi: (record['biln'], record['error'])
+        for smi, record in cache.items()
+        if record['biln'] is not None or not retry_failed
+    }
+    # Identical molecules are converted once.
+    todo = sorted(set(smi for smi in canonical if smi not in results))
+
+    if cache_file is not None:
+        os.makedirs(osp.dirname(osp.abspath(cache_file)), exist_ok=True)
+    fo = open(cache_file, 'a') if cache_file is not None and todo else None
+    progress = tqdm(total=len(todo), desc='BILN', disable=not todo)
+
+    def on_result(smi: str, biln: Optional[str], error: Optional[str]):
+        results[smi] = (biln, error)
+        if fo is not None:
+            fo.write(json.dumps({'smiles': smi, 'biln': biln,
+                                 'error': error}) + '\n')
+            fo.flush()
+        progress.update()
+
+    try:
+        _convert(todo, timeout, n_jobs, on_result)
+    finally:
+        progress.close()
+        if fo is not None:
+            fo.close()
+    return [results[smi] for smi in canonical]
@@ -0,0 +1,192 @@
+"""Fast SMILES Pair Encoding tokenizer for PeptideCLM.
+
+`SPETokenizer` reproduces the tokens and ids of
+`pepclm_tokenizer.SMILES_SPE_Tokenizer` without transformers or SmilesPE.
+The original applies the merges one at a time: it scans every pair of the
+whole molecule for the merge with the lowest rank, merges all its
+occurrences and starts again, which is quadratic in the length of the
+SMILES. Here the molecule is first cut between atoms that no merge can
+join, which splits a peptide into short fragments that repeat across
+residues and molecules, and each distinct fragment is merged once and
+memoized. Fragments never interact, so the result is the same. Within a
+fragment, the pairs are kept in a heap by rank, and each round merges all
+the occurrences of the lowest-ranked pair from left to right, as the
+original does.
+
+`encode_batch` returns the padded `input_ids`, `token_type_ids` and
+`attention_mask` as NumPy arrays, as the original would with
+`padding='longest'`.
+"""
+import heapq
+import os.path as osp
+import re
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .partition_index import file_sha256
+from .token_store import pad_batch
+
+
+TOKENIZER_DIR = osp.join(osp.dirname(__file__), 'tokenizer')
+VOCAB_FILE = osp.join(TOKENIZER_DIR, 'new_vocab.txt')
+SPE_FILE = osp.join(TOKENIZER_DIR, 'new_splits.txt')
+# Atom-level pre-tokenization of SmilesPE, `pretokenizer.atomwise_tokenizer`.
+ATOMWISE_REGEX = re.compile(
+    r"(\[[^\]]+]|Br?|Cl?|N|O|S|P|F|I|b|c|n|o|s|p|\(|\)|\.|=|#|-|\+|\\|\/|"
+    r":|~|@|\?|>|\*|\$|\%[0-9]{2}|[0-9])"
+)
+
+
+def load_vocab(path: str) -> Dict[str, int]:
+    with open(path, encoding='utf-8') as fi:
+        return {line.rstrip('\n'): idx for idx, line in enumerate(fi)}
+
+
+def load_merges(path: str) -> Dict[tuple, int]:
+    """Rank of every merge, keeping the first of duplicated merges."""
+    ranks = {}
+    with open(path, encoding='utf-8') as fi:
+        for idx, line in enumerate(fi):
+            pair = tuple(line.strip('\r\n ').split(' '))
+            if len(pair) != 2:
+                raise ValueError(f'Invalid line {idx + 1} in {path}: {line}')
+            ranks.setdefault(pair, idx)
+    return ranks
+
+
+class _Joinable(dict):
+    """Whether a merge could join a symbol that ends with the atom `left`
+    and one that starts with the atom `right`, by `(left, right)`."""
+    def __init__(self, ranks: Dict[tuple, int]):
+        super().__init__()
+        self.ranks = ranks
+
+    def __missing__(self, pair: tuple) -> bool:
+        left, right = pair
+        joinable = any(a.endswith(left) and b.startswith(right)
+                       for a, b in self.ranks)
+        self[pair] = joinable
+        return joinable
+
+
+class SPETokenizer:
+    """
+    :param vocab_file: Vocabulary, one token per line.
+    :param spe_file: SPE merges, one pair of symbols per line, by rank.
+    :param cache_size: Number of tokenized SMILES that are memoized.
+    """
+    def __init__(self, vocab_file: str = VOCAB_FILE,
+                 spe_file: str = SPE_FILE, cache_size: int = 100_000):
+        self.vocab = load_vocab(vocab_file)
+        self.ranks = load_merges(spe_file)
+        # Changes with the vocabulary or the merges, for the token store.
+        self.name = (f'spe-{file_sha256(vocab_file)[:12]}-'
+                     f'{file_sha256(spe_file)[:12]}')
+        self.unk_token_id = self.vocab['[UNK]']
+        self.pad_token_id = self.vocab['[PAD]']
+        self.cls_token_id = self.vocab['[CLS]']
+        self.sep_token_id = self.vocab['[SEP]']
+        self.cache_size = cache_size
+        self._cache = {}
+        self._joinable = _Joinable(self.ranks)
+        self._fragments = {}
+
+    def _merge(self, symbols: List[str]) -> List[str]:
+        n = len(symbols)
+        if n < 2:
+            return symbols
+        ranks = self.ranks
+        symbols = list(symbols)
+        nxt = list(range(1, n)) + [-1]
+        prv = list(range(-1, n - 1))
+        heap = []
+        for i in range(n - 1):
+            rank = ranks.get((symbols[i], symbols[i + 1]))
+            if rank is not None:
+                heap.append((rank, i))
+        heapq.heapify(heap)
+
+        while heap:
+            rank = heap[0][0]
+            positions = []
+            while heap and heap[0][0] == rank:
+                positions.append(heapq.heappop(heap)[1])
+            new_pairs = []
+            for i in sorted(set(positions)):
+                j = nxt[i]
+                # Stale entry, or overlapping with a merge of this round.
+                if symbols[i] is None or j < 0 or \
+                        ranks.get((symbols[i], symbols[j])) != rank:
+                    continue
+                symbols[i] = symbols[i] + symbols[j]
+                symbols[j] = None
+                nxt[i] = nxt[j]
+                if nxt[j] >= 0:
+                    prv[nxt[j]] = i
+                new_pairs.append(i)
+            # Pairs formed by this round are only considered in the next.
+            for i in new_pairs:
+                if symbols[i] is None:
+                    continue
+                if prv[i] >= 0:
+                    left = ranks.get((symbols[prv[i]], symbols[i]))
+                    if left is not None:
+                        heapq.heappush(heap, (left, prv[i]))
+                if nxt[i] >= 0:
+                    right = ranks.get((symbols[i], symbols[nxt[i]]))
+                    if right is not None:
+                        heapq.heappush(heap, (right, i))
+        return [symbol for symbol in symbols if symbol is not None]
+
+    def _merge_fragment(self, atoms: tuple) -> List[str]:
+        symbols = self._fragments.get(atoms)
+        if symbols is None:
+            symbols = self._merge(list(atoms))
+            self._fragments[atoms] = symbols
+        return symbols
+
+    def tokenize(self, smiles: str) -> List[str]:
+        if len(smiles) == 1:
+            return [smiles]
+        atoms = ATOMWISE_REGEX.findall(smiles)
+        joinable = self._joinable
+        cuts = [i for i, pair in enumerate(zip(atoms, atoms[1:]), 1)
+                if not joinable[pair]]
+        tokens = []
+        for start, end in zip([0] + cuts, cuts + [len(atoms)]):
+            tokens.extend(self._merge_fragment(tuple(atoms[start:end])))
+        # As in the original, a SMILES without atoms is one empty token.
+        return tokens or ['']
+
+    def _token_ids(self, smiles: str) -> List[int]:
+        if not smiles:
+            # transformers does not tokenize empty texts.
+            return []
+        ids = self._cache.get(smiles)
+        if ids is None:
+            ids = [self.vocab.get(token, self.unk_token_id)
+                   for token in self.tokenize(smiles)]
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[smiles] = ids
+        return ids
+
+    def encode(self, smiles: str,
+               max_length: Optional[int] = None) -> List[int]:
+        """Ids of `smiles` between `[CLS]` and `[SEP]`, truncated to
+        `max_length` ids in total if given."""
+        ids = self._token_ids(smiles)
+        if max_length is not None:
+            ids = ids[:max(max_length - 2, 0)]
+        return [self.cls_token_id] + ids + [self.sep_token_id]
+
+    def encode_batch(self, smiles: List[str],
+                     max_length: Optional[int] = None,
+                     pad_to_multiple_of: Optional[int] = None
+                     ) -> Dict[str, np.ndarray]:
+        """`input_ids`, `token_type_ids` and `attention_mask` of `smiles`,
+        padded on the right to the longest of them."""
+        return pad_batch([self.encode(smi, max_length) for smi in smiles],
+                         self.pad_token_id, pad_to_multiple_of)
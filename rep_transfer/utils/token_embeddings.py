@@ -0,0 +1,240 @@
+"""Store of the token-level embeddings of the language models.
+
+The hidden states of every token of every input are saved once, so that
+any pooling can be computed later from them without running the model
+again. A store is a directory with one float16 file per layer and an
+index:
+
+    <root>/<model>_<dataset>/layer<layer>.f16   (n_tokens, dim)
+    <root>/<model>_<dataset>/index.npz          offsets, layers, n_layers, dim
+
+where the tokens of input `i` are rows `offsets[i]:offsets[i + 1]` and
+layers are indices of hidden states, from 0, the output of the embeddings,
+to `n_layers`, that of the last layer of the model. Negative layers, e.g.,
+`LAST_LAYER`, count from the last one. The layer files are memory-mapped,
+and `TokenEmbeddings.pool` pools them by chunks of inputs, so a store may be
+larger than the memory. Saving other layers of the same inputs adds them to
+the store.
+"""
+import os
+import os.path as osp
+import shutil
+
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+
+TOKEN_EMBEDDING_DIR = osp.join(osp.dirname(__file__), '..', '..', 'reps',
+                               'tokens')
+POOLINGS = ['mean', 'max', 'first', 'last', 'gram']
+# Layer of the last hidden states.
+LAST_LAYER = -1
+
+
+def resolve_layer(layer: int, n_layers: Optional[int]) -> int:
+    """Index of the hidden state `layer` of a model with `n_layers`, which
+    may be unknown for stores written before it was saved."""
+    if layer < 0 and n_layers is not None:
+        return layer + n_layers + 1
+    return layer
+
+
+def store_path(model: str, dataset: str,
+               root: str = TOKEN_EMBEDDING_DIR) -> str:
+    return osp.join(root, f'{model}_{dataset}')
+
+
+def pool_tokens(states: np.ndarray, offsets: np.ndarray,
+                poolings: List[str]) -> Dict[str, np.ndarray]:
+    """Pooled `states`, `(n_tokens, dim)`, of the inputs whose tokens are
+    rows `offsets[i]:offsets[i + 1]`. Inputs without tokens are zeros.
+
+    `gram` is the upper triangle of the mean outer product of the token
+    states, `dim * (dim + 1) / 2` values, as in `lm_inference`.
+    """
+    states = states.astype(np.float32, copy=False)
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    # Segments of the non-empty inputs are contiguous and cover `states`.
+    starts = offsets[:-1][nonempty] - offsets[0]
+    n, dim = len(lengths), states.shape[1]
+    pooled = {}
+    for pooling in poolings:
+        if pooling == 'gram':
+            rows, cols = np.triu_indices(dim)
+            values = np.zeros((n, len(rows)), dtype=np.float32)
+        else:
+            values = np.zeros((n, dim), dtype=np.float32)
+        if not nonempty.any():
+            pooled[pooling] = values
+            continue
+        if pooling == 'mean':
+            values[nonempty] = np.add.reduceat(states, starts) / \
+                lengths[nonempty, None]
+        elif pooling == 'max':
+            values[nonempty] = np.maximum.reduceat(states, starts)
+        elif pooling == 'first':
+            values[nonempty] = states[starts]
+        elif pooling == 'last':
+            values[nonempty] = states[starts + lengths[nonempty] - 1]
+        elif pooling == 'gram':
+            for idx in np.flatnonzero(nonempty):
+                start = offsets[idx] - offsets[0]
+                tokens = states[start:start + lengths[idx]]
+                values[idx] = (tokens.T @ tokens)[rows, cols] / lengths[idx]
+        else:
+            raise ValueError(f'Pooling: {pooling} is not supported. '
+                             f'Choose one of: {", ".join(POOLINGS)}.')
+        pooled[pooling] = values
+    return pooled
+
+
+class TokenEmbeddingWriter:
+    """Appends the token embeddings of consecutive inputs to a new store.
+    The store only appears at `path` once `close` is called, along with the
+    other layers of an existing store of the same inputs.
+
+    :param path: Directory of the store.
+    :param layers: Layers that are saved, `LAST_LAYER` for the last hidden
+        states.
+    :param n_layers: Layers of the model, to which `LAST_LAYER` resolves.
+    """
+    def __init__(self, path: str, layers: Sequence[int] = (LAST_LAYER,),
+                 n_layers: Optional[int] = None):
+        self.path = path
+        self.layers = [resolve_layer(layer, n_layers) for layer in layers]
+        self.n_layers = n_layers
+        self.tmp_path = f'{path}.{os.getpid()}.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.files = [open(osp.join(self.tmp_path, f'layer{layer}.f16'),
+                           'wb') for layer in self.layers]
+        self.lengths = []
+        self.dim = None
+
+    def append(self, states: Sequence[np.ndarray]):
+        """Adds the next inputs, each `(n_tokens, dim)`, or
+        `(n_layers, n_tokens, dim)` with the states of every layer."""
+        for state in states:
+            state = np.asarray(state)
+            if state.ndim == 2:
+                state = state[None]
+            if len(state) != len(self.layers):
+                raise ValueError(f'{len(state)} layers were given for the '
+                                 f'{len(self.layers)} of the store.')
+            if self.dim is None:
+                self.dim = state.shape[-1]
+            for fo, layer_state in zip(self.files, state):
+                fo.write(np.ascontiguousarray(
+                    layer_state, dtype=np.float16).tobytes())
+            self.lengths.append(state.shape[1])
+
+    def close(self):
+        for fo in self.files:
+            fo.close()
+        offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(self.lengths)
+        layers = self._merge(offsets)
+        np.savez(osp.join(self.tmp_path, 'index.npz'), offsets=offsets,
+                 layers=np.array(layers, dtype=np.int64),
+                 n_layers=np.int64(-1 if self.n_layers is None
+                                   else self.n_layers),
+                 dim=np.int64(self.dim or 0))
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+    def _merge(self, offsets: np.ndarray) -> List[int]:
+        """Links the layers of the existing store that were not written
+        again into the new one and returns all the layers, in order."""
+        layers = list(self.layers)
+        if not osp.exists(osp.join(self.path, 'index.npz')):
+            return layers
+        stored = TokenEmbeddings(self.path)
+        if not np.array_equal(stored.offsets, offsets) or \
+                stored.dim != (self.dim or 0):
+            print(f'Warning: the inputs of {self.path} changed, its layers '
+                  f'{", ".join(map(str, stored.layers))} are discarded.')
+            return layers
+        n_layers = stored.n_layers if stored.n_layers is not None \
+            else self.n_layers
+        for layer in stored.layers:
+            resolved = resolve_layer(layer, n_layers)
+            if resolved in layers:
+                continue
+            # Linked rather than moved, so that the existing store stays
+            # whole until it is replaced.
+            src = osp.join(self.path, f'layer{layer}.f16')
+            dst = osp.join(self.tmp_path, f'layer{resolved}.f16')
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+            layers.append(resolved)
+        return sorted(layers)
+
+
+class TokenEmbeddings:
+    """Token embeddings of a store, memory-mapped.
+
+    :param path: Directory of the store.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with np.load(osp.join(path, 'index.npz')) as index:
+            self.offsets = index['offsets']
+            self.layers = index['layers'].tolist()
+            self.dim = int(index['dim'])
+            n_layers = int(index['n_layers']) if 'n_layers' in index else -1
+        self.n_layers = None if n_layers < 0 else n_layers
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def resolve(self, layer: int) -> int:
+        return resolve_layer(layer, self.n_layers)
+
+    def has_layer(self, layer: int) -> bool:
+        return self.resolve(layer) in self.layers
+
+    def layer(self, layer: int = LAST_LAYER) -> np.ndarray:
+        """`(n_tokens, dim)` float16 states of all the tokens in `layer`."""
+        layer = self.resolve(layer)
+        if layer not in self.layers:
+            raise ValueError(f'Layer {layer} is not in the store, which has '
+                             f'layers: {", ".join(map(str, self.layers))}.')
+        if self.offsets[-1] == 0:
+            return np.zeros((0, self.dim), dtype=np.float16)
+        return np.memmap(osp.join(self.path, f'layer{layer}.f16'),
+                         dtype=np.float16, mode='r',
+                         shape=(int(self.offsets[-1]), self.dim))
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        """`(n_layers, n_tokens, dim)` states of input `idx`."""
+        return np.stack([self.layer(layer)[
+            self.offsets[idx]:self.offsets[idx + 1]]
+            for layer in self.layers])
+
+    def chunks(self, chunk_size: int) -> Iterator[slice]:
+        for start in range(0, len(self), chunk_size):
+            yield slice(start, min(start + chunk_size, len(self)))
+
+    def pool(self, poolings: List[str], layer: int = LAST_LAYER,
+             chunk_size: int = 1024) -> Dict[str, np.ndarray]:
+        """`(n_inputs, dim)` float32 array of each pooling of `layer`."""
+        states = self.layer(layer)
+        out = {}
+        for chunk in self.chunks(chunk_size):
+            offsets = self.offsets[chunk.start:chunk.stop + 1]
+            pooled = pool_tokens(states[offsets[0]:offsets[-1]], offsets,
+                                 poolings)
+            for pooling, values in pooled.items():
+                if pooling not in out:
+                    out[pooling] = np.empty((len(self), values.shape[1]),
+                                            dtype=np.float32)
+                out[pooling][chunk] = values
+        return out
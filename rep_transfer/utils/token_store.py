@@ -0,0 +1,157 @@
+"""Persistent store of the token ids of the inputs of language models.
+
+The token ids of every input are kept as a ragged array, the flat ids and
+the offset of each input, in one file per tokenizer:
+
+    <root>/<tokenizer_id>.npz   keys, offsets, ids
+
+where `keys` are the 64-bit hashes of the inputs. `TokenStore.encode`
+returns the ids of a list of inputs, tokenizing and adding only those that
+are not in the store yet, as a `RaggedTokens`, whose `batches` are sorted
+by length and padded straight into arrays for the model.
+"""
+import fcntl
+import os
+import os.path as osp
+
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .downloads import CACHE_DIR
+from .peptide_dataset import smiles_hash
+
+
+TOKEN_DIR = osp.join(CACHE_DIR, 'tokens')
+
+
+def pad_batch(sequences: Sequence[Sequence[int]], pad_token_id: int,
+              pad_to_multiple_of: Optional[int] = None
+              ) -> Dict[str, np.ndarray]:
+    """`input_ids`, `token_type_ids` and `attention_mask` of token id
+    sequences, padded on the right to the longest of them."""
+    lengths = np.array([len(ids) for ids in sequences], dtype=np.int64)
+    width = int(lengths.max()) if len(sequences) else 0
+    if pad_to_multiple_of:
+        width = -(-width // pad_to_multiple_of) * pad_to_multiple_of
+    input_ids = np.full((len(sequences), width), pad_token_id,
+                        dtype=np.int64)
+    attention_mask = np.arange(width)[None, :] < lengths[:, None]
+    input_ids[attention_mask] = np.concatenate(
+        [np.asarray(ids, dtype=np.int64) for ids in sequences]
+    ) if len(sequences) else []
+    return {'input_ids': input_ids,
+            'token_type_ids': np.zeros_like(input_ids),
+            'attention_mask': attention_mask.astype(np.int64)}
+
+
+class RaggedTokens:
+    """Token ids of several inputs as flat `ids` and `offsets`, where the
+    ids of input `i` are `ids[offsets[i]:offsets[i + 1]]`."""
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray):
+        self.ids = ids
+        self.offsets = offsets
+
+    @classmethod
+    def from_lists(cls, sequences: Sequence[Sequence[int]]) -> 'RaggedTokens':
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(ids) for ids in sequences])
+        ids = np.fromiter((idx for seq in sequences for idx in seq),
+                          dtype=np.int32, count=int(offsets[-1]))
+        return cls(ids, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self.ids[self.offsets[idx]:self.offsets[idx + 1]]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def take(self, idxs: Sequence[int]) -> 'RaggedTokens':
+        offsets = np.zeros(len(idxs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(self.lengths[np.asarray(idxs, dtype=int)])
+        ids = np.concatenate([self.ids[:0]] + [self[idx] for idx in idxs])
+        return RaggedTokens(ids, offsets)
+
+    def batches(self, batch_size: int, pad_token_id: int,
+                sort: bool = True, pad_to_multiple_of: Optional[int] = None
+                ) -> Iterator[Tuple[np.ndarray, Dict[str, np.ndarray]]]:
+        """Yields the positions of the inputs of every batch and their
+        padded arrays. With `sort`, batches group inputs of similar length,
+        longest first, so that little of each batch is padding."""
+        order = np.argsort(-self.lengths, kind='stable') if sort \
+            else np.arange(len(self))
+        for start in range(0, len(order), batch_size):
+            idxs = order[start:start + batch_size]
+            yield idxs, pad_batch([self[idx] for idx in idxs], pad_token_id,
+                                  pad_to_multiple_of)
+
+
+class TokenStore:
+    """
+    :param tokenizer_id: Name of the tokenizer, which must change whenever
+        its output may change, e.g., with a hash of its vocabulary.
+    :param root: Directory of the stores of all tokenizers.
+    """
+    def __init__(self, tokenizer_id: str, root: str = TOKEN_DIR):
+        self.tokenizer_id = tokenizer_id
+        self.path = osp.join(root, f'{tokenizer_id}.npz')
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.tokens = RaggedTokens(np.zeros(0, dtype=np.int32),
+                                   np.zeros(1, dtype=np.int64))
+        self._rows = {}
+        self._load()
+
+    def _load(self):
+        if not osp.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            self.keys = data['keys']
+            self.tokens = RaggedTokens(data['ids'], data['offsets'])
+        self._rows = {int(key): row for row, key in enumerate(self.keys)}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, text: str) -> bool:
+        return smiles_hash(text) in self._rows
+
+    def _add(self, keys: List[int], sequences: List[List[int]]):
+        """Adds new entries and saves the store, merged with the entries
+        other processes may have saved in the meantime."""
+        os.makedirs(osp.dirname(self.path), exist_ok=True)
+        with open(f'{self.path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._load()
+            new = [(key, seq) for key, seq in zip(keys, sequences)
+                   if key not in self._rows]
+            if not new:
+                return
+            added = RaggedTokens.from_lists([seq for _, seq in new])
+            keys = np.concatenate([self.keys, np.array(
+                [key for key, _ in new], dtype=np.int64)])
+            ids = np.concatenate([self.tokens.ids, added.ids])
+            offsets = np.concatenate([self.tokens.offsets,
+                                      self.tokens.offsets[-1] +
+                                      added.offsets[1:]])
+            tmp_path = f'{self.path}.{os.getpid()}.tmp.npz'
+            np.savez(tmp_path, keys=keys, ids=ids, offsets=offsets)
+            os.replace(tmp_path, self.path)
+            self._load()
+
+    def encode(self, texts: Sequence[str],
+               encode_fn: Callable[[str], List[int]]) -> RaggedTokens:
+        """Token ids of `texts`, in the same order. Those that are not in
+        the store are tokenized with `encode_fn` and added to it."""
+        keys = [smiles_hash(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._rows and key not in missing:
+                missing[key] = text
+        if missing:
+            self._add(list(missing),
+                      [encode_fn(text) for text in missing.values()])
+        return self.tokens.take([self._rows[key] for key in keys])
@@ -0,0 +1,96 @@
+"""Embedding of inputs longer than the context of a language model.
+
+Instead of being truncated, an input longer than `window` units, residues
+of a sequence or atom-level tokens of a SMILES, is split into windows of
+`window` units every `stride` units, the last one ending with the input.
+The windows of all the inputs are embedded together, sorted by length so
+that batches are little padded, and the embedding of each input is the
+mean of those of its windows, weighted by their lengths. Inputs that fit
+in one window are embedded as they are.
+
+Windows of a SMILES keep bracket atoms whole, but may start or end inside
+a branch or between the two ends of a ring closure, so they are not
+always valid SMILES.
+"""
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .spe_tokenizer import ATOMWISE_REGEX
+
+
+def smiles_units(smiles: str) -> List[str]:
+    """Atom-level tokens of `smiles`: atoms, with bracket atoms whole,
+    bonds, branch parentheses and ring-closure digits, each a separate
+    unit that a window may start or end at."""
+    return ATOMWISE_REGEX.findall(smiles)
+
+
+def window_spans(length: int, window: int,
+                 stride: int) -> List[Tuple[int, int]]:
+    """Start and end of the windows that cover `length` units."""
+    if length <= window:
+        return [(0, length)]
+    spans = [(start, start + window)
+             for start in range(0, length - window + 1, stride)]
+    if spans[-1][1] < length:
+        spans.append((length - window, length))
+    return spans
+
+
+def split_windows(inputs: Sequence[str], window: int, stride: int,
+                  units: Callable[[str], List[str]] = list
+                  ) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Windows of all `inputs`, the input each comes from, and its length
+    in units."""
+    texts, owners, lengths = [], [], []
+    for idx, text in enumerate(inputs):
+        parts = units(text)
+        if len(parts) <= window:
+            # Unchanged, even if `units` does not cover all of it.
+            texts.append(text)
+            owners.append(idx)
+            lengths.append(max(len(parts), 1))
+            continue
+        for start, end in window_spans(len(parts), window, stride):
+            texts.append(''.join(parts[start:end]))
+            owners.append(idx)
+            lengths.append(end - start)
+    return (texts, np.array(owners, dtype=np.int64),
+            np.array(lengths, dtype=np.float64))
+
+
+def merge_windows(reps: Sequence[np.ndarray], owners: np.ndarray,
+                  weights: np.ndarray, n_inputs: int) -> np.ndarray:
+    """`(n_inputs, ...)` weighted mean of the representations of the
+    windows of each input."""
+    reps = np.stack([np.asarray(rep) for rep in reps])
+    flat = reps.reshape(len(reps), -1).astype(np.float64)
+    out = np.zeros((n_inputs, flat.shape[1]))
+    np.add.at(out, owners, flat * weights[:, None])
+    out /= np.bincount(owners, weights, minlength=n_inputs)[:, None]
+    return out.reshape((n_inputs,) + reps.shape[1:]).astype(np.float32)
+
+
+def embed_windows(compute: Callable[[List[str]], Sequence[np.ndarray]],
+                  inputs: Sequence[str], window: int,
+                  stride: Optional[int] = None,
+                  units: Callable[[str], List[str]] = list) -> np.ndarray:
+    """Representations of `inputs` from those that `compute` returns for
+    their windows.
+
+    :param window: Units of each window, at most the context of the model.
+    :param stride: Units between the starts of consecutive windows,
+        `window // 2` if `None`.
+    :param units: Splits an input into the units of the windows, its
+        characters by default.
+    """
+    stride = stride or max(window // 2, 1)
+    if not 0 < stride <= window:
+        raise ValueError(f'Stride {stride} must be between 1 and the window, '
+                         f'{window}.')
+    texts, owners, lengths = split_windows(inputs, window, stride, units)
+    order = np.argsort(-lengths, kind='stable')
+    reps = compute([texts[idx] for idx in order])
+    reps = [reps[pos] for pos in np.argsort(order)]
+    return merge_windows(reps, owners, lengths, len(inputs))
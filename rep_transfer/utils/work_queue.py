@@ -0,0 +1,204 @@
+"""Work queue on a shared filesystem, without a scheduler or a broker.
+
+Jobs are JSON files that move between the directories of the queue by
+atomic renames, which is safe on NFS:
+
+    pending/<priority>_<name>.json          waiting to be run
+    leased/<priority>_<name>@<worker>.json  claimed by a worker
+    done/<priority>_<name>.json             finished
+    failed/<priority>_<name>.json           failed `max_attempts` times
+
+A worker claims a job by renaming it into `leased/` under its own name, so
+only one of the workers that try at the same time succeeds. While the job
+runs, the worker touches the leased file every few seconds. Leases that
+have not been touched for `lease` seconds, e.g., because the node died, are
+moved back to `pending/` by any worker. A worker whose lease expired finds
+its file gone when it tries to complete the job.
+"""
+import json
+import os
+import os.path as osp
+import threading
+import time
+import traceback
+
+from typing import Dict, List, Optional
+
+
+STATES = ['pending', 'leased', 'done', 'failed']
+
+
+def _read(path: str) -> dict:
+    with open(path) as fi:
+        return json.load(fi)
+
+
+def _write(path: str, job: dict):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as fo:
+        json.dump(job, fo)
+    os.replace(tmp_path, path)
+
+
+def _job_file(filename: str) -> str:
+    """File name of a job in `pending/`, `done/` or `failed/`."""
+    return f"{filename[:-len('.json')].split('@')[0]}.json"
+
+
+class Lease:
+    """A job claimed by a worker. `complete` and `fail` return `False` if
+    the lease had expired and the job was handed to another worker."""
+    def __init__(self, queue: 'WorkQueue', path: str, job: dict):
+        self.queue = queue
+        self.path = path
+        self.job = job
+        self.filename = _job_file(osp.basename(path))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def heartbeat(self) -> bool:
+        try:
+            os.utime(self.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def start_heartbeat(self, interval: float = 60.):
+        def beat():
+            while not self._stop.wait(interval):
+                if not self.heartbeat():
+                    print(f'Warning: lease of {self.filename} was lost.')
+                    return
+        self._thread = threading.Thread(target=beat, daemon=True)
+        self._thread.start()
+
+    def _stop_heartbeat(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _move(self, state: str) -> bool:
+        self._stop_heartbeat()
+        # A last heartbeat checks that the lease is still ours and keeps it
+        # from expiring while the job is updated.
+        if not self.heartbeat():
+            return False
+        # The job is moved out of the way before it is updated, so that a
+        # lease that expires in between is not written back to `leased/`
+        # while another worker runs it from `pending/`.
+        moving = f"{self.path[:-len('.json')]}.moving.json"
+        try:
+            os.rename(self.path, moving)
+            _write(moving, self.job)
+            os.rename(moving, self.queue.path(state, self.filename))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self) -> bool:
+        self.job.pop('error', None)
+        return self._move('done')
+
+    def fail(self, error: str) -> bool:
+        """Returns the job to `pending/`, or moves it to `failed/` once it
+        has been attempted `max_attempts` times."""
+        self.job['error'] = error
+        if self.job['attempts'] >= self.queue.max_attempts:
+            return self._move('failed')
+        return self._move('pending')
+
+
+class WorkQueue:
+    """Queue of JSON jobs in `root`, which all the workers must share.
+
+    :param lease: Seconds without a heartbeat after which a leased job is
+        handed to another worker.
+    :param max_attempts: Times a job is run before it is considered failed.
+    """
+    def __init__(self, root: str, lease: float = 900.,
+                 max_attempts: int = 3):
+        self.root = root
+        self.lease = lease
+        self.max_attempts = max_attempts
+        for state in STATES:
+            os.makedirs(self.path(state), exist_ok=True)
+
+    def path(self, state: str, filename: str = '') -> str:
+        return osp.join(self.root, state, filename)
+
+    def list(self, state: str) -> List[str]:
+        return sorted(f for f in os.listdir(self.path(state))
+                      if f.endswith('.json'))
+
+    def submit(self, jobs: List[dict], names: List[str]) -> int:
+        """Adds the jobs, in order of priority, that are not already
+        pending, leased or failed. Returns the number of jobs added."""
+        known = set(_job_file(f)[:-len('.json')].split('_', 1)[1]
+                    for state in ['pending', 'leased', 'failed']
+                    for f in self.list(state))
+        offset = len(self.list('pending')) + len(self.list('leased'))
+        added = 0
+        for job, name in zip(jobs, names):
+            if name in known:
+                continue
+            job = dict(job, name=name, attempts=0)
+            _write(self.path('pending', f'{offset + added:07d}_{name}.json'),
+                   job)
+            added += 1
+        return added
+
+    def requeue_expired(self) -> int:
+        requeued = 0
+        now = time.time()
+        for filename in self.list('leased'):
+            path = self.path('leased', filename)
+            try:
+                expired = now - os.stat(path).st_mtime > self.lease
+                if expired:
+                    os.rename(path, self.path('pending', _job_file(filename)))
+                    requeued += 1
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def claim(self, worker: str) -> Optional[Lease]:
+        """Leases the pending job with the highest priority, or returns
+        `None` if there are none."""
+        self.requeue_expired()
+        for filename in self.list('pending'):
+            path = self.path('leased', f'{filename[:-5]}@{worker}.json')
+            try:
+                os.rename(self.path('pending', filename), path)
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            try:
+                job = _read(path)
+                job['attempts'] = job.get('attempts', 0) + 1
+                job['worker'] = worker
+                _write(path, job)
+            except FileNotFoundError:
+                return None
+            return Lease(self, path, job)
+        return None
+
+    def retry_failed(self) -> int:
+        retried = 0
+        for filename in self.list('failed'):
+            path = self.path('failed', filename)
+            job = _read(path)
+            job['attempts'] = 0
+            _write(path, job)
+            os.rename(path, self.path('pending', filename))
+            retried += 1
+        return retried
+
+    def counts(self) -> Dict[str, int]:
+        return {state: len(self.list(state)) for state in STATES}
+
+    def failed(self) -> List[dict]:
+        return [_read(self.path('failed', f)) for f in self.list('failed')]
+
+
+def format_exception(e: BaseException) -> str:
+    return ''.join(traceback.format_exception(type(e), e, e.__traceback__))